@@ -2,14 +2,84 @@
 db — 資料庫 CRUD 操作模組
 """
 
+from .connection import (                 # noqa: F401
+    connect,
+    shared_connection,
+    get_connection,
+    close_connection,
+    read_transaction,
+    export_snapshot,
+)
+from .meta import (                       # noqa: F401
+    commit_versioned,
+    get_data_version,
+    get_db_id,
+)
 from .crud import (                       # noqa: F401
+    upsert_ticker,
     get_db_tickers,
+    get_history_watermark,
+    get_latest_period_ends,
+    load_stored_quarters,
+    load_all_stored_quarters,
+    archive_ticker,
+    get_archived_tickers,
     remove_ticker_from_db,
+    purge_archived_tickers,
     save_to_fundamentals_history,
 )
+from .maintenance import (                # noqa: F401
+    compact_database,
+    reclaim_space,
+)
+from .partitions import (                 # noqa: F401
+    list_archives,
+    history_partitions,
+    open_partitions,
+    archive_closed_years,
+    restate_archives,
+)
+from .sink import (                       # noqa: F401
+    WriteSink,
+    SinkError,
+    use_sink,
+    write_rows,
+    run_write,
+    end_ticker,
+)
 
 __all__ = [
+    'connect',
+    'shared_connection',
+    'get_connection',
+    'close_connection',
+    'read_transaction',
+    'export_snapshot',
+    'commit_versioned',
+    'get_data_version',
+    'get_db_id',
+    'upsert_ticker',
     'get_db_tickers',
+    'get_history_watermark',
+    'get_latest_period_ends',
+    'load_stored_quarters',
+    'load_all_stored_quarters',
+    'archive_ticker',
+    'get_archived_tickers',
     'remove_ticker_from_db',
+    'purge_archived_tickers',
     'save_to_fundamentals_history',
+    'compact_database',
+    'reclaim_space',
+    'list_archives',
+    'history_partitions',
+    'open_partitions',
+    'archive_closed_years',
+    'restate_archives',
+    'WriteSink',
+    'SinkError',
+    'use_sink',
+    'write_rows',
+    'run_write',
+    'end_ticker',
 ]
@@ -0,0 +1,170 @@
+"""
+db.connection — 集中的 SQLite 連線工廠
+
+所有模組改由此取得連線，不再各自 sqlite3.connect(DB_PATH)：
+
+  connect     — 建立一條已套用 PRAGMA 的新連線（writer 執行緒 / 獨立 DB 使用）
+  get_connection / close_connection — 每個執行緒重用一條連線
+  shared_connection — context manager：取得本執行緒的連線，離開時回滾未 commit 的寫入
+  read_transaction — context manager：在本執行緒的連線上開一個讀交易，
+                     區塊內的 shared_connection 都讀同一版資料（匯出一致性）
+  export_snapshot — context manager：以 backup API 複製一份記憶體快照（選用，見其說明）
+
+預設路徑在呼叫時才讀 stock_config.DB_PATH，sync_portfolio --db 可在啟動後切換資料庫。
+
+PRAGMA：
+  auto_vacuum=INCREMENTAL — 只對新建的空資料庫生效；刪除後的空頁由 db.maintenance 增量回收
+  journal_mode=WAL      — 讀者不阻塞 writer，writer 也不阻塞讀者
+  synchronous=NORMAL    — WAL 下只在 checkpoint 時 fsync
+  busy_timeout          — 遇到鎖時等待而非立即 `database is locked`
+  cache_size / mmap_size / temp_store — 加大快取，讀取走記憶體映射
+  foreign_keys=ON       — 刪除 tickers 時連鎖刪除日線 / 快照 / 財報
+"""
+
+import contextlib
+import os
+import sqlite3
+import threading
+
+import stock_config
+
+BUSY_TIMEOUT_MS = 30_000
+CACHE_SIZE_KB = 64 * 1024              # 64 MB page cache（每條連線）
+MMAP_SIZE = 256 * 1024 * 1024          # 256 MB
+
+_PRAGMAS = (
+    f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}',
+    'PRAGMA synchronous = NORMAL',
+    f'PRAGMA cache_size = -{CACHE_SIZE_KB}',
+    f'PRAGMA mmap_size = {MMAP_SIZE}',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA foreign_keys = ON',
+)
+
+
+def connect(db_path=None, **kwargs):
+    """建立新的連線並套用 WAL 與效能 PRAGMA（kwargs 轉給 sqlite3.connect）。"""
+    kwargs.setdefault('timeout', BUSY_TIMEOUT_MS / 1000)
+    # 允許 ATTACH 'file:...?mode=ro'（年度歸檔以唯讀掛載，見 db.partitions）
+    kwargs.setdefault('uri', True)
+    conn = sqlite3.connect(db_path or stock_config.DB_PATH, **kwargs)
+    # auto_vacuum 必須在建立任何資料表（含寫入 WAL 檔頭）之前設定；既有資料庫上為 no-op
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    # journal_mode 寫入檔頭，之後所有連線（含舊版程式）都沿用 WAL
+    conn.execute('PRAGMA journal_mode = WAL')
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+# ─── 每執行緒連線 ────────────────────────────────────────────
+
+_local = threading.local()
+
+
+def get_connection(db_path=None):
+    """回傳本執行緒對 db_path 的共用連線（首次呼叫時建立）。"""
+    path = os.path.abspath(db_path or stock_config.DB_PATH)
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        conn = conns[path] = connect(path)
+    return conn
+
+
+def close_connection(db_path=None):
+    """關閉本執行緒的共用連線（db_path 為 None 時關閉全部）。"""
+    conns = getattr(_local, 'conns', None) or {}
+    paths = list(conns) if db_path is None else [os.path.abspath(db_path)]
+    for path in paths:
+        conn = conns.pop(path, None)
+        if conn is not None:
+            conn.close()
+
+
+@contextlib.contextmanager
+def shared_connection(db_path=None, *, row_factory=None):
+    """
+    取得本執行緒的共用連線（可巢狀使用）。
+
+    最外層區塊離開時若仍有未 commit 的寫入（例外中斷）則回滾；
+    row_factory 於離開時還原，避免影響同執行緒的其他使用者。
+    """
+    conn = get_connection(db_path)
+    depth = getattr(_local, 'depth', None)
+    if depth is None:
+        depth = _local.depth = {}
+    depth[conn] = depth.get(conn, 0) + 1
+    previous = conn.row_factory
+    if row_factory is not None:
+        conn.row_factory = row_factory
+    try:
+        yield conn
+    finally:
+        conn.row_factory = previous
+        depth[conn] -= 1
+        if not depth[conn]:
+            del depth[conn]
+            if conn.in_transaction:
+                conn.rollback()
+
+
+# ─── 匯出快照 ────────────────────────────────────────────────
+
+@contextlib.contextmanager
+def read_transaction(db_path=None):
+    """
+    在本執行緒對 db_path 的共用連線上 BEGIN 一個讀交易，區塊內的
+    shared_connection / get_connection 都讀交易開始時的同一版資料，多個 exporter 一致。
+
+    WAL 下讀交易只固定一個 snapshot、不複製任何資料，記憶體用量與資料庫大小無關；
+    writer 照常 commit（區塊內看不到），但 checkpoint 無法越過這個 snapshot，
+    匯出期間 WAL 檔會變大。區塊內不可 commit；離開時 ROLLBACK（沒有寫入可回滾）。
+
+    Yields:
+        sqlite3.Connection: 本執行緒的共用連線
+    """
+    with shared_connection(db_path) as conn:
+        if conn.in_transaction:
+            raise RuntimeError('read_transaction：連線上仍有未 commit 的寫入')
+        conn.execute('BEGIN')
+        try:
+            # WAL 的 snapshot 在第一次讀取時才建立：立即讀一次，固定在 BEGIN 當下的版本
+            conn.execute('SELECT COUNT(*) FROM main.sqlite_master').fetchone()
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+
+
+@contextlib.contextmanager
+def export_snapshot(db_path=None):
+    """
+    以 sqlite3 backup API 把資料庫一次複製到記憶體，區塊內本執行緒對 db_path 的
+    shared_connection / get_connection 都改讀這份快照，多個 exporter 看到同一版資料。
+
+    選用：峰值記憶體等於整個熱資料庫，匯出預設改用 read_transaction。
+    只在匯出很久、又不希望 WAL 在期間無法 checkpoint 時使用
+    （複製完即釋放讀交易；sync_portfolio.regenerate_json(in_memory=True)）。
+    年度歸檔本身唯讀，仍照常開啟。
+
+    Yields:
+        sqlite3.Connection: 記憶體快照連線
+    """
+    path = os.path.abspath(db_path or stock_config.DB_PATH)
+    source = get_connection(path)
+    snapshot = sqlite3.connect(':memory:', uri=True)
+    try:
+        source.backup(snapshot)
+        snapshot.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KB}')
+        conns = _local.conns
+        previous = conns[path]
+        conns[path] = snapshot
+        try:
+            yield snapshot
+        finally:
+            conns[path] = previous
+    finally:
+        snapshot.close()
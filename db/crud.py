@@ -2,56 +2,307 @@
 db.crud — 資料庫查詢 / 新增 / 刪除操作
 
 提供：
-  get_db_tickers       — 取得 DB 中所有 ticker 集合
-  remove_ticker_from_db — 刪除指定 ticker 的全部資料
+  upsert_ticker        — 登錄 ticker（tickers 維度表），可更新名稱 / 產業；
+                         財報寫入前也須先登錄（外鍵）
+  get_db_tickers       — 取得 DB 中有資料的 ticker 集合（走 tickers 維度表）
+  get_history_watermark — 取得 ticker 在 price_bars 中最新的成功交易日
+  get_latest_period_ends — 取得各 ticker 在 fundamentals_history 中最新的季度
+  load_stored_quarters  — 從 fundamentals_history 還原季報 list 與股利
+  load_all_stored_quarters — 一次還原全部 ticker 的季報（批次修正用）
+  archive_ticker       — 封存指定 ticker（資料保留，排除於 diff / 匯出）
+  get_archived_tickers — 取得已封存的 ticker
+  remove_ticker_from_db — 刪除指定 ticker 的全部資料（外鍵連鎖刪除）
+  purge_archived_tickers — 刪除已封存的 ticker（含年度歸檔中的日線）並回收空間，回報回收量
   save_to_fundamentals_history — 將季報資料存入 fundamentals_history 表
 """
 
+import json
 import os
 import sqlite3
-import contextlib
 
-from stock_config import DB_PATH
+import stock_config
+from .connection import shared_connection
+from .maintenance import db_size, reclaim_space
+from .meta import commit_versioned
+from .partitions import delete_from_archives
+from .sink import write_rows
 
-# S-5: 允許查詢的表名白名單
-_VALID_TABLES = frozenset(['stock_history', 'annual_fundamentals', 'fundamentals_history'])
+# ─── tickers 維度表 ──────────────────────────────────────────
+
+# 子查詢：ticker 代碼 → tickers.id（供 price_bars / fundamental_snapshots 寫入使用）
+TICKER_ID_SQL = '(SELECT id FROM tickers WHERE ticker = ?)'
+
+
+def upsert_ticker(ticker, name=None, sector=None):
+    """登錄 ticker；name / sector 為 None 時保留既有值。已封存的 ticker 寫入新資料時自動還原。"""
+    write_rows(ticker, '''
+        INSERT INTO tickers (ticker, name, sector) VALUES (?, ?, ?)
+        ON CONFLICT(ticker) DO UPDATE SET
+            name = COALESCE(excluded.name, tickers.name),
+            sector = COALESCE(excluded.sector, tickers.sector),
+            archived_at = NULL
+    ''', [(ticker, name, sector)])
 
 
 # ─── 查詢 DB 中所有 ticker ──────────────────────────────────
 
 def get_db_tickers():
-    """回傳 DB stock_history / annual_fundamentals / fundamentals_history 中的所有 ticker 集合。"""
-    if not os.path.exists(DB_PATH):
+    """
+    回傳 DB 中有資料（日線或財報）且未封存的 ticker 集合。
+
+    只走 tickers 維度表與各表的 ticker 索引（O(#tickers)），
+    不再對 stock_history / 財報表做 DISTINCT 全表掃描；
+    僅解析過交易所、尚無資料的 ticker 不列入。
+    """
+    if not os.path.exists(stock_config.DB_PATH):
         return set()
-    with contextlib.closing(sqlite3.connect(DB_PATH)) as conn:
-        tickers = set()
-        for table in ['stock_history', 'annual_fundamentals', 'fundamentals_history']:
-            if table not in _VALID_TABLES:
-                continue
-            try:
-                rows = conn.execute(f'SELECT DISTINCT ticker FROM {table}').fetchall()
-                tickers.update(r[0] for r in rows)
-            except sqlite3.OperationalError:
-                pass
-    return tickers
+    with shared_connection() as conn:
+        try:
+            rows = conn.execute('''
+                SELECT t.ticker FROM tickers t
+                WHERE t.archived_at IS NULL AND (
+                      EXISTS (SELECT 1 FROM stock_latest l WHERE l.ticker_id = t.id)
+                   OR EXISTS (SELECT 1 FROM fundamentals_history f WHERE f.ticker = t.ticker)
+                   OR EXISTS (SELECT 1 FROM annual_fundamentals a WHERE a.ticker = t.ticker))
+            ''').fetchall()
+        except sqlite3.OperationalError:
+            return set()
+    return {r[0] for r in rows}
+
+
+# ─── 歷史走勢水位線 ─────────────────────────────────────────
 
+def get_history_watermark(ticker):
+    """
+    回傳 ticker 在 price_bars 中最新一筆成功資料的日期（'YYYY-MM-DD'），
+    無資料時回傳 None。供增量回填決定起始日期。
+    """
+    if not os.path.exists(stock_config.DB_PATH):
+        return None
+    with shared_connection() as conn:
+        row = conn.execute(
+            'SELECT latest_ok_date FROM stock_latest '
+            f'WHERE ticker_id = {TICKER_ID_SQL}',
+            (ticker,)).fetchone()
+    if not row or not row[0]:
+        return None
+    return row[0]
+
+
+# ─── 已存季報 ───────────────────────────────────────────────
+
+def get_latest_period_ends(tickers=None):
+    """
+    回傳 {ticker: 最新 period_end}（fundamentals_history）。
+
+    tickers 為 None 時列出全部未封存的 ticker；指定 tickers 時在 SQL 端過濾
+    （走 idx_fundamentals_ticker_period，只讀這幾檔），已封存的也照列
+    （從封存還原時沿用已存季報判斷是否該下載財報）。
+    """
+    if not os.path.exists(stock_config.DB_PATH):
+        return {}
+    if tickers is None:
+        sql = '''
+            SELECT f.ticker, MAX(f.period_end) FROM fundamentals_history f
+            JOIN tickers t ON t.ticker = f.ticker AND t.archived_at IS NULL
+            GROUP BY f.ticker
+        '''
+        params = ()
+    else:
+        tickers = list(tickers)
+        if not tickers:
+            return {}
+        if len(tickers) == 1:
+            where, params = 'ticker = ?', (tickers[0],)
+        else:
+            where, params = 'ticker IN (SELECT value FROM json_each(?))', (json.dumps(tickers),)
+        sql = f'''
+            SELECT ticker, MAX(period_end) FROM fundamentals_history
+            WHERE {where}
+            GROUP BY ticker
+        '''
+    with shared_connection() as conn:
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        except sqlite3.OperationalError:
+            return {}
+    return dict(rows)
+
+
+def _rows_to_quarters(rows):
+    """fundamentals_history 列 → (quarters, dividend_data)。"""
+    quarters = []
+    dividend_data = {}
+    for (period_end, fy, fq, eps, ni, rev, oi, equity, debt, assets,
+         shares, fcf_m, div) in rows:
+        quarters.append({
+            'period_end': period_end,
+            'fiscal_year': fy,
+            'fiscal_quarter': fq,
+            'basic_eps': eps or 0,
+            'net_income': ni or 0,
+            'revenue': rev or 0,
+            'operating_income': oi or 0,
+            'equity': equity or 0,
+            'total_debt': debt or 0,
+            'total_assets': assets or 0,
+            'shares': shares or 0,
+            'fcf': (fcf_m or 0) * 1_000_000,    # fundamentals_history 以百萬存放
+        })
+        if div:
+            dividend_data[fy] = div
+    return quarters, dividend_data
+
+
+_QUARTER_COLUMNS = '''period_end, fiscal_year, fiscal_quarter, eps, net_income, revenue,
+                   operating_income, equity, total_debt, total_assets,
+                   shares_outstanding, fcf, dividend_per_share'''
+
+
+def load_stored_quarters(ticker_code, conn=None):
+    """
+    從 fundamentals_history 還原 save_quarterly_and_fix 所用的季報格式，
+    不需連網即可重建快照。
+
+    Args:
+        ticker_code: 台股代碼
+        conn: 讀取用的連線（None = 本執行緒的共用連線）；傳入 sink 的寫入連線時
+              可讀到同一交易內尚未 commit 的季報
+
+    Returns:
+        tuple: (quarters, dividend_data)
+            quarters      — list[dict]，欄位同 fetchers.fundamentals._extract_quarters
+            dividend_data — dict，key=年度, value=每股股利
+    """
+    if conn is None:
+        with shared_connection() as conn:
+            return load_stored_quarters(ticker_code, conn)
+    rows = conn.execute(f'''
+        SELECT {_QUARTER_COLUMNS}
+        FROM fundamentals_history
+        WHERE ticker = ?
+        ORDER BY period_end
+    ''', (ticker_code,)).fetchall()
+    return _rows_to_quarters(rows)
+
+
+def load_all_stored_quarters(tickers=None):
+    """
+    一次讀出全部（或指定 tickers）的已存季報，供批次修正使用。
+
+    Returns:
+        dict: {ticker: (quarters, dividend_data)}，格式同 load_stored_quarters
+    """
+    if not os.path.exists(stock_config.DB_PATH):
+        return {}
+    # 指定 tickers 時在 SQL 端過濾（走 idx_fundamentals_ticker_period），
+    # process pool 的每批只讀自己那幾檔
+    where, params = '', ()
+    if tickers is not None:
+        where = 'WHERE ticker IN (SELECT value FROM json_each(?))'
+        params = (json.dumps(list(tickers)),)
+    with shared_connection() as conn:
+        rows = conn.execute(f'''
+            SELECT ticker, {_QUARTER_COLUMNS}
+            FROM fundamentals_history
+            {where}
+            ORDER BY ticker, period_end
+        ''', params).fetchall()
+    by_ticker = {}
+    for row in rows:
+        by_ticker.setdefault(row[0], []).append(row[1:])
+    return {t: _rows_to_quarters(r) for t, r in by_ticker.items()}
+
+
+# ─── 封存 / 刪除指定 ticker ──────────────────────────────────
+
+# 指定 ticker 的日線 + 快照 + 財報筆數
+_TICKER_ROWS_SQL = '''
+    SELECT t.id,
+           (SELECT COUNT(*) FROM price_bars WHERE ticker_id = t.id)
+         + (SELECT COUNT(*) FROM fundamental_snapshots WHERE ticker_id = t.id)
+         + (SELECT COUNT(*) FROM annual_fundamentals WHERE ticker = t.ticker)
+         + (SELECT COUNT(*) FROM fundamentals_history WHERE ticker = t.ticker)
+    FROM tickers t WHERE t.ticker = ?
+'''
+
+
+def archive_ticker(ticker):
+    """
+    封存指定 ticker：資料全數保留，但不再列入 get_db_tickers 與匯出。
+    之後重新加入時只需補抓封存後的缺口（水位線不變）。
+
+    Returns:
+        int | None: 保留的資料筆數；ticker 不在 DB 中時為 None
+    """
+    with shared_connection() as conn:
+        row = conn.execute(_TICKER_ROWS_SQL, (ticker,)).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            'UPDATE tickers SET archived_at = CURRENT_TIMESTAMP '
+            'WHERE id = ? AND archived_at IS NULL', (row[0],))
+        commit_versioned(conn)
+    return row[1]
+
+
+def get_archived_tickers():
+    """回傳 {ticker: archived_at}（已封存的 ticker）。"""
+    if not os.path.exists(stock_config.DB_PATH):
+        return {}
+    with shared_connection() as conn:
+        try:
+            rows = conn.execute(
+                'SELECT ticker, archived_at FROM tickers WHERE archived_at IS NOT NULL'
+            ).fetchall()
+        except sqlite3.OperationalError:
+            return {}
+    return dict(rows)
 
-# ─── 刪除指定 ticker ─────────────────────────────────────────
 
 def remove_ticker_from_db(ticker):
-    """從 stock_history / annual_fundamentals / fundamentals_history 中移除指定 ticker。"""
-    with contextlib.closing(sqlite3.connect(DB_PATH)) as conn:
-        total = 0
-        for table in ['stock_history', 'annual_fundamentals', 'fundamentals_history']:
-            if table not in _VALID_TABLES:
-                continue
-            try:
-                cursor = conn.execute(f'DELETE FROM {table} WHERE ticker = ?', (ticker,))
-                total += cursor.rowcount
-            except sqlite3.OperationalError:
-                pass
-        conn.commit()
-    return total
+    """
+    刪除 tickers 中的指定 ticker；日線 / 快照 / 指紋 / 財報由外鍵 ON DELETE CASCADE
+    在同一交易內連鎖刪除（stock_latest 由日線的刪除 trigger 清除）。
+
+    Returns:
+        int: 刪除的日線 + 快照 + 財報筆數
+    """
+    with shared_connection() as conn:
+        row = conn.execute(_TICKER_ROWS_SQL, (ticker,)).fetchone()
+        if row is None:
+            return 0
+        conn.execute('DELETE FROM tickers WHERE id = ?', (row[0],))
+        commit_versioned(conn)
+    return row[1]
+
+
+def purge_archived_tickers(tickers=None):
+    """
+    真正刪除已封存的 ticker（可限定 tickers），再回收空間（db.maintenance.reclaim_space）。
+
+    年度歸檔（db.partitions）中的日線先刪：熱資料庫的 ticker 刪除後就無從得知
+    哪些代碼已封存，中途失敗時重跑仍能補刪歸檔。
+
+    Returns:
+        dict: {'tickers': [...], 'rows': 刪除筆數（含歸檔）,
+               'archives': {年度: 歸檔刪除筆數},
+               'bytes_before': ..., 'bytes_after': ...}（熱資料庫 + 歸檔合計）
+    """
+    archived = sorted(get_archived_tickers())
+    if tickers is not None:
+        wanted = set(tickers)
+        archived = [t for t in archived if t in wanted]
+    purged = delete_from_archives(archived)
+    with shared_connection() as conn:
+        before = db_size(conn) + purged['bytes_before']
+        rows = sum(remove_ticker_from_db(t) for t in archived)
+        if archived:
+            reclaim_space(conn)
+        after = db_size(conn) + purged['bytes_after']
+    rows += sum(purged['years'].values())
+    return {'tickers': archived, 'rows': rows, 'archives': purged['years'],
+            'bytes_before': before, 'bytes_after': after}
 
 
 # ─── 存入 fundamentals_history ────────────────────────────────
@@ -66,45 +317,39 @@ def save_to_fundamentals_history(ticker_code, quarters, dividend_data):
         dividend_data: dict，key=年度, value=每股股利
 
     Returns:
-        int: 成功插入的筆數
-    """
-    with contextlib.closing(sqlite3.connect(DB_PATH)) as conn:
-        cursor = conn.cursor()
-
-        inserted = 0
-        for q in quarters:
-            bvps = q['equity'] / q['shares'] if q['shares'] > 0 else 0
-            div = dividend_data.get(q['fiscal_year'], 0)
-
-            # 計算單季年化 ROE
-            quarterly_roe = (q['net_income'] * 4 / q['equity'] * 100) if q['equity'] > 0 else 0
-
-            try:
-                cursor.execute('''
-                INSERT OR REPLACE INTO fundamentals_history
-                (ticker, period_end, fiscal_year, fiscal_quarter, eps, net_income,
-                 revenue, operating_income, equity, total_debt, total_assets,
-                 shares_outstanding, bvps, roe, fcf, dividend_per_share, source)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    ticker_code, q['period_end'], q['fiscal_year'], q['fiscal_quarter'],
-                    round(q['basic_eps'], 2),
-                    round(q['net_income'], 0),
-                    round(q['revenue'], 0),
-                    round(q['operating_income'], 0),
-                    round(q['equity'], 0),
-                    round(q['total_debt'], 0),
-                    round(q['total_assets'], 0),
-                    round(q['shares'], 0),
-                    round(bvps, 2),
-                    round(quarterly_roe, 2),
-                    round(q['fcf'] / 1_000_000, 2),
-                    div,
-                    'yfinance'
-                ))
-                inserted += 1
-            except Exception as e:
-                print(f"    ❌ 插入 {q['period_end']} 失敗: {e}")
-
-        conn.commit()
-    return inserted
+        int: 送出寫入的筆數
+    """
+    rows = []
+    for q in quarters:
+        bvps = q['equity'] / q['shares'] if q['shares'] > 0 else 0
+        div = dividend_data.get(q['fiscal_year'], 0)
+
+        # 計算單季年化 ROE
+        quarterly_roe = (q['net_income'] * 4 / q['equity'] * 100) if q['equity'] > 0 else 0
+
+        rows.append((
+            ticker_code, q['period_end'], q['fiscal_year'], q['fiscal_quarter'],
+            round(q['basic_eps'], 2),
+            round(q['net_income'], 0),
+            round(q['revenue'], 0),
+            round(q['operating_income'], 0),
+            round(q['equity'], 0),
+            round(q['total_debt'], 0),
+            round(q['total_assets'], 0),
+            round(q['shares'], 0),
+            round(bvps, 2),
+            round(quarterly_roe, 2),
+            round(q['fcf'] / 1_000_000, 2),
+            div,
+            'yfinance'
+        ))
+
+    upsert_ticker(ticker_code)
+    write_rows(ticker_code, '''
+    INSERT OR REPLACE INTO fundamentals_history
+    (ticker, period_end, fiscal_year, fiscal_quarter, eps, net_income,
+     revenue, operating_income, equity, total_debt, total_assets,
+     shares_outstanding, bvps, roe, fcf, dividend_per_share, source)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    return len(rows)
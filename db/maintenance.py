@@ -0,0 +1,161 @@
+"""
+db.maintenance — 資料庫壓實與空間回收
+
+  compact_database — 合併重複快照、刪除孤兒快照、套用日線保留政策，再回收空間
+  reclaim_space    — 以 incremental_vacuum 歸還空頁（首次會切換 auto_vacuum 並完整 VACUUM 一次）
+  db_size          — 目前資料庫檔案大小（page_count × page_size）
+
+同日多次同步本來就由 price_bars 主鍵 upsert 收斂為一筆（最新報價勝出），
+這裡處理的是長期累積：每日一筆的 quote 快照，以及多年份的日線。
+"""
+
+from datetime import date
+
+from .connection import shared_connection
+from .meta import commit_versioned
+
+# auto_vacuum 模式代碼（PRAGMA auto_vacuum 回傳值）
+_AUTO_VACUUM_INCREMENTAL = 2
+
+# 內容相同的 quote / legacy 快照：各組保留 available_from 最新的一筆，其餘標記待合併
+_DUPLICATE_SNAPSHOTS_SQL = (
+    'DROP TABLE IF EXISTS temp._compact_dups',
+    'CREATE TEMP TABLE _compact_dups (id INTEGER PRIMARY KEY, keep_id INTEGER NOT NULL)',
+    '''
+    INSERT INTO _compact_dups (id, keep_id)
+    SELECT id, keep_id FROM (
+        SELECT id, FIRST_VALUE(id) OVER (
+                   PARTITION BY ticker_id, kind, period_end, eps, roe, debt_to_equity,
+                                current_ratio, fcf, bvps, growth_rate, dividend
+                   ORDER BY available_from DESC) AS keep_id
+        FROM fundamental_snapshots
+        WHERE kind != 'quarter'
+    ) WHERE id != keep_id
+    ''',
+)
+
+# 日線改指向保留的快照（掃描 price_bars 一次，以 _compact_dups 主鍵查找）
+_REPOINT_BARS_SQL = '''
+UPDATE price_bars SET snapshot_id = d.keep_id
+FROM _compact_dups AS d
+WHERE price_bars.snapshot_id = d.id
+'''
+
+_DROP_DUPLICATES_SQL = '''
+DELETE FROM fundamental_snapshots WHERE id IN (SELECT id FROM _compact_dups)
+'''
+
+# 沒有日線指向的 quote / legacy 快照；每檔各 kind 最新的一筆保留
+# （當日報價寫入與 restatement 的流動比率補值都會查它）。
+# 季報快照由 restatement 維護（指紋涵蓋整份清單），這裡不動。
+_DROP_ORPHANS_SQL = '''
+DELETE FROM fundamental_snapshots
+WHERE kind != 'quarter'
+  AND id NOT IN (SELECT snapshot_id FROM price_bars WHERE snapshot_id IS NOT NULL)
+  AND id NOT IN (
+      SELECT (SELECT s.id FROM fundamental_snapshots s
+              WHERE s.ticker_id = k.ticker_id AND s.kind = k.kind
+              ORDER BY s.available_from DESC LIMIT 1)
+      FROM (SELECT DISTINCT ticker_id, kind FROM fundamental_snapshots
+            WHERE kind != 'quarter') AS k)
+'''
+
+# 早於 cutoff 的日線降為週線：每檔每週只留該週最後一個交易日
+_WEEKLY_RETENTION_SQL = '''
+DELETE FROM price_bars
+WHERE trade_date < :cutoff
+  AND (ticker_id, trade_date) NOT IN (
+      SELECT ticker_id, MAX(trade_date) FROM price_bars
+      WHERE trade_date < :cutoff
+      GROUP BY ticker_id, strftime('%Y-%W', trade_date))
+'''
+
+
+def db_size(conn):
+    """目前資料庫大小（bytes）。"""
+    return conn.execute(
+        'SELECT page_count * page_size FROM pragma_page_count(), pragma_page_size()'
+    ).fetchone()[0]
+
+
+def reclaim_space(conn):
+    """
+    把空頁歸還檔案系統。
+
+    新資料庫在 connect() 時即為 auto_vacuum=INCREMENTAL，只需 incremental_vacuum；
+    舊資料庫（auto_vacuum=NONE）第一次會切換模式並完整 VACUUM，之後都走增量。
+    呼叫前需已 commit（VACUUM 不能在交易中執行）。
+
+    Returns:
+        bool: 是否執行了完整 VACUUM
+    """
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != _AUTO_VACUUM_INCREMENTAL:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        return True
+    # incremental_vacuum 每 step 釋放一頁並回傳一列「零欄位」結果，
+    # execute() 只會 step 一次；executescript 會執行到完成（此時已無未 commit 的交易）
+    conn.executescript('PRAGMA incremental_vacuum')
+    return False
+
+
+def _drop_orphan_snapshots(conn):
+    """刪除沒有日線指向的 quote / legacy 快照（不 commit），回傳筆數。"""
+    return conn.execute(_DROP_ORPHANS_SQL).rowcount
+
+
+def _years_ago(years, today=None):
+    today = today or date.today()
+    try:
+        return today.replace(year=today.year - years)
+    except ValueError:                          # 2/29 → 2/28
+        return today.replace(year=today.year - years, day=28)
+
+
+def compact_database(keep_daily_years=None, db_path=None):
+    """
+    壓實資料庫：
+
+      1. 內容相同的 quote / legacy 快照合併為一筆（日線改指向保留的那筆）
+      2. 刪除沒有日線指向的孤兒 quote / legacy 快照
+      3. keep_daily_years 不為 None 時，早於 N 年前的日線只保留每週最後一個交易日
+      4. incremental_vacuum 回收空間
+
+    Returns:
+        dict: {'duplicates', 'orphans', 'bars', 'rows', 'cutoff',
+               'bytes_before', 'bytes_after', 'full_vacuum'}
+    """
+    cutoff = None
+    if keep_daily_years is not None:
+        cutoff = _years_ago(keep_daily_years).isoformat()
+
+    with shared_connection(db_path) as conn:
+        before = db_size(conn)
+
+        for sql in _DUPLICATE_SNAPSHOTS_SQL:
+            conn.execute(sql)
+        conn.execute(_REPOINT_BARS_SQL)
+        duplicates = conn.execute(_DROP_DUPLICATES_SQL).rowcount
+        conn.execute('DROP TABLE temp._compact_dups')
+
+        bars = 0
+        if cutoff is not None:
+            bars = conn.execute(_WEEKLY_RETENTION_SQL, {'cutoff': cutoff}).rowcount
+
+        # 週線化後不再被指向的快照一併清掉
+        orphans = _drop_orphan_snapshots(conn)
+        commit_versioned(conn)
+
+        full_vacuum = reclaim_space(conn)
+        after = db_size(conn)
+
+    return {
+        'duplicates': duplicates,
+        'orphans': orphans,
+        'bars': bars,
+        'rows': duplicates + orphans + bars,
+        'cutoff': cutoff,
+        'bytes_before': before,
+        'bytes_after': after,
+        'full_vacuum': full_vacuum,
+    }
@@ -0,0 +1,52 @@
+"""
+db.meta — 資料版本計數（db_meta.data_version）
+
+每次有寫入的 commit 先把 data_version +1（與資料同一交易），
+匯出時把快照所見的版本寫進 JSON metadata，可確認 stock_data.json 與
+history_all.json 出自同一版資料。
+
+  commit_versioned — 本交易有寫入時遞增 data_version 後 commit
+  get_data_version — 讀取目前連線（或匯出快照）所見的 data_version
+  get_db_id        — 建立資料庫時產生的隨機識別碼（重建的 DB 不會沿用舊快取）
+"""
+
+import sqlite3
+
+from .connection import shared_connection
+
+DATA_VERSION_KEY = 'data_version'
+DB_ID_KEY = 'db_id'
+
+
+def commit_versioned(conn):
+    """commit；若有未 commit 的寫入，先在同一交易內遞增 data_version。"""
+    if conn.in_transaction:
+        conn.execute('UPDATE main.db_meta SET value = value + 1 WHERE key = ?',
+                     (DATA_VERSION_KEY,))
+    conn.commit()
+
+
+def get_data_version(conn=None):
+    """目前的 data_version（db_meta 尚未建立時回傳 None）。"""
+    if conn is None:
+        with shared_connection() as conn:
+            return get_data_version(conn)
+    try:
+        row = conn.execute('SELECT value FROM main.db_meta WHERE key = ?',
+                           (DATA_VERSION_KEY,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def get_db_id(conn=None):
+    """資料庫識別碼（db_meta 尚未建立或沒有 db_id 時回傳 None）。"""
+    if conn is None:
+        with shared_connection() as conn:
+            return get_db_id(conn)
+    try:
+        row = conn.execute('SELECT value FROM main.db_meta WHERE key = ?',
+                           (DB_ID_KEY,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
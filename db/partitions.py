@@ -0,0 +1,330 @@
+"""
+db.partitions — 依年度切分的唯讀歸檔資料庫
+
+熱資料庫（DB_PATH）只保留近期日線；已結束的年度由 archive_closed_years 搬到
+ARCHIVE_DIR/stock_history_{年}.db。歸檔 DB 內有一張與 stock_history view
+同名、同欄位（去掉 name / sector / ticker_id / snapshot_id）的實體表，
+基本面依歸檔當時的修正結果攤平。季報快照仍留在熱資料庫，
+--restate 以 restate_archives 用同一套公式（stock_config.HISTORY_METRICS_SQL）
+改寫歸檔，REPORT_DELAY_DAYS 或快照公式調整後歸檔年度也會跟著修正。
+
+查詢端以 history_partitions 逐一取得涵蓋日期區間的 schema：
+歸檔在需要時才以唯讀 ATTACH、用完立即 DETACH（不受 SQLITE_MAX_ATTACHED 限制），
+同一段 SQL 對 '{schema}.stock_history' 執行即可跨分區：
+
+    with contextlib.closing(history_partitions(conn, since='2020-01-01')) as parts:
+        for schema in parts:
+            conn.execute(f'SELECT ... FROM {schema}.stock_history WHERE ...').fetchall()
+
+ticker 名稱 / 產業 / 封存狀態一律以 main.tickers 為準（以 ticker 文字 JOIN）。
+
+需要同時讀多個分區（依 ticker 合併串流）時改用 open_partitions：
+各年度歸檔各開一條唯讀連線，而非同時 ATTACH。
+"""
+
+import contextlib
+import json
+import os
+import pathlib
+import re
+import sqlite3
+from datetime import date
+
+import stock_config
+from stock_config import ARCHIVE_DIR, HISTORY_METRICS_SQL, HOT_YEARS
+from .connection import shared_connection
+from .maintenance import db_size, reclaim_space, _drop_orphan_snapshots
+from .meta import commit_versioned
+
+# 各分區共通的 stock_history 欄位（熱資料庫的 view 另有 name / sector / ticker_id）
+HISTORY_COLUMNS = (
+    'ticker', 'trade_date', 'price', 'eps', 'pe', 'pb', 'roe', 'dividend_yield',
+    'debt_to_equity', 'current_ratio', 'fcf', 'bvps', 'growth_rate',
+    'fetch_error', 'fetch_time',
+)
+
+_ARCHIVE_FILE = re.compile(r'^stock_history_(\d{4})\.db$')
+
+_ARCHIVE_SCHEMA_SQL = '''
+CREATE TABLE IF NOT EXISTS {schema}.stock_history (
+    ticker TEXT NOT NULL,
+    trade_date TEXT NOT NULL,
+    price REAL,
+    eps REAL,
+    pe REAL,
+    pb REAL,
+    roe REAL,
+    dividend_yield REAL,
+    debt_to_equity REAL,
+    current_ratio REAL,
+    fcf REAL,
+    bvps REAL,
+    growth_rate REAL,
+    fetch_error INTEGER NOT NULL DEFAULT 0,
+    fetch_time TEXT,
+    PRIMARY KEY (ticker, trade_date)
+) WITHOUT ROWID
+'''
+
+# 每檔最新的日線（stock_latest 的 latest_date / latest_ok_date）留在熱資料庫，
+# 最新資料查詢與回填水位線都只需看熱資料庫
+_MOVABLE_SQL = '''
+    trade_date >= :start AND trade_date < :end
+    AND NOT EXISTS (
+        SELECT 1 FROM main.stock_latest l
+        WHERE l.ticker_id = {alias}.ticker_id
+          AND {alias}.trade_date IN (l.latest_date, l.latest_ok_date))
+'''
+
+_COPY_YEAR_SQL = '''
+INSERT OR REPLACE INTO {schema}.stock_history ({columns})
+SELECT {columns} FROM main.stock_history s
+WHERE ''' + _MOVABLE_SQL.format(alias='s')
+
+_DELETE_YEAR_SQL = '''
+DELETE FROM main.price_bars AS b
+WHERE ''' + _MOVABLE_SQL.format(alias='b')
+
+# 季報快照的 as-of 區間（同 transforms.snapshots：第一季往前涵蓋更早的日線）
+_ARCHIVE_RANGES_SQL = '''
+CREATE TEMP TABLE _archive_ranges AS
+SELECT t.ticker, s.eps, s.roe, s.debt_to_equity, s.current_ratio, s.fcf, s.bvps,
+       s.growth_rate, s.dividend,
+       CASE WHEN ROW_NUMBER() OVER w = 1 THEN '' ELSE s.available_from END AS valid_from,
+       COALESCE(LEAD(s.available_from) OVER w, '9999-12-31') AS valid_to
+FROM main.fundamental_snapshots s
+INNER JOIN main.tickers t ON t.id = s.ticker_id
+WHERE s.kind = 'quarter' AND {where}
+WINDOW w AS (PARTITION BY s.ticker_id ORDER BY s.available_from)
+'''
+
+# 由區間驅動、以主鍵範圍掃描歸檔；只取代算出來與現存值不同的列
+_RESTATE_ARCHIVE_SQL = '''
+INSERT OR REPLACE INTO {schema}.stock_history ({columns})
+SELECT {columns} FROM (
+    SELECT h.ticker AS ticker, h.trade_date AS trade_date,{metrics}
+           h.fetch_error AS fetch_error, h.fetch_time AS fetch_time
+    FROM _archive_ranges r
+    CROSS JOIN {schema}.stock_history h
+        ON h.ticker = r.ticker AND h.trade_date >= r.valid_from AND h.trade_date < r.valid_to
+    WHERE h.price IS NOT NULL
+) AS x
+WHERE NOT EXISTS (
+    SELECT 1 FROM {schema}.stock_history o
+    WHERE {unchanged})
+'''
+
+
+def archive_dir(db_path=None):
+    """歸檔目錄（DB_PATH 所在目錄下的 ARCHIVE_DIR）。"""
+    db_path = db_path or stock_config.DB_PATH
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), ARCHIVE_DIR)
+
+
+def archive_path(year, db_path=None):
+    return os.path.join(archive_dir(db_path), f'stock_history_{year}.db')
+
+
+def list_archives(db_path=None):
+    """回傳 {年度: 歸檔路徑}，依年度排序。"""
+    directory = archive_dir(db_path)
+    if not os.path.isdir(directory):
+        return {}
+    found = {}
+    for name in os.listdir(directory):
+        m = _ARCHIVE_FILE.match(name)
+        if m:
+            found[int(m.group(1))] = os.path.join(directory, name)
+    return dict(sorted(found.items()))
+
+
+def hot_since(hot_years=HOT_YEARS, today=None):
+    """熱資料庫保留的第一天（此日之前的年度可歸檔）。"""
+    today = today or date.today()
+    return date(today.year - hot_years + 1, 1, 1).isoformat()
+
+
+@contextlib.contextmanager
+def attach_archive(conn, year, *, readonly=True, db_path=None):
+    """
+    ATTACH 指定年度的歸檔（預設唯讀），離開時 DETACH。
+
+    唯讀掛載以 URI mode=ro 開啟；離開前須讀完該 schema 上的所有游標。
+    """
+    path = archive_path(year, db_path)
+    schema = f'archive_{year}'
+    if readonly:
+        target = pathlib.Path(path).as_uri() + '?mode=ro'
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        target = path
+    conn.execute('ATTACH DATABASE ? AS ' + schema, (target,))
+    try:
+        if not readonly:
+            # 歸檔以 rollback journal 儲存，唯讀掛載時不需要 -wal / -shm
+            conn.execute(f'PRAGMA {schema}.journal_mode = DELETE')
+            conn.execute(_ARCHIVE_SCHEMA_SQL.format(schema=schema))
+        yield schema
+    finally:
+        conn.execute('DETACH DATABASE ' + schema)
+
+
+def _archive_years(since, until, db_path):
+    return [y for y in list_archives(db_path)
+            if (since is None or f'{y}-12-31' >= since[:10])
+            and (until is None or f'{y}-01-01' <= until[:10])]
+
+
+def history_partitions(conn, since=None, until=None, *, newest_first=False, db_path=None):
+    """
+    依序產生涵蓋 [since, until] 的分區 schema 名稱（'main' 與 'archive_{年}'）。
+
+    歸檔在輪到時才 ATTACH，換下一個分區前 DETACH；
+    提前中斷請以 contextlib.closing 包住，確保最後一個歸檔被卸載。
+    預設由舊到新（歸檔 → main），newest_first=True 時反向。
+    """
+    years = _archive_years(since, until, db_path)
+    order = ([None] + years[::-1]) if newest_first else (years + [None])
+    for year in order:
+        if year is None:
+            yield 'main'
+            continue
+        with attach_archive(conn, year, db_path=db_path) as schema:
+            yield schema
+
+
+@contextlib.contextmanager
+def open_partitions(conn, since=None, until=None, *, db_path=None):
+    """
+    同時開啟涵蓋 [since, until] 的所有分區，回傳 [(schema 名稱, 連線)]，由舊到新。
+
+    熱資料庫就是 conn；各年度歸檔各開一條唯讀連線（不受 SQLITE_MAX_ATTACHED 限制），
+    離開時關閉。每條連線上的表都在 main schema，歸檔連線看不到 main.tickers，
+    篩選 ticker 需以參數傳入。
+    """
+    parts = []
+    try:
+        for year in _archive_years(since, until, db_path):
+            target = pathlib.Path(archive_path(year, db_path)).as_uri() + '?mode=ro'
+            parts.append((f'archive_{year}', sqlite3.connect(target, uri=True)))
+        parts.append(('main', conn))
+        yield parts
+    finally:
+        for schema, part in parts:
+            if part is not conn:
+                part.close()
+
+
+def archive_closed_years(hot_years=HOT_YEARS, db_path=None):
+    """
+    把熱資料庫中早於 hot_since() 的日線依年度搬到歸檔 DB。
+
+    每個年度：先寫入歸檔並 commit，再自熱資料庫刪除並 commit
+    （熱資料庫為 WAL，跨 DB 的單一交易不保證原子性；中斷後重跑即可補齊，
+    歸檔端以主鍵 INSERT OR REPLACE 去重）。搬完後清掉不再被指向的快照並回收空間。
+
+    Returns:
+        dict: {'years': {年度: 筆數}, 'orphans': 快照筆數,
+               'bytes_before': ..., 'bytes_after': ...}
+    """
+    cutoff = hot_since(hot_years)
+    columns = ', '.join(HISTORY_COLUMNS)
+    moved = {}
+    with shared_connection(db_path) as conn:
+        before = db_size(conn)
+        years = [int(r[0]) for r in conn.execute(
+            'SELECT DISTINCT substr(trade_date, 1, 4) FROM main.price_bars '
+            'WHERE trade_date < ? ORDER BY 1', (cutoff,))]
+        if not years:
+            return {'years': moved, 'orphans': 0, 'bytes_before': before, 'bytes_after': before}
+
+        for year in years:
+            bounds = {'start': f'{year}-01-01', 'end': f'{year + 1}-01-01'}
+            with attach_archive(conn, year, readonly=False, db_path=db_path) as schema:
+                rows = conn.execute(
+                    _COPY_YEAR_SQL.format(schema=schema, columns=columns), bounds).rowcount
+                commit_versioned(conn)
+            if rows:
+                conn.execute(_DELETE_YEAR_SQL, bounds)
+                commit_versioned(conn)
+                moved[year] = rows
+
+        orphans = _drop_orphan_snapshots(conn)
+        commit_versioned(conn)
+        reclaim_space(conn)
+        after = db_size(conn)
+    return {'years': moved, 'orphans': orphans, 'bytes_before': before, 'bytes_after': after}
+
+
+def restate_archives(tickers=None, db_path=None):
+    """
+    以熱資料庫目前的季報快照改寫各年度歸檔的基本面欄位（--restate 呼叫）。
+
+    歸檔只存攤平後的指標，由 as-of 區間找出每列適用的季報快照，
+    以與 stock_history view 相同的公式重算；沒有季報快照的 ticker
+    （歸檔時指向 quote 快照）維持原值。每個年度各自 commit，中斷後重跑即可補齊。
+
+    Args:
+        tickers: 限定 ticker（None = 全部未封存的 ticker）
+
+    Returns:
+        dict: {年度: 改寫筆數}（只列有改寫的年度）
+    """
+    archives = list_archives(db_path)
+    if not archives or tickers is not None and not tickers:
+        return {}
+    if tickers is None:
+        where, params = 't.archived_at IS NULL', ()
+    else:
+        where, params = 't.ticker IN (SELECT value FROM json_each(?))', (json.dumps(sorted(tickers)),)
+    columns = ', '.join(HISTORY_COLUMNS)
+    unchanged = ' AND '.join(
+        f'o.{c} = x.{c}' if c in ('ticker', 'trade_date') else f'o.{c} IS x.{c}'
+        for c in HISTORY_COLUMNS)
+    metrics = HISTORY_METRICS_SQL.format(b='h', s='r')
+    rewritten = {}
+    with shared_connection(db_path) as conn:
+        conn.execute('DROP TABLE IF EXISTS _archive_ranges')
+        conn.execute(_ARCHIVE_RANGES_SQL.format(where=where), params)
+        try:
+            for year in archives:
+                with attach_archive(conn, year, readonly=False, db_path=db_path) as schema:
+                    rows = conn.execute(_RESTATE_ARCHIVE_SQL.format(
+                        schema=schema, columns=columns, metrics=metrics,
+                        unchanged=unchanged)).rowcount
+                    if rows:
+                        commit_versioned(conn)
+                        rewritten[year] = rows
+                    else:
+                        conn.rollback()
+        finally:
+            conn.execute('DROP TABLE _archive_ranges')
+    return rewritten
+
+
+def delete_from_archives(tickers, db_path=None):
+    """
+    自各年度歸檔刪除指定 ticker 的日線（讀寫 ATTACH），有刪除的歸檔以 VACUUM 回收空間。
+
+    每個年度各自 commit；中斷後重跑即可補齊（熱資料庫的 ticker 應在全部歸檔刪完後才刪除）。
+
+    Returns:
+        dict: {'years': {年度: 筆數}, 'bytes_before': ..., 'bytes_after': ...}（歸檔合計）
+    """
+    deleted = {}
+    before = after = 0
+    archives = list_archives(db_path) if tickers else {}
+    payload = json.dumps(sorted(tickers or ()))
+    with shared_connection(db_path) as conn:
+        for year, path in archives.items():
+            before += os.path.getsize(path)
+            with attach_archive(conn, year, readonly=False, db_path=db_path) as schema:
+                rows = conn.execute(
+                    f'DELETE FROM {schema}.stock_history '
+                    'WHERE ticker IN (SELECT value FROM json_each(?))', (payload,)).rowcount
+                commit_versioned(conn)
+                if rows:
+                    conn.execute(f'VACUUM {schema}')
+                    deleted[year] = rows
+            after += os.path.getsize(path)
+    return {'years': deleted, 'bytes_before': before, 'bytes_after': after}
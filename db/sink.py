@@ -0,0 +1,381 @@
+"""
+db.sink — 單一寫入者（write-behind）SQLite sink
+
+並行抓取時，各 fetcher 不再各自 sqlite3.connect + commit，
+而是把整批資料列交給佇列，由唯一的 writer 執行緒以 executemany 套用，
+每支（或每 N 支）ticker 只 commit 一次，避免 `database is locked` 與多次 fsync。
+
+失敗處理：每個項目在自己的 SAVEPOINT 內套用，失敗時不留下該項目的部分寫入；
+若同一交易內已有這支 ticker 先前的寫入，整個未 commit 的交易回滾，
+交易內涉及的 ticker 全部記為失敗（並行時交易可能夾雜多支 ticker）。
+失敗 ticker 之後的項目一律捨棄，直到它的 end_ticker —— end_ticker 會等 writer
+處理完並把錯誤拋回 fetcher。writer 執行緒意外中止時，等待中與之後的呼叫都會收到 SinkError。
+
+提供：
+  RowBatch    — 一批同 SQL 的資料列（executemany）
+  WriteSink   — writer 執行緒 + 佇列，含佇列深度 / commit 延遲統計
+  use_sink    — context manager：在區塊內啟用 sink
+  write_rows  — 寫入一批資料列（有 sink 時排入佇列，否則直接寫入）
+  run_write   — 在 writer 連線上執行 fn(conn)（需先讀後寫的步驟使用）
+  end_ticker  — 標記一支 ticker 的寫入結束（交易邊界），該 ticker 寫入失敗時拋出 SinkError
+  SinkError   — 寫入失敗（已回滾）或 writer 已中止
+"""
+
+import queue
+import sqlite3
+import contextlib
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Any, List, NamedTuple, Sequence
+
+import stock_config
+from .connection import connect, shared_connection
+from .meta import commit_versioned
+
+DEFAULT_QUEUE_SIZE = 1000
+_PUT_POLL_SECONDS = 0.5        # 佇列滿時檢查 writer 是否仍存活的間隔
+
+
+class SinkError(Exception):
+    """sink 寫入失敗（該 ticker 未 commit 的寫入已回滾），或 writer 執行緒已中止。"""
+
+
+class RowBatch(NamedTuple):
+    """一批資料列：同一條 SQL 以 executemany 套用。"""
+    ticker: str
+    sql: str
+    rows: List[Sequence[Any]]
+
+
+class _Call(NamedTuple):
+    ticker: str
+    fn: Any
+    future: Future
+
+
+class _TickerDone(NamedTuple):
+    ticker: str
+    future: Future
+
+
+_STOP = object()
+
+
+# ─── Writer ──────────────────────────────────────────────────
+
+class WriteSink:
+    """
+    單一 writer 執行緒的寫入佇列。
+
+    Args:
+        db_path: 資料庫路徑（預設 DB_PATH）
+        commit_every: 每完成幾支 ticker commit 一次（1 = 每支一個交易）
+        maxsize: 佇列上限（滿時 fetcher 阻塞，形成背壓）
+    """
+
+    def __init__(self, db_path=None, *, commit_every=1, maxsize=DEFAULT_QUEUE_SIZE):
+        self.db_path = db_path or stock_config.DB_PATH
+        self.commit_every = max(1, int(commit_every))
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._error = None          # writer 執行緒中止的原因
+        self._failed = {}           # 本次執行寫入失敗的 ticker → 例外（含已回滾的連帶 ticker）
+        self._broken = {}           # 已失敗、尚未 end_ticker 的 ticker：其後的項目捨棄
+        self._dirty = set()         # 目前未 commit 交易內有寫入的 ticker
+        self._open = set()          # 已送出項目、尚未 end_ticker 的 ticker
+        self._done_since_commit = 0
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'batches': 0,
+            'rows': 0,
+            'calls': 0,
+            'errors': 0,
+            'dropped': 0,
+            'tickers': 0,
+            'commits': 0,
+            'commit_seconds': 0.0,
+            'commit_max': 0.0,
+            'max_queue_depth': 0,
+        }
+
+    # ── 生命週期 ──
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        """送出停止訊號，等待佇列排空並 commit 剩餘交易。"""
+        if self._thread is not None:
+            if self._error is None:
+                self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ── 生產端 ──
+    def _check_alive(self):
+        if self._error is not None:
+            raise SinkError(f'寫入執行緒已中止: {self._error}') from self._error
+
+    def _put(self, item):
+        # 佇列滿時定期確認 writer 仍存活，writer 中止後不會永久阻塞
+        while True:
+            self._check_alive()
+            try:
+                self._queue.put(item, timeout=_PUT_POLL_SECONDS)
+                break
+            except queue.Full:
+                continue
+        if self._error is not None:
+            # writer 在放入前後中止：清空佇列的步驟可能已錯過這一項
+            self._fail_item(item, self._error)
+            self._check_alive()
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            if depth > self._stats['max_queue_depth']:
+                self._stats['max_queue_depth'] = depth
+
+    def submit_rows(self, ticker, sql, rows):
+        """排入一批資料列（不等待寫入完成）。"""
+        if rows:
+            self._put(RowBatch(ticker, sql, list(rows)))
+
+    def call(self, ticker, fn):
+        """在 writer 連線上執行 fn(conn)，回傳 Future。"""
+        future = Future()
+        self._put(_Call(ticker, fn, future))
+        return future
+
+    def ticker_done(self, ticker):
+        """標記 ticker 結束，回傳 Future（該 ticker 寫入失敗時以 SinkError 完成）。"""
+        future = Future()
+        self._put(_TickerDone(ticker, future))
+        return future
+
+    # ── 統計 ──
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def failures(self):
+        """本次執行寫入失敗（已回滾）的 ticker，依代碼排序。"""
+        return sorted(self._failed)
+
+    def stats(self):
+        with self._stats_lock:
+            s = dict(self._stats)
+        s['queue_depth'] = self.queue_depth
+        s['commit_avg'] = s['commit_seconds'] / s['commits'] if s['commits'] else 0.0
+        return s
+
+    def _bump(self, **kwargs):
+        with self._stats_lock:
+            for key, value in kwargs.items():
+                self._stats[key] += value
+
+    # ── Writer 執行緒 ──
+    @staticmethod
+    def _fail_item(item, error):
+        future = getattr(item, 'future', None)
+        if future is not None and not future.done():
+            try:
+                future.set_exception(error if isinstance(error, SinkError)
+                                     else SinkError(f'{item.ticker} 寫入失敗: {error}'))
+            except InvalidStateError:
+                pass
+
+    def _fail(self, conn, ticker, error, *, rollback_all=False):
+        """
+        ticker 寫入失敗：同一交易內已有它先前的寫入（或 rollback_all）時整個交易回滾，
+        交易內涉及的 ticker 一併記為失敗；否則只有失敗的項目本身已回滾。
+        """
+        self._bump(errors=1)
+        affected = {ticker}
+        if rollback_all or ticker in self._dirty:
+            if conn.in_transaction:
+                conn.rollback()
+            affected |= self._dirty
+            self._dirty = set()
+            self._done_since_commit = 0
+        for name in affected:
+            self._failed.setdefault(name, error)
+            if name in self._open:
+                self._broken.setdefault(name, error)
+        others = sorted(affected - {ticker})
+        print(f"    ❌ {ticker} 寫入失敗，已回滾: {error}"
+              + (f"（同一交易的 {', '.join(others)} 一併回滾）" if others else ''))
+
+    def _apply(self, conn, item):
+        """在 SAVEPOINT 內套用一個項目；失敗時只撤銷這個項目後拋出。"""
+        if not conn.in_transaction:
+            conn.execute('BEGIN')    # 讓 RELEASE 不會直接 commit 最外層 savepoint
+        conn.execute('SAVEPOINT sink_item')
+        try:
+            if isinstance(item, RowBatch):
+                result = conn.executemany(item.sql, item.rows)
+            else:
+                result = item.fn(conn)
+        except BaseException:
+            conn.execute('ROLLBACK TO sink_item')
+            conn.execute('RELEASE sink_item')
+            raise
+        conn.execute('RELEASE sink_item')
+        self._dirty.add(item.ticker)
+        return result
+
+    def _commit(self, conn):
+        self._done_since_commit = 0
+        if not self._dirty:
+            # 只有被撤銷的項目：結束空交易，不遞增 data_version
+            if conn.in_transaction:
+                conn.rollback()
+            return
+        t0 = time.perf_counter()
+        try:
+            commit_versioned(conn)
+        except sqlite3.Error as e:
+            self._fail(conn, next(iter(sorted(self._dirty))), e, rollback_all=True)
+            return
+        self._dirty = set()
+        elapsed = time.perf_counter() - t0
+        with self._stats_lock:
+            self._stats['commits'] += 1
+            self._stats['commit_seconds'] += elapsed
+            self._stats['commit_max'] = max(self._stats['commit_max'], elapsed)
+
+    def _handle(self, conn, item):
+        if isinstance(item, _TickerDone):
+            self._bump(tickers=1)
+            self._done_since_commit += 1
+            if self._done_since_commit >= self.commit_every:
+                self._commit(conn)
+            self._open.discard(item.ticker)
+            error = self._broken.pop(item.ticker, None)
+            if error is None:
+                item.future.set_result(None)
+            else:
+                self._fail_item(item, error)
+            return
+
+        self._open.add(item.ticker)
+        error = self._broken.get(item.ticker)
+        if error is not None:
+            self._bump(dropped=1)
+            self._fail_item(item, error)
+            return
+        try:
+            result = self._apply(conn, item)
+        except Exception as e:
+            self._fail(conn, item.ticker, e)
+            if isinstance(item, _Call):
+                item.future.set_exception(e)      # run_write 的呼叫端拿到原本的例外
+            return
+        if isinstance(item, RowBatch):
+            self._bump(batches=1, rows=len(item.rows))
+        else:
+            self._bump(calls=1)
+            item.future.set_result(result)
+
+    def _drain_failed(self, error):
+        """writer 中止：佇列中所有等待結果的項目以 SinkError 完成。"""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP:
+                self._fail_item(item, error)
+
+    def _run(self):
+        item = None
+        try:
+            with contextlib.closing(connect(self.db_path)) as conn:
+                while True:
+                    item = self._queue.get()
+                    if item is _STOP:
+                        break
+                    self._handle(conn, item)
+                    item = None
+                self._commit(conn)
+        except BaseException as e:
+            error = SinkError(f'寫入執行緒中止: {e}')
+            for name in self._dirty | self._open:
+                self._failed.setdefault(name, error)
+            self._error = error
+            print(f"    ❌ 寫入執行緒中止，未 commit 的寫入已捨棄: {e}")
+            if item is not None and item is not _STOP:
+                self._fail_item(item, error)
+            self._drain_failed(error)
+
+
+def format_sink_stats(stats):
+    """將 WriteSink.stats() 格式化為一行摘要。"""
+    return (f"💾 寫入 {stats['rows']} 筆 / {stats['batches']} 批，"
+            f"{stats['commits']} 次 commit（平均 {stats['commit_avg'] * 1000:.1f} ms，"
+            f"最長 {stats['commit_max'] * 1000:.1f} ms），"
+            f"佇列最深 {stats['max_queue_depth']}"
+            + (f"，錯誤 {stats['errors']}" if stats['errors'] else '')
+            + (f"，捨棄 {stats['dropped']} 項" if stats['dropped'] else ''))
+
+
+# ─── 啟用中的 sink ───────────────────────────────────────────
+
+_active_sink = None
+
+
+@contextlib.contextmanager
+def use_sink(sink):
+    """在區塊內讓 write_rows / run_write 改走指定的 sink。"""
+    global _active_sink
+    previous = _active_sink
+    _active_sink = sink
+    try:
+        yield sink
+    finally:
+        _active_sink = previous
+
+
+def write_rows(ticker, sql, rows):
+    """
+    寫入一批資料列。
+
+    Returns:
+        int | None: 直接寫入時回傳 rowcount；排入 sink 佇列時回傳 None
+    """
+    rows = list(rows)
+    if _active_sink is not None:
+        _active_sink.submit_rows(ticker, sql, rows)
+        return None
+    if not rows:
+        return 0
+    with shared_connection() as conn:
+        cursor = conn.executemany(sql, rows)
+        commit_versioned(conn)
+        return cursor.rowcount
+
+
+def run_write(ticker, fn):
+    """在寫入連線上執行 fn(conn) 並回傳結果（有 sink 時於 writer 執行緒中依序執行）。"""
+    if _active_sink is not None:
+        return _active_sink.call(ticker, fn).result()
+    with shared_connection() as conn:
+        result = fn(conn)
+        commit_versioned(conn)
+        return result
+
+
+def end_ticker(ticker):
+    """
+    標記 ticker 的寫入結束；sink 依 commit_every 決定是否 commit。
+
+    等 writer 處理完才返回；這支 ticker 有寫入失敗（已回滾）時拋出 SinkError。
+    """
+    if _active_sink is not None:
+        _active_sink.ticker_done(ticker).result()
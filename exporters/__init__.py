@@ -10,6 +10,7 @@ from .stock_data import (                           # noqa: F401
 )
 from .history import (                              # noqa: F401
     fetch_history_from_db,
+    iter_history_from_db,
     export_history_json,
 )
 
@@ -17,5 +18,6 @@ __all__ = [
     'generate_stock_data_json',
     'compute_fundamentals_enrichment',
     'fetch_history_from_db',
+    'iter_history_from_db',
     'export_history_json',
 ]
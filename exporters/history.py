@@ -4,6 +4,7 @@ exporters.history — 從 SQLite 歷史資料匯出 history_all.json
 輸出格式（history_all.json）：
 {
   "generatedAt": "2024-01-02T12:34:56",
+  "dataVersion": 42,            // db_meta.data_version（與 stock_data.json 同一快照時相同）
   "history": {
     "1537": [
       { "date": "2024-01-02", "price": 218.5, "eps": 14.2, ... },
@@ -11,90 +12,170 @@ exporters.history — 從 SQLite 歷史資料匯出 history_all.json
     ]
   }
 }
+
+增量匯出：每檔以緊湊 JSON 的 SHA-1 為內容雜湊，記錄在匯出 manifest
+（{output_root}/.cache/history_export/manifest.json）。雜湊未變且檔案仍在的股票
+不重寫 public/history/{ticker}.json；history_all.json 每次重建，但各檔內容
+直接拼接快取的片段（已縮排好的 JSON 文字），不再重新序列化。
+
+因此個股檔的 generatedAt / dataVersion 是「該檔最後一次重寫」時的值（內容最後變更的
+時間與版本），不是本次匯出的版本；只有 history_all.json 的這兩個欄位每次更新。
+要確認個股檔與 stock_data.json 是否出自同一版，請比對 history_all.json。
+
+串流匯出：STOCK_LIST 篩選在 SQL 內完成，各分區游標依 (ticker, 日期) 合併，
+逐檔寫入個股檔與 history_all.json；記憶體上限約為單一股票的歷史。
 """
 
+import contextlib
+import hashlib
+import heapq
+import itertools
 import json
 import os
-import sqlite3
-import contextlib
 from datetime import datetime
-from typing import Any, Dict, List
+from operator import itemgetter
+from typing import Any, Dict, Iterator, List, Tuple
 
-from stock_config import STOCK_LIST, DB_PATH
+import stock_config
+from stock_config import STOCK_LIST
+from db.connection import shared_connection
+from db.meta import get_data_version
+from db.partitions import open_partitions
 
 
-def _atomic_write_json(path, data):
-    """原子寫入 JSON：tmp + fsync + os.replace，避免寫入中斷產生損壞檔。"""
+# 各分區共用的查詢（熱資料庫與歸檔連線上的表都在 main schema）；
+# fetch_time 為 NULL 或空字串的列在 <> '' 時一併排除
+_HISTORY_SQL = """
+    SELECT
+        ticker, price, eps, pe, pb, roe,
+        dividend_yield, growth_rate, fetch_time
+    FROM main.stock_history
+    WHERE fetch_error = 0
+      AND fetch_time <> ''
+      AND ticker IN (SELECT value FROM json_each(:tickers))
+    ORDER BY ticker, fetch_time ASC
+"""
+
+# 匯出範圍：STOCK_LIST 中且未封存（封存狀態以熱資料庫的 tickers 為準）
+_EXPORT_TICKERS_SQL = """
+    SELECT ticker FROM main.tickers
+    WHERE archived_at IS NULL
+      AND ticker IN (SELECT value FROM json_each(:tickers))
+    ORDER BY ticker
+"""
+
+# manifest 格式版本：片段格式或雜湊方式調整時遞增，舊 manifest 視為全部變更
+_MANIFEST_FORMAT = 1
+
+
+@contextlib.contextmanager
+def _atomic_open(path):
+    """原子寫入文字檔：寫到 tmp、fsync 後 os.replace，避免寫入中斷產生損壞檔。"""
     tmp = path + '.tmp'
     with open(tmp, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-        f.write('\n')
+        yield f
         f.flush()
         os.fsync(f.fileno())
     os.replace(tmp, path)
 
 
-def fetch_history_from_db() -> Dict[str, List[Dict[str, Any]]]:
-    """
-    從 SQLite 讀取所有成功的歷史記錄，依 ticker 分組。
-    只保留 STOCK_LIST 中的股票。
-    """
-    if not os.path.exists(DB_PATH):
-        print(f"❌ 找不到資料庫檔案：{DB_PATH}")
+def _atomic_write_json(path, data):
+    """原子寫入 JSON（indent=2）。"""
+    with _atomic_open(path) as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+
+
+def _points_hash(points):
+    """每檔歷史的內容雜湊（緊湊 JSON 走 C encoder，比 indent 序列化快得多）。"""
+    text = json.dumps(points, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _history_fragment(points):
+    """history_all.json 中單檔陣列的文字（縮排深度與 json.dump(indent=2) 的輸出一致）。"""
+    return json.dumps(points, ensure_ascii=False, indent=2).replace('\n', '\n    ')
+
+
+def _load_manifest(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('format') != _MANIFEST_FORMAT:
         return {}
+    return manifest.get('tickers', {})
 
-    with contextlib.closing(sqlite3.connect(DB_PATH)) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT
-                ticker, price, eps, pe, pb, roe,
-                dividend_yield, growth_rate, fetch_time
-            FROM stock_history
-            WHERE fetch_error = 0
-            ORDER BY ticker, fetch_time ASC
-        """)
+def _date_key(row):
+    """合併排序鍵 (ticker, 日期)；fetch_time 取空白前的日期部分。"""
+    return row[0], str(row[8]).split(" ")[0]
 
-        rows = cursor.fetchall()
 
-    history: Dict[str, List[Dict[str, Any]]] = {}
+def _to_point(row) -> Dict[str, Any]:
+    ticker, price, eps, pe, pb, roe, dividend_yield, growth_rate, fetch_time = row
+    return {
+        "date": str(fetch_time).split(" ")[0],
+        "price": price,
+        "eps": eps,
+        "pe": pe,
+        "pb": pb,
+        "roe": roe,
+        "dividendYield": dividend_yield,
+        "growthRate": growth_rate,
+    }
+
 
-    for row in rows:
-        ticker = row["ticker"]
-        fetch_time = row["fetch_time"]
-        if not fetch_time:
-            continue
+def iter_history_from_db() -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """
+    依 ticker 順序逐檔產生 (ticker, 依日期排序的歷史)，含年度歸檔。
+    只讀 STOCK_LIST 中且未封存的股票；同時只持有一檔的歷史。
 
-        date_str = str(fetch_time).split(" ")[0]
+    各分區各自依 (ticker, fetch_time) 排序，heapq.merge 依 (ticker, 日期) 合併；
+    同一天跨分區時舊分區在前（與先串接再穩定排序的結果相同）。
+    提前中斷請以 contextlib.closing 包住，確保歸檔連線被關閉。
+    """
+    if not os.path.exists(stock_config.DB_PATH):
+        print(f"❌ 找不到資料庫檔案：{stock_config.DB_PATH}")
+        return
 
-        point = {
-            "date": date_str,
-            "price": row["price"],
-            "eps": row["eps"],
-            "pe": row["pe"],
-            "pb": row["pb"],
-            "roe": row["roe"],
-            "dividendYield": row["dividend_yield"],
-            "growthRate": row["growth_rate"],
-        }
+    with shared_connection() as conn:
+        tickers = json.dumps([r[0] for r in conn.execute(
+            _EXPORT_TICKERS_SQL, {"tickers": json.dumps(list(STOCK_LIST))})])
+        with open_partitions(conn) as parts:
+            cursors = [part.execute(_HISTORY_SQL, {"tickers": tickers}) for _, part in parts]
+            rows = heapq.merge(*cursors, key=_date_key)
+            for ticker, group in itertools.groupby(rows, key=itemgetter(0)):
+                yield ticker, [_to_point(row) for row in group]
 
-        history.setdefault(ticker, []).append(point)
 
-    # 依日期排序
-    for ticker, points in history.items():
-        points.sort(key=lambda p: p["date"])
+def fetch_history_from_db() -> Dict[str, List[Dict[str, Any]]]:
+    """
+    從 SQLite 讀取所有成功的歷史記錄（含年度歸檔），依 ticker 分組。
+    只保留 STOCK_LIST 中且未封存的股票。整份載入記憶體，匯出請用 iter_history_from_db。
+    """
+    return dict(iter_history_from_db())
 
-    # 只保留 STOCK_LIST 中的股票
-    active_set = set(STOCK_LIST)
-    history = {t: pts for t, pts in history.items() if t in active_set}
 
-    return history
+def _write_ticker_file(path, header, base):
+    """寫入 public/history/{ticker}.json（與 json.dump(payload, indent=2) 逐字相同）。"""
+    with _atomic_open(path) as f:
+        f.write('{\n')
+        for key, value in header.items():
+            f.write(f'  {json.dumps(key)}: {json.dumps(value, ensure_ascii=False)},\n')
+        f.write('  "history": ')
+        f.write(base.replace('\n', '\n  '))
+        f.write('\n}\n')
 
 
 def export_history_json(output_root: str = ".") -> str:
     """
-    匯出 history_all.json 到 public/ 目錄。
+    串流匯出 history_all.json 與 public/history/{ticker}.json 到 public/ 目錄。
+
+    逐檔處理：內容雜湊有變的股票才重寫個股檔與快取片段，
+    history_all.json 邊讀邊寫（未變的股票直接拼接快取片段）。
+    略過的個股檔保留上次寫入時的 generatedAt / dataVersion（見模組說明）。
 
     Args:
         output_root: 專案根目錄
@@ -102,53 +183,97 @@ def export_history_json(output_root: str = ".") -> str:
     Returns:
         public/history_all.json 的實際路徑
     """
-    history = fetch_history_from_db()
-
-    total_points = sum(len(points) for points in history.values())
-    print(f"📊 共有 {len(history)} 檔股票，總計 {total_points} 筆歷史記錄")
-
+    data_version = get_data_version()
     now = datetime.now().isoformat()
-    payload = {
-        "generatedAt": now,
-        "history": history,
-    }
 
     root = os.path.abspath(output_root)
     public_dir = os.path.join(root, "public")
-    os.makedirs(public_dir, exist_ok=True)
-
-    # 1. 輸出 history_all.json（保留原有格式，方便前端過渡）
+    history_dir = os.path.join(public_dir, "history")
+    cache_dir = os.path.join(root, ".cache", "history_export")
+    manifest_path = os.path.join(cache_dir, "manifest.json")
     public_path = os.path.join(public_dir, "history_all.json")
+    for directory in (public_dir, history_dir, cache_dir):
+        os.makedirs(directory, exist_ok=True)
+
+    previous = _load_manifest(manifest_path)
+    manifest: Dict[str, Dict[str, Any]] = {}
+    exported = set()
+    written = skipped = total_points = 0
+    completed = False
+
+    def export_ticker(ticker, points):
+        """處理單檔：必要時重寫個股檔與片段，回傳 history_all.json 用的片段文字。"""
+        nonlocal written, skipped
+        ticker_path = os.path.join(history_dir, f"{ticker}.json")
+        fragment_path = os.path.join(cache_dir, f"{ticker}.json")
+        digest = _points_hash(points)
+        if (previous.get(ticker, {}).get("hash") == digest
+                and os.path.exists(ticker_path) and os.path.exists(fragment_path)):
+            with open(fragment_path, encoding='utf-8') as f:
+                fragment = f.read()
+            manifest[ticker] = previous[ticker]
+            skipped += 1
+            return fragment
+
+        # 只序列化一次：個股檔與片段差在縮排深度
+        base = json.dumps(points, ensure_ascii=False, indent=2)
+        fragment = base.replace('\n', '\n    ')
+        # 個股檔的 generatedAt / dataVersion 標記內容最後變更的那次匯出，略過時不更新
+        header = {"generatedAt": now, "dataVersion": data_version, "ticker": ticker}
+        try:
+            _write_ticker_file(ticker_path, header, base)
+            with _atomic_open(fragment_path) as f:
+                f.write(fragment)
+            manifest[ticker] = {"hash": digest, "points": len(points),
+                                "dataVersion": data_version}
+            written += 1
+            print(f"  └─ {ticker_path} ({len(points)} 筆)")
+        except Exception as e:
+            print(f"⚠️ 寫入 {ticker_path} 失敗：{e}")
+        return fragment
+
+    # 1. history_all.json（保留原有格式，方便前端過渡）與個股檔同一趟串流寫出
     try:
-        _atomic_write_json(public_path, payload)
+        with contextlib.closing(iter_history_from_db()) as history, \
+                _atomic_open(public_path) as combined:
+            combined.write('{\n')
+            combined.write(f'  "generatedAt": {json.dumps(now)},\n')
+            combined.write(f'  "dataVersion": {json.dumps(data_version)},\n')
+            combined.write('  "history": {')
+            for ticker, points in history:
+                combined.write(',\n' if exported else '\n')
+                combined.write(f'    {json.dumps(ticker, ensure_ascii=False)}: ')
+                combined.write(export_ticker(ticker, points))
+                exported.add(ticker)
+                total_points += len(points)
+            combined.write('\n  }\n}\n' if exported else '}\n}\n')
+        completed = True
+        print(f"📊 共有 {len(exported)} 檔股票，總計 {total_points} 筆歷史記錄")
         print(f"✅ 已輸出歷史 JSON：{public_path}")
     except Exception as e:
         print(f"⚠️ 寫入 {public_path} 失敗：{e}")
+    print(f"  📝 個股歷史檔：重寫 {written} 檔，略過 {skipped} 檔（內容未變更）")
 
-    # 2. 拆分為 public/history/{ticker}.json
-    history_dir = os.path.join(public_dir, "history")
-    os.makedirs(history_dir, exist_ok=True)
-    for ticker, points in history.items():
-        ticker_path = os.path.join(history_dir, f"{ticker}.json")
-        ticker_payload = {
-            "generatedAt": now,
-            "ticker": ticker,
-            "history": points,
-        }
+    # 串流中斷時 manifest 不完整：不清殘留、不更新 manifest（下次重寫未記錄的股票）
+    if not completed:
+        return public_path
+
+    # 2. 清除已移除股票的殘留 JSON 與片段
+    for directory in (history_dir, cache_dir):
         try:
-            _atomic_write_json(ticker_path, ticker_payload)
-            print(f"  └─ {ticker_path} ({len(points)} 筆)")
+            existing_files = {f[:-5] for f in os.listdir(directory) if f.endswith('.json')}
+            for orphan in existing_files - exported - {"manifest"}:
+                orphan_path = os.path.join(directory, f"{orphan}.json")
+                os.remove(orphan_path)
+                if directory == history_dir:
+                    print(f"  🗑️  已刪除殘留: {orphan_path}")
         except Exception as e:
-            print(f"⚠️ 寫入 {ticker_path} 失敗：{e}")
+            print(f"⚠️ 清除殘留檔失敗: {e}")
 
-    # 3. 清除已移除股票的殘留 JSON
+    # 3. manifest 在個股檔與片段都寫完後才更新：中斷時下次會重寫未記錄的股票
     try:
-        existing_files = {f[:-5] for f in os.listdir(history_dir) if f.endswith('.json')}
-        for orphan in existing_files - set(history.keys()):
-            orphan_path = os.path.join(history_dir, f"{orphan}.json")
-            os.remove(orphan_path)
-            print(f"  🗑️  已刪除殘留: {orphan_path}")
+        _atomic_write_json(manifest_path, {"format": _MANIFEST_FORMAT, "tickers": manifest})
     except Exception as e:
-        print(f"⚠️ 清除殘留檔失敗: {e}")
+        print(f"⚠️ 寫入 {manifest_path} 失敗：{e}")
 
     return public_path
@@ -2,18 +2,20 @@
 exporters.stock_data — 從 DB 最新資料生成 stock_data.json
 
 stock_data.json 供前端主儀表板使用，包含各股最新的價格和基本面指標。
-此模組直接從 stock_history 表取最新一筆修正後的資料，
-並從 fundamentals_history 表計算平滑化 EPS 與每股自由現金流。
+此模組經由 stock_latest 從 stock_history view 取最新一筆修正後的資料（排除已封存的 ticker），
+並從 fundamentals_history / annual_fundamentals 以視窗函數計算平滑化 EPS 與每股自由現金流
+（只算 STOCK_LIST 中未封存的股票，結果依 db_id + data_version 快取於 .cache/enrichment.json）。
 """
 
 import json
 import os
 import sqlite3
-import contextlib
-from collections import defaultdict
 from datetime import datetime
 
-from stock_config import STOCK_LIST, STOCK_NAME_MAPPING, SECTOR_MAPPING, DB_PATH
+import stock_config
+from stock_config import STOCK_LIST, STOCK_NAME_MAPPING, SECTOR_MAPPING
+from db.connection import shared_connection
+from db.meta import get_data_version, get_db_id
 
 
 def _atomic_write_json(path, data):
@@ -27,7 +29,99 @@ def _atomic_write_json(path, data):
     os.replace(tmp, path)
 
 
-def compute_fundamentals_enrichment(cursor):
+# 未封存、且在 :tickers 中（NULL = 全部）的股票
+_ACTIVE_CTE = '''
+WITH active AS (
+    SELECT ticker FROM tickers
+    WHERE archived_at IS NULL
+      AND (:tickers IS NULL OR ticker IN (SELECT value FROM json_each(:tickers)))
+)'''
+
+# 每檔一列：年報近 3 年 EPS / FCFPS 的和與筆數、最早 / 最新股本，
+# 季報最新 4 季 FCF 與最新股本。加總以 LAG 明確由舊到新相加（與 Python sum 相同順序），
+# round / 次方留給 Python，輸出與逐筆計算逐位元相同。
+_ENRICHMENT_SQL = _ACTIVE_CTE + ''',
+annual_rows AS (
+    SELECT ticker, fiscal_year, shares_outstanding AS shares,
+        ROW_NUMBER() OVER by_year = COUNT(*) OVER all_years AS is_latest,
+        0 + IFNULL(LAG(eps, 2) OVER by_year, 0) + IFNULL(LAG(eps, 1) OVER by_year, 0)
+          + IFNULL(eps, 0) AS eps_sum,
+        (LAG(eps, 2) OVER by_year IS NOT NULL) + (LAG(eps, 1) OVER by_year IS NOT NULL)
+          + (eps IS NOT NULL) AS eps_n,
+        0 + IFNULL(LAG(fcfps, 2) OVER by_year, 0) + IFNULL(LAG(fcfps, 1) OVER by_year, 0)
+          + IFNULL(fcfps, 0) AS fcfps_sum,
+        (LAG(fcfps, 2) OVER by_year IS NOT NULL) + (LAG(fcfps, 1) OVER by_year IS NOT NULL)
+          + (fcfps IS NOT NULL) AS fcfps_n,
+        MIN(fiscal_year) FILTER (WHERE shares_outstanding > 0) OVER all_years AS oldest_year,
+        MAX(fiscal_year) FILTER (WHERE shares_outstanding > 0) OVER all_years AS newest_year
+    FROM (
+        SELECT *, CASE WHEN fcf IS NOT NULL AND shares_outstanding > 0
+                       THEN fcf / shares_outstanding END AS fcfps
+        FROM annual_fundamentals
+        WHERE ticker IN (SELECT ticker FROM active)
+    )
+    WINDOW by_year AS (PARTITION BY ticker ORDER BY fiscal_year),
+           all_years AS (by_year ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+),
+annual AS (
+    SELECT ticker,
+        MAX(CASE WHEN is_latest THEN eps_sum END) AS eps_sum,
+        MAX(CASE WHEN is_latest THEN eps_n END) AS eps_n,
+        MAX(CASE WHEN is_latest THEN fcfps_sum END) AS fcfps_sum,
+        MAX(CASE WHEN is_latest THEN fcfps_n END) AS fcfps_n,
+        COUNT(CASE WHEN shares > 0 THEN 1 END) AS n_shares,
+        MAX(oldest_year) AS oldest_year,
+        MAX(CASE WHEN fiscal_year = oldest_year THEN shares END) AS oldest_shares,
+        MAX(newest_year) AS newest_year,
+        MAX(CASE WHEN fiscal_year = newest_year THEN shares END) AS newest_shares
+    FROM annual_rows
+    GROUP BY ticker
+),
+quarter_rows AS (
+    SELECT ticker, period_end, shares_outstanding AS shares,
+        ROW_NUMBER() OVER by_period = COUNT(*) OVER all_periods AS is_latest,
+        COUNT(*) OVER all_periods AS n_quarters,
+        0 + IFNULL(LAG(fcf, 3) OVER by_period, 0) + IFNULL(LAG(fcf, 2) OVER by_period, 0)
+          + IFNULL(LAG(fcf, 1) OVER by_period, 0) + IFNULL(fcf, 0) AS ttm_fcf,
+        MAX(period_end) FILTER (WHERE shares_outstanding > 0) OVER all_periods AS shares_period
+    FROM fundamentals_history
+    WHERE ticker IN (SELECT ticker FROM active)
+    WINDOW by_period AS (PARTITION BY ticker ORDER BY period_end),
+           all_periods AS (by_period ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+),
+quarterly AS (
+    SELECT ticker,
+        MAX(n_quarters) AS n_quarters,
+        MAX(CASE WHEN is_latest THEN ttm_fcf END) AS ttm_fcf,
+        MAX(CASE WHEN period_end = shares_period THEN shares END) AS shares
+    FROM quarter_rows
+    GROUP BY ticker
+)
+SELECT t.ticker,
+    a.ticker IS NOT NULL, a.eps_sum, a.eps_n, a.fcfps_sum, a.fcfps_n,
+    a.n_shares, a.oldest_year, a.oldest_shares, a.newest_year, a.newest_shares,
+    q.ticker IS NOT NULL, q.n_quarters, q.ttm_fcf, q.shares
+FROM active t
+LEFT JOIN annual a ON a.ticker = t.ticker
+LEFT JOIN quarterly q ON q.ticker = t.ticker
+WHERE a.ticker IS NOT NULL OR q.ticker IS NOT NULL
+ORDER BY t.ticker
+'''
+
+# 歷年 EPS 逐列取出、在 Python 組成陣列：json_group_array 只輸出 15 位有效數字
+_HISTORICAL_EPS_SQL = _ACTIVE_CTE + '''
+SELECT ticker, eps FROM annual_fundamentals
+WHERE ticker IN (SELECT ticker FROM active) AND eps IS NOT NULL
+ORDER BY ticker, fiscal_year
+'''
+
+# 快取鍵含此版本號：計算方式調整時遞增，舊快取自動失效
+_ENRICHMENT_CACHE_VERSION = 2
+_PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENRICHMENT_CACHE_PATH = os.path.join(_PROJECT_DIR, '.cache', 'enrichment.json')
+
+
+def compute_fundamentals_enrichment(cursor, tickers=None):
     """
     從 annual_fundamentals (年報) 和 fundamentals_history (季報) 計算進階估值欄位：
     - avgEps: 近 3 年年度 EPS 平均值（來自 annual_fundamentals）
@@ -35,113 +129,99 @@ def compute_fundamentals_enrichment(cursor):
     - avgFcfPerShare: 近 3 年年度 FCF per share 平均值
     - historicalEps: 全部年度 EPS 陣列（供前端計算盈餘穩定性 CV）
     - shareDilutionRate: 年化股本稀釋率 %
+
+    視窗函數在 SQLite 內逐檔彙總（只讀未封存、且在 tickers 中的股票），每檔回傳一列；
+    歷年 EPS 另依年度逐列讀出，數值原樣放進陣列。
+
+    Args:
+        cursor: DB cursor
+        tickers: 限定的 ticker（None = 全部未封存）
     """
-    enrichment = {}
+    params = {'tickers': None if tickers is None else json.dumps(list(tickers))}
+    cursor.execute(_ENRICHMENT_SQL, params)
 
-    # ── 1. 從 annual_fundamentals 計算近 3 年平均 EPS 和 FCF per share ──
-    try:
-        cursor.execute('''
-            SELECT ticker, fiscal_year, eps, fcf, shares_outstanding
-            FROM annual_fundamentals
-            ORDER BY ticker, fiscal_year ASC
-        ''')
-        annual_by_ticker = defaultdict(list)
-        for r in cursor.fetchall():
-            annual_by_ticker[r['ticker']].append(dict(r))
-    except Exception:
-        annual_by_ticker = {}
-
-    for ticker, years in annual_by_ticker.items():
-        recent = years[-3:] if len(years) >= 3 else years
-
-        eps_values = [y['eps'] for y in recent if y['eps'] is not None]
-        avg_eps = round(sum(eps_values) / len(eps_values), 2) if eps_values else None
-
-        historical_eps = [y['eps'] for y in years if y['eps'] is not None]
-
-        fcfps_values = []
-        for y in recent:
-            if y['fcf'] is not None and y['shares_outstanding'] and y['shares_outstanding'] > 0:
-                fcfps_values.append(y['fcf'] / y['shares_outstanding'])
-        avg_fcfps = round(sum(fcfps_values) / len(fcfps_values), 2) if fcfps_values else None
-
-        enrichment[ticker] = {
-            'avgEps': avg_eps,
-            'avgFcfPerShare': avg_fcfps,
-            'fcfPerShare': None,
-            'historicalEps': historical_eps,
+    enrichment = {}
+    for (ticker, has_annual, eps_sum, eps_n, fcfps_sum, fcfps_n,
+         n_shares, oldest_year, oldest_shares, newest_year, newest_shares,
+         has_quarterly, n_quarters, ttm_fcf_m, shares) in cursor.fetchall():
+        entry = enrichment[ticker] = {
+            'avgEps': None, 'avgFcfPerShare': None,
+            'fcfPerShare': None, 'historicalEps': [],
             'shareDilutionRate': None,
         }
 
-        # 股本稀釋率
-        shares_data = [(y['fiscal_year'], y['shares_outstanding'])
-                       for y in years if y.get('shares_outstanding') and y['shares_outstanding'] > 0]
-        if len(shares_data) >= 2:
-            shares_data.sort(key=lambda x: x[0])
-            oldest_year, oldest_shares = shares_data[0]
-            newest_year, newest_shares = shares_data[-1]
-            n_years = newest_year - oldest_year
-            if n_years > 0 and oldest_shares > 0:
-                dilution = ((newest_shares / oldest_shares) ** (1 / n_years) - 1) * 100
-                enrichment[ticker]['shareDilutionRate'] = round(dilution, 2)
-
-    # ── 2. 從 fundamentals_history 計算 TTM FCFPS（最新 4 季）──
-    cursor.execute('''
-        SELECT ticker, period_end, eps, fcf, shares_outstanding
-        FROM fundamentals_history
-        ORDER BY ticker, period_end ASC
-    ''')
-
-    quarterly_by_ticker = defaultdict(list)
-    for r in cursor.fetchall():
-        quarterly_by_ticker[r['ticker']].append(dict(r))
-
-    for ticker, quarters in quarterly_by_ticker.items():
-        shares = 0
-        for q in reversed(quarters):
-            if q['shares_outstanding'] and q['shares_outstanding'] > 0:
-                shares = q['shares_outstanding']
-                break
-
-        fcf_per_share = None
-        if len(quarters) >= 4 and shares > 0:
-            ttm_fcf_m = sum(quarters[j]['fcf'] or 0 for j in range(len(quarters) - 4, len(quarters)))
-            fcf_per_share = round(ttm_fcf_m * 1_000_000 / shares, 2)
-
-        if ticker not in enrichment:
-            enrichment[ticker] = {
-                'avgEps': None, 'avgFcfPerShare': None,
-                'fcfPerShare': None, 'historicalEps': [],
-                'shareDilutionRate': None,
-            }
-
-        enrichment[ticker]['fcfPerShare'] = fcf_per_share
-        if enrichment[ticker]['avgFcfPerShare'] is None and fcf_per_share is not None:
-            enrichment[ticker]['avgFcfPerShare'] = fcf_per_share
+        if has_annual:
+            entry['avgEps'] = round(eps_sum / eps_n, 2) if eps_n else None
+            entry['avgFcfPerShare'] = round(fcfps_sum / fcfps_n, 2) if fcfps_n else None
+
+            # 股本稀釋率
+            if n_shares >= 2:
+                n_years = newest_year - oldest_year
+                if n_years > 0 and oldest_shares > 0:
+                    dilution = ((newest_shares / oldest_shares) ** (1 / n_years) - 1) * 100
+                    entry['shareDilutionRate'] = round(dilution, 2)
+
+        # TTM FCFPS（最新 4 季）
+        if has_quarterly:
+            shares = shares or 0
+            if n_quarters >= 4 and shares > 0:
+                entry['fcfPerShare'] = round(ttm_fcf_m * 1_000_000 / shares, 2)
+                if entry['avgFcfPerShare'] is None:
+                    entry['avgFcfPerShare'] = entry['fcfPerShare']
+
+    cursor.execute(_HISTORICAL_EPS_SQL, params)
+    for ticker, eps in cursor.fetchall():
+        enrichment[ticker]['historicalEps'].append(eps)
 
     return enrichment
 
 
+def _cached_enrichment(cursor, tickers, data_version, db_id):
+    """
+    以 (DB 路徑, db_id, data_version, tickers) 為鍵快取 compute_fundamentals_enrichment 的結果；
+    DB 沒有任何寫入時（例如連續 --regen-only）直接沿用上次的計算。
+    db_id 區分同一路徑上重建的資料庫（data_version 會從 0 重數）。
+    """
+    key = [_ENRICHMENT_CACHE_VERSION, os.path.abspath(stock_config.DB_PATH), db_id,
+           data_version, sorted(tickers)]
+    cacheable = data_version is not None and db_id is not None
+    if cacheable:
+        try:
+            with open(ENRICHMENT_CACHE_PATH, encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('key') == key:
+                return cached['enrichment']
+        except (OSError, ValueError):
+            pass
+
+    enrichment = compute_fundamentals_enrichment(cursor, tickers)
+    if cacheable:
+        try:
+            os.makedirs(os.path.dirname(ENRICHMENT_CACHE_PATH), exist_ok=True)
+            _atomic_write_json(ENRICHMENT_CACHE_PATH, {'key': key, 'enrichment': enrichment})
+        except OSError:
+            pass
+    return enrichment
+
+
 def generate_stock_data_json():
     """從 DB 最新修正資料生成 stock_data.json"""
-    with contextlib.closing(sqlite3.connect(DB_PATH)) as conn:
-        conn.row_factory = sqlite3.Row
+    with shared_connection(row_factory=sqlite3.Row) as conn:
         cursor = conn.cursor()
 
+        # CROSS JOIN 固定由 stock_latest 驅動：每檔一次主鍵查找，不掃描整張 price_bars
         cursor.execute('''
             SELECT s.*
-            FROM stock_history s
-            INNER JOIN (
-                SELECT ticker, MAX(fetch_time) as max_time
-                FROM stock_history
-                WHERE fetch_error = 0
-                GROUP BY ticker
-            ) latest ON s.ticker = latest.ticker AND s.fetch_time = latest.max_time
+            FROM stock_latest l
+            CROSS JOIN stock_history s
+                ON s.ticker_id = l.ticker_id AND s.trade_date = l.latest_ok_date
+            WHERE l.ticker_id IN (SELECT id FROM tickers WHERE archived_at IS NULL)
             ORDER BY s.ticker
         ''')
 
         rows = cursor.fetchall()
-        fundamentals = compute_fundamentals_enrichment(cursor)
+        data_version = get_data_version(conn)
+        fundamentals = _cached_enrichment(cursor, STOCK_LIST, data_version, get_db_id(conn))
 
     active_set = set(STOCK_LIST)
 
@@ -178,6 +258,7 @@ def generate_stock_data_json():
 
     output = {
         'lastUpdate': datetime.now().isoformat(),
+        'dataVersion': data_version,
         'stocks': stocks,
     }
 
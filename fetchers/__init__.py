@@ -1,20 +1,52 @@
 """
-fetchers — yfinance API 抓取模組
+fetchers — 資料源抓取模組
 
-提供 ticker 解析、即時報價、年報／季報與歷史走勢的抓取功能。
+提供 ticker 解析、即時報價、年報／季報與歷史走勢的抓取功能；
+資料源經由 fetchers.provider 取得（yfinance / 錄製 / 重播 / 合成）。
 """
 
-from .ticker import resolve_ticker                                   # noqa: F401
-from .price import save_current_snapshot, save_historical_prices     # noqa: F401
+from .ticker import (                                                # noqa: F401
+    TickerNotFoundError,
+    resolve_ticker,
+    resolve_unresolved,
+    registered_symbols,
+)
+from .price import (                                                 # noqa: F401
+    save_current_snapshot,
+    save_historical_prices,
+    fetch_latest_quotes,
+    save_quotes_only,
+)
 from .fundamentals import (                                          # noqa: F401
     save_annual_fundamentals,
     save_quarterly_and_fix,
 )
+from .pool import TokenBucket, run_pool                              # noqa: F401
+from .provider import (                                              # noqa: F401
+    get_provider,
+    set_provider,
+    use_provider,
+    make_provider,
+)
+from .resilience import ResilientProvider, CircuitOpenError              # noqa: F401
 
 __all__ = [
+    'TickerNotFoundError',
     'resolve_ticker',
+    'resolve_unresolved',
+    'registered_symbols',
     'save_current_snapshot',
     'save_historical_prices',
+    'fetch_latest_quotes',
+    'save_quotes_only',
     'save_annual_fundamentals',
     'save_quarterly_and_fix',
+    'TokenBucket',
+    'run_pool',
+    'get_provider',
+    'set_provider',
+    'use_provider',
+    'make_provider',
+    'ResilientProvider',
+    'CircuitOpenError',
 ]
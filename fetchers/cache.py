@@ -0,0 +1,176 @@
+"""
+fetchers.cache — 資料源回應的本地 TTL 快取（info / 財報 / 股利）
+
+季報與年報一年最多變動四次，沒必要每次 --refresh 都重新下載。
+快取存於獨立的 SQLite 檔（預設 .cache/provider_cache.db）：
+
+  payloads — 以內容 sha256 為鍵的 zlib 壓縮 blob（相同內容只存一份）
+  entries  — (symbol, kind) → digest，記錄寫入與最後存取時間
+
+每種 payload 有各自的 TTL；總大小超過上限時依最後存取時間（LRU）淘汰。
+報價走勢（history()）不經過快取。
+"""
+
+import hashlib
+import os
+import pickle
+import threading
+import time
+import zlib
+
+from db.connection import connect
+
+_PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CACHE_PATH = os.path.join(_PROJECT_DIR, '.cache', 'provider_cache.db')
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# 各 payload 類型的 TTL（秒）
+PAYLOAD_TTL_SECONDS = {
+    'info': 10 * 60,                              # 含即時報價，只避免短時間重複下載
+    'dividends': 24 * 3600,
+    'financials': 30 * 24 * 3600,
+    'balance_sheet': 30 * 24 * 3600,
+    'cashflow': 30 * 24 * 3600,
+    'quarterly_financials': 7 * 24 * 3600,
+    'quarterly_balance_sheet': 7 * 24 * 3600,
+    'quarterly_cashflow': 7 * 24 * 3600,
+}
+
+
+class ResponseCache:
+    """
+    內容定址的 payload 快取（執行緒安全）。
+
+    Args:
+        path: 快取 DB 路徑
+        max_bytes: 壓縮後總大小上限，超過時 LRU 淘汰
+        ttl: 覆寫 PAYLOAD_TTL_SECONDS 的 dict
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, *, max_bytes=DEFAULT_MAX_BYTES, ttl=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = dict(PAYLOAD_TTL_SECONDS, **(ttl or {}))
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'stores': 0, 'evicted': 0}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = connect(path, check_same_thread=False)
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS payloads (
+                digest TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                data BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS entries (
+                symbol TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (symbol, kind)
+            );
+            CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries(accessed_at);
+        ''')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ── 讀寫 ──
+    def get(self, symbol, kind):
+        """回傳 (hit, value)；過期或不存在時 hit 為 False。"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('''
+                SELECT e.stored_at, p.data FROM entries e
+                JOIN payloads p ON p.digest = e.digest
+                WHERE e.symbol = ? AND e.kind = ?
+            ''', (symbol, kind)).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return False, None
+            if now - row[0] > self.ttl.get(kind, 0):
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return False, None
+            self._conn.execute(
+                'UPDATE entries SET accessed_at = ? WHERE symbol = ? AND kind = ?',
+                (now, symbol, kind))
+            self._conn.commit()
+            self.stats['hits'] += 1
+        return True, pickle.loads(zlib.decompress(row[1]))
+
+    def put(self, symbol, kind, value):
+        data = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        digest = hashlib.sha256(data).hexdigest()
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR IGNORE INTO payloads (digest, size, data) VALUES (?, ?, ?)',
+                (digest, len(data), data))
+            self._conn.execute('''
+                INSERT OR REPLACE INTO entries (symbol, kind, digest, stored_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (symbol, kind, digest, now, now))
+            self.stats['stores'] += 1
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """刪除孤兒 payload，總大小超過上限時依 LRU 淘汰 entries。"""
+        self._conn.execute(
+            'DELETE FROM payloads WHERE digest NOT IN (SELECT digest FROM entries)')
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM payloads').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for symbol, kind in self._conn.execute(
+                'SELECT symbol, kind FROM entries ORDER BY accessed_at').fetchall():
+            self._conn.execute('DELETE FROM entries WHERE symbol = ? AND kind = ?', (symbol, kind))
+            self.stats['evicted'] += 1
+            self._conn.execute(
+                'DELETE FROM payloads WHERE digest NOT IN (SELECT digest FROM entries)')
+            total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM payloads').fetchone()[0]
+            if total <= self.max_bytes:
+                break
+
+    # ── 包裝 ──
+    def wrap(self, stock, symbol, *, prefetched=()):
+        """
+        包裝 ticker 物件。prefetched 為 stock 上已下載好的屬性（例如解析交易所時
+        驗證用的 info）：第一次讀取直接用這份最新資料並寫回快取，不讀舊快取。
+        """
+        return CachedTicker(stock, symbol, self, prefetched=prefetched)
+
+    def summary(self):
+        s = self.stats
+        lookups = s['hits'] + s['misses']
+        ratio = s['hits'] / lookups * 100 if lookups else 0
+        return (f"🗃️  快取命中 {s['hits']} / 未命中 {s['misses']}（命中率 {ratio:.0f}%），"
+                f"寫入 {s['stores']}，過期 {s['expired']}，淘汰 {s['evicted']}")
+
+
+class CachedTicker:
+    """
+    包裝 provider.ticker() 物件：PAYLOAD_TTL_SECONDS 中的屬性先查快取，其餘（history() 等）直接轉發。
+    prefetched 中的屬性已在 stock 上，略過快取查詢（避免以舊資料蓋過剛下載的報價）。
+    """
+
+    def __init__(self, stock, symbol, cache, *, prefetched=()):
+        self._stock = stock
+        self._symbol = symbol
+        self._cache = cache
+        self._prefetched = set(prefetched)
+
+    def __getattr__(self, name):
+        if name not in self._cache.ttl:
+            return getattr(self._stock, name)
+        if name in self._prefetched:
+            self._prefetched.discard(name)
+        else:
+            hit, value = self._cache.get(self._symbol, name)
+            if hit:
+                return value
+        value = getattr(self._stock, name)
+        if value is not None:
+            self._cache.put(self._symbol, name, value)
+        return value
@@ -0,0 +1,221 @@
+"""
+fetchers.pool — 多 ticker 並行抓取（有界 worker pool + 共用 token-bucket 限速）
+
+提供：
+  TokenBucket         — 共用限速器（每秒請求數 + burst），偵測到節流時自動降速
+  http_statuses       — 例外附帶的 HTTP 狀態碼（response.status_code，或訊息中獨立的三位數）
+  is_throttle_error   — 判斷例外是否為資料源節流（HTTP 429 / rate limit）
+  run_pool            — 以 N 個 worker 執行 fetch_fn(ticker)，回傳失敗清單與耗時統計
+"""
+
+import io
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+THROTTLE_RETRIES = 2          # 單一 ticker 遇節流時的重排次數
+_THROTTLE_MARKERS = ('too many requests', 'rate limit')
+_THROTTLE_STATUS = 429
+# 訊息中的狀態碼必須是獨立的三位數：1429.TW / 6504.TW 這類代號不算
+_STATUS_IN_MESSAGE = re.compile(r'(?<![\w.])\d{3}(?!\w|\.\w)')
+
+
+# ─── Token Bucket ────────────────────────────────────────────
+
+class TokenBucket:
+    """
+    執行緒安全的 token-bucket 限速器。
+
+    每秒補充 rate 個 token，最多累積 burst 個；acquire() 取不到 token 時阻塞等待。
+    throttled() 將速率減半（不低於 min_rate），succeeded() 逐步恢復到初始速率。
+    """
+
+    def __init__(self, rate, burst=1, *, min_rate=0.1):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.throttle_events = 0
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self):
+        """取得一個 token，必要時阻塞等待。"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self):
+        """資料源回報節流：速率減半並清空累積的 token。"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0.0
+            self.throttle_events += 1
+            return self.rate
+
+    def succeeded(self):
+        """請求成功：速率以 10% 幅度回升，上限為初始速率。"""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._refill(time.monotonic())
+                self.rate = min(self.max_rate, self.rate * 1.1)
+
+
+def http_statuses(exc):
+    """
+    例外附帶的 HTTP 狀態碼集合。
+
+    優先取 exc.response.status_code（requests / curl_cffi）、exc.status_code 或
+    exc.code（urllib）；都沒有時才從訊息中找獨立的三位數。
+    """
+    response = getattr(exc, 'response', None)
+    for status in (getattr(response, 'status_code', None),
+                   getattr(exc, 'status_code', None), getattr(exc, 'code', None)):
+        if isinstance(status, int) and not isinstance(status, bool):
+            return {status}
+    return {int(code) for code in _STATUS_IN_MESSAGE.findall(str(exc))}
+
+
+def is_throttle_error(exc):
+    """資料源節流例外（yfinance YFRateLimitError / HTTP 429）。"""
+    if type(exc).__name__ == 'YFRateLimitError':
+        return True
+    if _THROTTLE_STATUS in http_statuses(exc):
+        return True
+    msg = str(exc).lower()
+    return any(marker in msg for marker in _THROTTLE_MARKERS)
+
+
+# ─── 每執行緒輸出緩衝 ────────────────────────────────────────
+
+class _ThreadBufferedStdout(io.TextIOBase):
+    """並行時將各 worker 的 print 暫存，整支 ticker 完成後一次輸出，避免日誌交錯。"""
+
+    def __init__(self, target):
+        self._target = target
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def begin(self):
+        self._local.buffer = io.StringIO()
+
+    def end(self):
+        buf = getattr(self._local, 'buffer', None)
+        self._local.buffer = None
+        if buf is not None:
+            with self._lock:
+                self._target.write(buf.getvalue())
+                self._target.flush()
+
+    def write(self, s):
+        buf = getattr(self._local, 'buffer', None)
+        if buf is not None:
+            return buf.write(s)
+        with self._lock:
+            return self._target.write(s)
+
+    def flush(self):
+        if getattr(self._local, 'buffer', None) is None:
+            self._target.flush()
+
+
+# ─── Worker Pool ─────────────────────────────────────────────
+
+def run_pool(tickers, fetch_fn, *, workers=1, limiter=None):
+    """
+    以有界 worker pool 執行 fetch_fn(ticker)，所有 worker 共用同一個 limiter。
+
+    Args:
+        tickers: 要抓取的 ticker 清單（依序送出）
+        fetch_fn: 單支 ticker 的抓取函數（例外視為失敗）
+        workers: 並行 worker 數（1 = 循序）
+        limiter: TokenBucket；None 表示不限速
+
+    Returns:
+        tuple: (failures, stats)
+            failures — 失敗的 ticker list（依輸入順序）
+            stats    — dict：wall / busy / count / throttled
+    """
+    tickers = list(tickers)
+    workers = max(1, min(int(workers), len(tickers) or 1))
+    busy = [0.0]
+    busy_lock = threading.Lock()
+    failed = set()
+
+    stdout = None
+    if workers > 1:
+        stdout = _ThreadBufferedStdout(sys.stdout)
+        sys.stdout = stdout
+
+    def _task(ticker):
+        if stdout is not None:
+            stdout.begin()
+        try:
+            for attempt in range(THROTTLE_RETRIES + 1):
+                if limiter is not None:
+                    limiter.acquire()
+                t0 = time.monotonic()
+                try:
+                    fetch_fn(ticker)
+                    if limiter is not None:
+                        limiter.succeeded()
+                    return True
+                except Exception as e:
+                    if limiter is not None and is_throttle_error(e) and attempt < THROTTLE_RETRIES:
+                        rate = limiter.throttled()
+                        print(f"    ⏳ {ticker} 遭節流，降速至 {rate:.2f} 次/秒後重試")
+                        continue
+                    print(f"    ⚠️ {ticker} 失敗: {e}")
+                    return False
+                finally:
+                    with busy_lock:
+                        busy[0] += time.monotonic() - t0
+            return False
+        finally:
+            if stdout is not None:
+                stdout.end()
+
+    start = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_task, t): t for t in tickers}
+            for future in as_completed(futures):
+                if not future.result():
+                    failed.add(futures[future])
+    finally:
+        if stdout is not None:
+            sys.stdout = stdout._target
+
+    stats = {
+        'wall': time.monotonic() - start,
+        'busy': busy[0],
+        'count': len(tickers),
+        'workers': workers,
+        'throttled': limiter.throttle_events if limiter is not None else 0,
+    }
+    return [t for t in tickers if t in failed], stats
+
+
+def format_pool_stats(stats):
+    """將 run_pool 統計格式化為一行摘要（牆鐘 vs 各 ticker 累計耗時）。"""
+    wall, busy = stats['wall'], stats['busy']
+    speedup = busy / wall if wall > 0 else 0
+    line = (f"⏱️  {stats['count']} 檔 / {stats['workers']} workers："
+            f"牆鐘 {wall:.1f} 秒，累計 {busy:.1f} 秒（加速 {speedup:.1f}×）")
+    if stats['throttled']:
+        line += f"，節流 {stats['throttled']} 次"
+    return line
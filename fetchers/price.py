@@ -1,78 +1,134 @@
 """
-fetchers.price — 即時報價 + 歷史走勢抓取 → stock_history
+fetchers.price — 即時報價 + 歷史走勢抓取 → price_bars / fundamental_snapshots
+
+日線只存價格與 snapshot_id；info 基本面存成當日一筆 kind='quote' 快照，
+pe / pb / 殖利率由 stock_history view 依價格推導。
+
+另提供 --quotes-only 用的批次報價：一次批次 download 抓全部持股收盤，
+沿用最新一筆日線的快照（EPS / BVPS / 每股股利不變）。
 """
 
-import sqlite3
-import contextlib
 from datetime import datetime, timedelta
 
 from stock_config import (
-    STOCK_NAME_MAPPING, SECTOR_MAPPING, DB_PATH, safe_number,
+    STOCK_NAME_MAPPING, SECTOR_MAPPING, safe_number,
 )
+from db.crud import TICKER_ID_SQL, upsert_ticker
+from db.sink import write_rows
+from .provider import get_provider
 
 _round_or_none = lambda v, n: round(v, n) if v is not None else None
 
+# 增量回填時往水位線前多抓幾天，涵蓋連假與當日即時報價列
+WATERMARK_OVERLAP_DAYS = 7
+# 估算全量回填筆數用（台股一年約 245 個交易日）
+_TRADING_DAYS_RATIO = 245 / 365
+# 批次報價每次 download 的 symbol 數
+QUOTE_BATCH_SIZE = 200
 
-# ─── Step 1: 即時報價 → stock_history (today) ────────────────
+
+# ─── info 基本面 → fundamental_snapshots ─────────────────────
+
+def _save_quote_snapshot(ticker_code, info):
+    """
+    以 ticker.info 的基本面 upsert 當日 kind='quote' 快照（每檔每日一筆）。
+    殖利率換算為每股股利（殖利率 × 現價），之後依各日價格推導。
+    """
+    price = safe_number(info.get('currentPrice') or info.get('regularMarketPrice'))
+    raw_dy = safe_number(info.get('dividendYield'), 0)
+    dividend_yield = raw_dy * 100 if raw_dy < 1 else raw_dy
+    write_rows(ticker_code, f'''
+        INSERT INTO fundamental_snapshots
+        (ticker_id, kind, available_from, eps, roe, debt_to_equity, current_ratio,
+         fcf, bvps, growth_rate, dividend)
+        VALUES ({TICKER_ID_SQL}, 'quote', date('now'), ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(ticker_id, kind, available_from) DO UPDATE SET
+            eps = excluded.eps,
+            roe = excluded.roe,
+            debt_to_equity = excluded.debt_to_equity,
+            current_ratio = excluded.current_ratio,
+            fcf = excluded.fcf,
+            bvps = excluded.bvps,
+            growth_rate = excluded.growth_rate,
+            dividend = excluded.dividend
+    ''', [(
+        ticker_code,
+        _round_or_none(safe_number(info.get('trailingEps'), default=None), 2),
+        round(safe_number(info.get('returnOnEquity'), 0) * 100, 2),
+        round(safe_number(info.get('debtToEquity'), 0) / 100, 2),
+        _round_or_none(safe_number(info.get('currentRatio'), default=None), 2),
+        round(safe_number(info.get('freeCashflow'), 0) / 1_000_000, 0),
+        _round_or_none(safe_number(info.get('bookValue'), default=None), 2),
+        round(safe_number(info.get('revenueGrowth'), 0.05) * 100, 1),
+        round(dividend_yield * price / 100, 4),
+    )])
+
+
+# 日線的快照預設指向當日 quote 快照（Step 4 會改指向季報快照）
+_QUOTE_SNAPSHOT_SQL = '''(SELECT s.id FROM fundamental_snapshots s
+            WHERE s.ticker_id = t.id AND s.kind = 'quote'
+              AND s.available_from = date('now'))'''
+
+
+# ─── Step 1: 即時報價 → price_bars (today) ───────────────────
 
 def save_current_snapshot(ticker_code, info):
     """
-    從 yf.Ticker.info 擷取即時指標，寫入 stock_history 一筆當日快照。
+    從 ticker.info 擷取即時指標：基本面寫入當日 quote 快照，
+    價格 upsert 為當日日線（同日多次同步只保留最新報價）。
 
     Args:
         ticker_code: 台股代碼
-        info: yf.Ticker.info 字典
+        info: ticker.info 字典
     """
     price = safe_number(info.get('currentPrice') or info.get('regularMarketPrice'))
     if price is None or price <= 0:
         print(f"    \u25b8 \u5373\u6642\u5831\u50f9 \u26a0\ufe0f  \u7121\u6548\u50f9\u683c ({price})\uff0c\u8df3\u904e")
         return
-    eps = safe_number(info.get('trailingEps'), default=None)
-    pe = safe_number(info.get('trailingPE'), default=None)
-    pb = safe_number(info.get('priceToBook'), default=None)
-    roe = safe_number(info.get('returnOnEquity'), 0) * 100
-    raw_dy = safe_number(info.get('dividendYield'), 0)
-    dividend_yield = raw_dy * 100 if raw_dy < 1 else raw_dy
-    debt_to_equity = safe_number(info.get('debtToEquity'), 0) / 100
-    current_ratio = safe_number(info.get('currentRatio'), default=None)
-    fcf = safe_number(info.get('freeCashflow'), 0) / 1_000_000
-    bvps = safe_number(info.get('bookValue'), default=None)
-    growth_rate = safe_number(info.get('revenueGrowth'), 0.05) * 100
-
-    with contextlib.closing(sqlite3.connect(DB_PATH)) as conn:
-        conn.execute('''
-            INSERT INTO stock_history
-            (ticker, name, sector, price, eps, pe, pb, roe, dividend_yield,
-             debt_to_equity, current_ratio, fcf, bvps, growth_rate, fetch_error)
-            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,0)
-        ''', (
-            ticker_code,
-            STOCK_NAME_MAPPING.get(ticker_code, info.get('shortName', ticker_code)),
-            SECTOR_MAPPING.get(ticker_code, '電子'),
-            round(price, 2), _round_or_none(eps, 2), _round_or_none(pe, 2), _round_or_none(pb, 2),
-            round(roe, 2), round(dividend_yield, 2), round(debt_to_equity, 2),
-            _round_or_none(current_ratio, 2), round(fcf, 0), _round_or_none(bvps, 2),
-            round(growth_rate, 1),
-        ))
-        conn.commit()
+
+    upsert_ticker(ticker_code,
+                  STOCK_NAME_MAPPING.get(ticker_code, info.get('shortName', ticker_code)),
+                  SECTOR_MAPPING.get(ticker_code, '電子'))
+    _save_quote_snapshot(ticker_code, info)
+    # 已修正過的當日日線保留其季報快照
+    write_rows(ticker_code, f'''
+        INSERT INTO price_bars (ticker_id, trade_date, price, fetch_time, fetch_error, snapshot_id)
+        SELECT t.id, date('now'), :price, datetime('now'), 0, {_QUOTE_SNAPSHOT_SQL}
+        FROM tickers t WHERE t.ticker = :ticker
+        ON CONFLICT(ticker_id, trade_date) DO UPDATE SET
+            price = excluded.price,
+            fetch_time = excluded.fetch_time,
+            fetch_error = 0,
+            snapshot_id = COALESCE(price_bars.snapshot_id, excluded.snapshot_id)
+    ''', [{'ticker': ticker_code, 'price': round(price, 2)}])
     print(f"    ▸ 即時報價 ✅  ${price:.2f}")
 
 
-# ─── Step 3: 歷史走勢 → stock_history (backfill) ────────────
+# ─── Step 3: 歷史走勢 → price_bars (backfill) ───────────────
 
-def save_historical_prices(ticker_code, stock, symbol, info, days):
+def save_historical_prices(ticker_code, stock, symbol, info, days, since=None):
     """
-    回填指定天數的日收盤進 stock_history（跳過已存在日期）。
+    回填日收盤進 price_bars（跳過已存在日期）。
+
+    有水位線（since）時只抓 since - WATERMARK_OVERLAP_DAYS 之後的缺口，
+    並與全量 days 天的舊行為比較，記錄省下的筆數與位元組。
 
     Args:
         ticker_code: 台股代碼
-        stock: yf.Ticker 物件
+        stock: provider.ticker() 物件（yf.Ticker 介面）
         symbol: 完整 ticker（如 '2330.TW'）
-        info: yf.Ticker.info 字典
-        days: 回填天數
+        info: ticker.info 字典
+        days: 全量回填天數（新股票或 --full-backfill）
+        since: 已存資料的最新日期 'YYYY-MM-DD'；None 表示全量回填
     """
     end_date = datetime.now()
     start_date = end_date - timedelta(days=days)
+    incremental = False
+    if since:
+        gap_start = datetime.strptime(since, '%Y-%m-%d') - timedelta(days=WATERMARK_OVERLAP_DAYS)
+        if gap_start > start_date:
+            start_date = gap_start
+            incremental = True
 
     try:
         hist = stock.history(start=start_date, end=end_date)
@@ -80,60 +136,110 @@ def save_historical_prices(ticker_code, stock, symbol, info, days):
         print(f"    ▸ 歷史走勢 ❌  {e}")
         return
 
+    if incremental:
+        requested_days = max(0, (end_date - start_date).days)
+        full_rows = int(days * _TRADING_DAYS_RATIO)
+        saved_rows = max(0, full_rows - len(hist))
+        saved_note = f"，增量 {requested_days}/{days} 天，省下約 {saved_rows} 筆"
+        if not hist.empty:
+            row_bytes = hist.memory_usage(index=True).sum() / len(hist)
+            saved_note += f" / {saved_rows * row_bytes / 1024:.1f} KB"
+    else:
+        saved_note = ''
+
     if hist.empty:
-        print("    ▸ 歷史走勢 ⚠️  無資料")
+        print(f"    ▸ 歷史走勢 ⚠️  無資料{saved_note}")
         return
 
-    # 用即時基本面填充（後續 Step 4 會以季報修正）
-    fund = {
-        'eps': safe_number(info.get('trailingEps'), default=None),
-        'pe': safe_number(info.get('trailingPE'), default=None),
-        'pb': safe_number(info.get('priceToBook'), default=None),
-        'roe': safe_number(info.get('returnOnEquity'), 0) * 100,
-        'dy': safe_number(info.get('dividendYield'), 0) * 100,
-        'de': safe_number(info.get('debtToEquity'), 0) / 100,
-        'cr': safe_number(info.get('currentRatio'), default=None),
-        'fcf': safe_number(info.get('freeCashflow'), 0) / 1_000_000,
-        'bvps': safe_number(info.get('bookValue'), default=None),
-        'gr': safe_number(info.get('revenueGrowth'), 0.05) * 100,
-    }
-
-    with contextlib.closing(sqlite3.connect(DB_PATH)) as conn:
-        cursor = conn.cursor()
-        inserted = 0
-
-        for date, row in hist.iterrows():
-            close = safe_number(row['Close'])
-            if close <= 0:
-                continue
-            date_str = date.strftime('%Y-%m-%d %H:%M:%S')
+    rows = []
+    for date, row in hist.iterrows():
+        close = safe_number(row['Close'])
+        if close <= 0:
+            continue
+        date_str = date.strftime('%Y-%m-%d %H:%M:%S')
+        rows.append({'ticker': ticker_code, 'trade_date': date_str[:10],
+                     'price': round(close, 2), 'fetch_time': date_str})
+
+    # 先指向當日 quote 快照（即時基本面），後續 Step 4 會以季報修正
+    upsert_ticker(ticker_code, STOCK_NAME_MAPPING.get(ticker_code),
+                  SECTOR_MAPPING.get(ticker_code))
+    _save_quote_snapshot(ticker_code, info)
+
+    # 整個 frame 一次寫入；已存在的 (ticker_id, trade_date) 由主鍵跳過
+    inserted = write_rows(ticker_code, f'''
+        INSERT INTO price_bars (ticker_id, trade_date, price, fetch_time, fetch_error, snapshot_id)
+        SELECT t.id, :trade_date, :price, :fetch_time, 0, {_QUOTE_SNAPSHOT_SQL}
+        FROM tickers t WHERE t.ticker = :ticker
+        ON CONFLICT(ticker_id, trade_date) DO NOTHING
+    ''', rows)
+    if inserted is None:
+        print(f"    ▸ 歷史走勢 ✅  {len(rows)} 交易日（已排入寫入佇列）{saved_note}")
+    else:
+        print(f"    ▸ 歷史走勢 ✅  {inserted} 交易日{saved_note}")
+
+
+# ─── 批次報價（--quotes-only）────────────────────────────────
+
+def fetch_latest_quotes(symbols):
+    """
+    以 provider.download 批次抓取多檔最近收盤（每 QUOTE_BATCH_SIZE 檔一次請求）。
 
-            cursor.execute(
-                'SELECT COUNT(*) FROM stock_history '
-                'WHERE ticker = ? AND date(fetch_time) = date(?)',
-                (ticker_code, date_str))
-            if cursor.fetchone()[0] > 0:
+    Args:
+        symbols: 完整 ticker list（如 ['2330.TW', '6488.TWO']）
+
+    Returns:
+        dict: {symbol: (trade_date 'YYYY-MM-DD', close)}；無資料的 symbol 不列入
+    """
+    quotes = {}
+    for i in range(0, len(symbols), QUOTE_BATCH_SIZE):
+        chunk = symbols[i:i + QUOTE_BATCH_SIZE]
+        try:
+            df = get_provider().download(chunk, period='5d', interval='1d', group_by='ticker',
+                                         progress=False, threads=True)
+        except Exception as e:
+            print(f"    ▸ 批次報價 ❌  {e}")
+            continue
+        if df is None or df.empty:
+            continue
+        multi = getattr(df.columns, 'nlevels', 1) > 1
+        for symbol in chunk:
+            try:
+                close = (df[symbol]['Close'] if multi else df['Close']).dropna()
+            except KeyError:
+                continue
+            if close.empty:
                 continue
+            price = safe_number(close.iloc[-1])
+            if price > 0:
+                quotes[symbol] = (close.index[-1].strftime('%Y-%m-%d'), round(price, 2))
+    return quotes
 
-            cursor.execute('''
-                INSERT INTO stock_history
-                (ticker, name, sector, price, eps, pe, pb, roe, dividend_yield,
-                 debt_to_equity, current_ratio, fcf, bvps, growth_rate,
-                 fetch_error, fetch_time)
-                VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,0,?)
-            ''', (
-                ticker_code,
-                STOCK_NAME_MAPPING.get(ticker_code, ticker_code),
-                SECTOR_MAPPING.get(ticker_code, '電子'),
-                round(close, 2),
-                _round_or_none(fund['eps'], 2), _round_or_none(fund['pe'], 2),
-                _round_or_none(fund['pb'], 2), round(fund['roe'], 2),
-                round(fund['dy'], 2), round(fund['de'], 2),
-                _round_or_none(fund['cr'], 2), round(fund['fcf'], 0),
-                _round_or_none(fund['bvps'], 2), round(fund['gr'], 1),
-                date_str,
-            ))
-            inserted += 1
-
-        conn.commit()
-    print(f"    ▸ 歷史走勢 ✅  {inserted} 交易日")
+
+def save_quotes_only(quotes):
+    """
+    upsert 各股當日日線：價格取自批次報價，快照沿用最新一筆成功日線
+    （eps / bvps / 每股股利不變，pe / pb / 殖利率由 view 依新價格推導）。
+
+    Args:
+        quotes: {ticker: (trade_date, price)}
+
+    Returns:
+        int | None: 寫入筆數（排入 sink 時為 None）
+    """
+    now = datetime.now().strftime('%H:%M:%S')
+    rows = [
+        {'ticker': t, 'price': price, 'trade_date': d, 'fetch_time': f"{d} {now}"}
+        for t, (d, price) in quotes.items()
+    ]
+    return write_rows('quotes', '''
+        INSERT INTO price_bars (ticker_id, trade_date, price, fetch_time, fetch_error, snapshot_id)
+        SELECT l.ticker_id, :trade_date, :price, :fetch_time, 0, b.snapshot_id
+        FROM tickers t
+        INNER JOIN stock_latest l ON l.ticker_id = t.id
+        INNER JOIN price_bars b ON b.ticker_id = l.ticker_id AND b.trade_date = l.latest_ok_date
+        WHERE t.ticker = :ticker
+        ON CONFLICT(ticker_id, trade_date) DO UPDATE SET
+            price = excluded.price,
+            fetch_time = excluded.fetch_time,
+            fetch_error = 0
+    ''', rows)
@@ -0,0 +1,429 @@
+"""
+fetchers.provider — 資料源抽象層
+
+所有 fetcher 透過 get_provider() 取得報價 / 財報，不再直接 import yfinance：
+  provider.ticker(symbol)        — 回傳具 yf.Ticker 介面的物件
+                                   （info / financials / balance_sheet / cashflow /
+                                    quarterly_* / dividends / history()）
+  provider.download(symbols,...) — 多檔批次日線（同 yf.download，group_by='ticker'）
+
+實作：
+  YFinanceProvider  — 真實 yfinance（預設）
+  RecordingProvider — 包裝另一個 provider，把每次回應存到 fixtures 目錄
+  ReplayProvider    — 從 fixtures 目錄重播錄下的回應（不連網）
+  SyntheticProvider — 依 symbol 產生可重現的假資料（不連網、不需 fixtures）
+
+Replay / Synthetic 可設定每次呼叫的人工延遲，用來離線、可重現地量測同步吞吐量。
+"""
+
+import abc
+import contextlib
+import os
+import pickle
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+
+_PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_FIXTURES_DIR = os.path.join(_PROJECT_DIR, 'fixtures')
+
+# 具 TTL 的 payload 屬性（與 fetchers.cache 對應），history() 另外處理
+PAYLOAD_ATTRS = (
+    'info', 'dividends',
+    'financials', 'balance_sheet', 'cashflow',
+    'quarterly_financials', 'quarterly_balance_sheet', 'quarterly_cashflow',
+)
+
+
+class ProviderError(Exception):
+    """Replay / Synthetic 找不到資料時拋出（等同真實資料源查無此 symbol）。"""
+
+
+# ─── yfinance ────────────────────────────────────────────────
+
+class YFinanceProvider:
+    name = 'yfinance'
+
+    def __init__(self):
+        import yfinance as yf
+        self._yf = yf
+
+    def ticker(self, symbol):
+        return self._yf.Ticker(symbol)
+
+    def download(self, symbols, **kwargs):
+        kwargs.setdefault('group_by', 'ticker')
+        kwargs.setdefault('progress', False)
+        return self._yf.download(symbols, **kwargs)
+
+
+# ─── Recording ───────────────────────────────────────────────
+
+def _fixture_path(root, symbol, kind):
+    return os.path.join(root, symbol, f'{kind}.pkl')
+
+
+def _read_fixture(root, symbol, kind):
+    path = _fixture_path(root, symbol, kind)
+    if not os.path.isfile(path):
+        raise ProviderError(f'{symbol}: 無 {kind} fixture')
+    with open(path, 'rb') as f:
+        return pickle.loads(zlib.decompress(f.read()))
+
+
+def _write_fixture(root, symbol, kind, value):
+    path = _fixture_path(root, symbol, kind)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+    os.replace(tmp, path)
+
+
+def _merge_frames(old, new):
+    """合併兩段日線（同日以新資料為準）。"""
+    import pandas as pd
+    merged = pd.concat([old, new])
+    return merged[~merged.index.duplicated(keep='last')].sort_index()
+
+
+class _RecordingTicker:
+    def __init__(self, stock, symbol, provider):
+        self._stock = stock
+        self._symbol = symbol
+        self._provider = provider
+
+    def __getattr__(self, name):
+        value = getattr(self._stock, name)
+        if name in PAYLOAD_ATTRS and value is not None:
+            self._provider.record(self._symbol, name, value)
+        return value
+
+    def history(self, *args, **kwargs):
+        hist = self._stock.history(*args, **kwargs)
+        if hist is not None and not hist.empty:
+            self._provider.record_history(self._symbol, hist)
+        return hist
+
+
+class RecordingProvider:
+    """包裝 inner provider，將回應寫入 fixtures/<symbol>/<kind>.pkl。"""
+    name = 'record'
+
+    def __init__(self, inner, root=DEFAULT_FIXTURES_DIR):
+        self.inner = inner
+        self.root = root
+        self._lock = threading.Lock()
+
+    def record(self, symbol, kind, value):
+        with self._lock:
+            _write_fixture(self.root, symbol, kind, value)
+
+    def record_history(self, symbol, hist):
+        with self._lock:
+            try:
+                hist = _merge_frames(_read_fixture(self.root, symbol, 'history'), hist)
+            except ProviderError:
+                pass
+            _write_fixture(self.root, symbol, 'history', hist)
+
+    def ticker(self, symbol):
+        return _RecordingTicker(self.inner.ticker(symbol), symbol, self)
+
+    def download(self, symbols, **kwargs):
+        df = self.inner.download(symbols, **kwargs)
+        if df is not None and not df.empty:
+            multi = getattr(df.columns, 'nlevels', 1) > 1
+            for symbol in ([symbols] if isinstance(symbols, str) else symbols):
+                try:
+                    sub = df[symbol] if multi else df
+                except KeyError:
+                    continue
+                sub = sub.dropna(how='all')
+                if not sub.empty:
+                    self.record_history(symbol, sub)
+        return df
+
+
+# ─── 離線 provider 共用 ──────────────────────────────────────
+
+def _period_start(end, period):
+    """yf 的 period 字串（'5d' / '1mo' / '1y'）→ 起始日。"""
+    if not period:
+        return end - timedelta(days=30)
+    unit_days = {'d': 1, 'wk': 7, 'mo': 31, 'y': 366}
+    for unit, days in unit_days.items():
+        if period.endswith(unit) and period[:-len(unit)].isdigit():
+            return end - timedelta(days=int(period[:-len(unit)]) * days)
+    return end - timedelta(days=30)
+
+
+def _slice(hist, start, end):
+    """取 [start, end) 區間；錄下的 yfinance 日線帶時區時，naive 日期視為同時區。"""
+    import pandas as pd
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    tz = getattr(hist.index, 'tz', None)
+    if tz is not None:
+        start = start.tz_localize(tz) if start.tzinfo is None else start
+        end = end.tz_localize(tz) if end.tzinfo is None else end
+    return hist[(hist.index >= start) & (hist.index < end)]
+
+
+def _period_ends(end, periods, freq):
+    """季底 / 年底序列（相容 pandas 2.2 前後的 freq 別名）。"""
+    import pandas as pd
+    aliases = {'Q': ('QE', 'Q'), 'Y': ('YE', 'A')}[freq]
+    for alias in aliases:
+        try:
+            return pd.date_range(end=end, periods=periods, freq=alias)
+        except ValueError:
+            continue
+    raise ValueError(freq)
+
+
+class _OfflineProvider(abc.ABC):
+    """Replay / Synthetic 共用：人工延遲、history 切片與 download 組裝。"""
+
+    def __init__(self, latency=0.0):
+        self.latency = max(0.0, float(latency))
+
+    def _sleep(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    @abc.abstractmethod
+    def _history(self, symbol):
+        """symbol 的完整日線 DataFrame；查無資料時拋出 ProviderError。"""
+
+    @abc.abstractmethod
+    def payload(self, symbol, kind):
+        """symbol 的 PAYLOAD_ATTRS 屬性值（_OfflineTicker 讀取）。"""
+
+    def history(self, symbol, start=None, end=None, period=None, **_):
+        self._sleep()
+        hist = self._history(symbol)
+        end = end or datetime.now()
+        start = start or _period_start(end, period)
+        return _slice(hist, start, end)
+
+    def download(self, symbols, period=None, start=None, end=None, **_):
+        import pandas as pd
+        self._sleep()
+        end = end or datetime.now()
+        start = start or _period_start(end, period)
+        frames = {}
+        for symbol in ([symbols] if isinstance(symbols, str) else symbols):
+            try:
+                hist = self._history(symbol)
+            except ProviderError:
+                continue
+            frames[symbol] = _slice(hist, start, end)
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, axis=1)
+
+
+class _OfflineTicker:
+    def __init__(self, provider, symbol):
+        self._provider = provider
+        self._symbol = symbol
+        self._memo = {}
+
+    def __getattr__(self, name):
+        if name not in PAYLOAD_ATTRS:
+            raise AttributeError(name)
+        if name not in self._memo:
+            self._provider._sleep()
+            self._memo[name] = self._provider.payload(self._symbol, name)
+        return self._memo[name]
+
+    def history(self, start=None, end=None, period=None, **kwargs):
+        return self._provider.history(self._symbol, start=start, end=end,
+                                      period=period, **kwargs)
+
+
+# ─── Replay ──────────────────────────────────────────────────
+
+class ReplayProvider(_OfflineProvider):
+    """從 RecordingProvider 錄下的 fixtures 重播。"""
+    name = 'replay'
+
+    def __init__(self, root=DEFAULT_FIXTURES_DIR, latency=0.0):
+        super().__init__(latency)
+        self.root = root
+
+    def payload(self, symbol, kind):
+        try:
+            return _read_fixture(self.root, symbol, kind)
+        except ProviderError:
+            if kind == 'info':
+                return {}          # 同 yfinance：查無此 symbol 時 info 不含 'symbol'
+            raise
+
+    def _history(self, symbol):
+        return _read_fixture(self.root, symbol, 'history')
+
+    def ticker(self, symbol):
+        return _OfflineTicker(self, symbol)
+
+
+# ─── Synthetic ───────────────────────────────────────────────
+
+class SyntheticProvider(_OfflineProvider):
+    """
+    依 symbol 雜湊產生可重現的假資料：約 1/5 的代碼為上櫃（只有 .TWO 有資料），
+    日線為隨機漫步，另有 4 年年報、8 季季報與年度股利。
+    """
+    name = 'synthetic'
+    HISTORY_DAYS = 3 * 365
+
+    def __init__(self, latency=0.0, seed=0):
+        super().__init__(latency)
+        self.seed = seed
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def _rng(self, symbol, salt=''):
+        import numpy as np
+        return np.random.default_rng(zlib.crc32(f'{self.seed}:{symbol}:{salt}'.encode()))
+
+    def _exists(self, symbol):
+        code, _, suffix = symbol.partition('.')
+        is_otc = zlib.crc32(code.encode()) % 5 == 0
+        return suffix == ('TWO' if is_otc else 'TW')
+
+    def _history(self, symbol):
+        import pandas as pd
+        if not self._exists(symbol):
+            raise ProviderError(f'{symbol}: 查無資料')
+        with self._lock:
+            if symbol not in self._frames:
+                rng = self._rng(symbol, 'history')
+                today = pd.Timestamp(datetime.now().date())
+                index = pd.bdate_range(end=today, periods=int(self.HISTORY_DAYS * 5 / 7))
+                base = float(rng.uniform(20, 800))
+                close = base * (1 + rng.normal(0, 0.015, len(index))).cumprod()
+                self._frames[symbol] = pd.DataFrame({
+                    'Open': close, 'High': close * 1.01, 'Low': close * 0.99, 'Close': close,
+                    'Volume': rng.integers(1_000, 5_000_000, len(index)),
+                    'Dividends': 0.0, 'Stock Splits': 0.0,
+                }, index=index)
+            return self._frames[symbol]
+
+    def _statements(self, symbol, quarterly):
+        import pandas as pd
+        rng = self._rng(symbol, 'quarterly' if quarterly else 'annual')
+        today = pd.Timestamp(datetime.now().date())
+        if quarterly:
+            ends = _period_ends(today - pd.Timedelta(days=60), 8, 'Q')
+            scale = 1.0
+        else:
+            ends = _period_ends(today - pd.Timedelta(days=120), 4, 'Y')
+            scale = 4.0
+        shares = float(rng.uniform(1e8, 3e10))
+        revenue = rng.uniform(1e9, 5e11, len(ends)) * scale
+        net_income = revenue * rng.uniform(0.02, 0.35, len(ends))
+        equity = shares * rng.uniform(10, 200, len(ends))
+        fin = pd.DataFrame({
+            'Basic EPS': net_income / shares,
+            'Net Income': net_income,
+            'Total Revenue': revenue,
+            'Operating Income': net_income * 1.2,
+        }, index=ends).T
+        bal = pd.DataFrame({
+            'Stockholders Equity': equity,
+            'Total Debt': equity * rng.uniform(0.05, 1.5, len(ends)),
+            'Total Assets': equity * rng.uniform(1.2, 3.0, len(ends)),
+            'Ordinary Shares Number': shares,
+        }, index=ends).T
+        cf = pd.DataFrame({
+            'Free Cash Flow': net_income * rng.uniform(0.3, 1.2, len(ends)),
+        }, index=ends).T
+        # yfinance 的財報欄位為新 → 舊
+        return fin.iloc[:, ::-1], bal.iloc[:, ::-1], cf.iloc[:, ::-1]
+
+    def payload(self, symbol, kind):
+        import pandas as pd
+        if not self._exists(symbol):
+            if kind == 'info':
+                return {}
+            return pd.DataFrame() if kind != 'dividends' else pd.Series(dtype=float)
+
+        if kind == 'info':
+            rng = self._rng(symbol, 'info')
+            price = float(self._history(symbol)['Close'].iloc[-1])
+            eps = float(rng.uniform(0.5, 60))
+            bvps = float(rng.uniform(10, 300))
+            return {
+                'symbol': symbol,
+                'shortName': f'SYN {symbol}',
+                'currentPrice': price,
+                'trailingEps': eps,
+                'trailingPE': price / eps,
+                'priceToBook': price / bvps,
+                'bookValue': bvps,
+                'returnOnEquity': float(rng.uniform(0.02, 0.35)),
+                'dividendYield': float(rng.uniform(0, 0.06)),
+                'debtToEquity': float(rng.uniform(5, 150)),
+                'currentRatio': float(rng.uniform(0.8, 3)),
+                'freeCashflow': float(rng.uniform(1e8, 1e11)),
+                'revenueGrowth': float(rng.normal(0.05, 0.1)),
+            }
+        if kind == 'dividends':
+            rng = self._rng(symbol, 'dividends')
+            years = range(datetime.now().year - 4, datetime.now().year)
+            dates = pd.DatetimeIndex([pd.Timestamp(y, 7, 15) for y in years])
+            return pd.Series(rng.uniform(0.5, 20, len(dates)), index=dates)
+
+        quarterly = kind.startswith('quarterly_')
+        fin, bal, cf = self._statements(symbol, quarterly)
+        base = kind[len('quarterly_'):] if quarterly else kind
+        return {'financials': fin, 'balance_sheet': bal, 'cashflow': cf}[base]
+
+    def ticker(self, symbol):
+        return _OfflineTicker(self, symbol)
+
+
+# ─── 啟用中的 provider ───────────────────────────────────────
+
+PROVIDER_NAMES = ('yfinance', 'record', 'replay', 'synthetic')
+_provider = None
+
+
+def make_provider(name='yfinance', *, fixtures=DEFAULT_FIXTURES_DIR, latency=0.0):
+    """依名稱建立 provider（record = yfinance + 錄製到 fixtures）。"""
+    if name == 'yfinance':
+        return YFinanceProvider()
+    if name == 'record':
+        return RecordingProvider(YFinanceProvider(), fixtures)
+    if name == 'replay':
+        return ReplayProvider(fixtures, latency=latency)
+    if name == 'synthetic':
+        return SyntheticProvider(latency=latency)
+    raise ValueError(f'未知的 provider: {name}')
+
+
+def get_provider():
+    """回傳目前的 provider（首次呼叫時建立 YFinanceProvider）。"""
+    global _provider
+    if _provider is None:
+        _provider = YFinanceProvider()
+    return _provider
+
+
+def set_provider(provider):
+    global _provider
+    _provider = provider
+
+
+@contextlib.contextmanager
+def use_provider(provider):
+    """在區塊內暫時改用指定的 provider。"""
+    global _provider
+    previous = _provider
+    _provider = provider
+    try:
+        yield provider
+    finally:
+        _provider = previous
@@ -0,0 +1,244 @@
+"""
+fetchers.resilience — 資料源呼叫的重試 / 退避 / 斷路器
+
+單次網路抖動不應讓整支 ticker 當天失敗，資料源當機也不應讓每支 ticker
+依序等完自己的逾時。ResilientProvider 包裝任一 provider，
+對每次 payload 屬性讀取、history() 與 download() 套用：
+
+  classify_error  — 節流 / 可重試 / 致命 三類
+  RetryPolicy     — 可重試錯誤以帶 jitter 的指數退避重試
+  CircuitBreaker  — 全程共用，連續 N 次失敗後跳脫，其餘呼叫立即失敗
+
+節流錯誤不在此重試，直接交給 run_pool 降速重排（fetchers.pool）。
+"""
+
+import random
+import threading
+import time
+
+from .pool import http_statuses, is_throttle_error
+from .provider import PAYLOAD_ATTRS, ProviderError
+
+DEFAULT_RETRIES = 3            # 第一次之外的重試次數
+DEFAULT_BACKOFF_BASE = 0.5     # 秒
+DEFAULT_BACKOFF_CAP = 8.0      # 秒
+DEFAULT_BREAKER_THRESHOLD = 5  # 連續失敗幾次後跳脫（0 = 停用）
+
+# 資料已回應但內容有問題：重試也不會變好
+_FATAL_TYPES = (ProviderError, KeyError, IndexError, TypeError, AttributeError,
+                NotImplementedError)
+# requests / curl_cffi / json 的暫時性錯誤（以類別名稱判斷，不需 import 這些套件）
+_RETRYABLE_NAMES = {
+    'RequestsError', 'CurlError', 'Timeout', 'ReadTimeout', 'ConnectTimeout',
+    'ChunkedEncodingError', 'ProtocolError', 'JSONDecodeError',
+}
+_RETRYABLE_MARKERS = (
+    'timed out', 'timeout', 'connection reset', 'connection aborted',
+    'temporarily unavailable', 'bad gateway', 'service unavailable',
+)
+# 伺服器端暫時性錯誤；其餘 4xx 表示請求本身有問題，重試也不會變好
+_RETRYABLE_STATUS = {500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """斷路器已跳脫：本次執行剩餘的資料源呼叫一律立即失敗。"""
+
+
+def classify_error(exc):
+    """
+    將資料源例外分類。
+
+    Returns:
+        str: 'throttle'（交給 pool 降速）/ 'retryable'（退避後重試）/ 'fatal'（直接失敗）
+    """
+    if is_throttle_error(exc):
+        return 'throttle'
+    if isinstance(exc, CircuitOpenError):
+        return 'fatal'
+    statuses = http_statuses(exc)
+    if statuses & _RETRYABLE_STATUS:
+        return 'retryable'
+    if type(exc).__name__ in _RETRYABLE_NAMES:
+        return 'retryable'
+    if isinstance(exc, _FATAL_TYPES):
+        return 'fatal'
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return 'retryable'
+    # requests 的 HTTPError 也是 OSError：有 4xx 狀態碼時以狀態碼為準
+    if any(400 <= status < 500 for status in statuses):
+        return 'fatal'
+    if isinstance(exc, OSError):
+        return 'retryable'
+    msg = str(exc).lower()
+    if any(marker in msg for marker in _RETRYABLE_MARKERS):
+        return 'retryable'
+    return 'fatal'
+
+
+# ─── Retry Policy ────────────────────────────────────────────
+
+class RetryPolicy:
+    """
+    帶 full jitter 的指數退避：第 n 次重試前等待 uniform(0, min(cap, base × 2ⁿ)) 秒。
+
+    Args:
+        retries: 第一次之外最多重試幾次
+        base: 退避基準秒數
+        cap: 單次等待上限秒數
+    """
+
+    def __init__(self, retries=DEFAULT_RETRIES, *, base=DEFAULT_BACKOFF_BASE,
+                 cap=DEFAULT_BACKOFF_CAP, sleep=time.sleep):
+        self.retries = max(0, int(retries))
+        self.base = float(base)
+        self.cap = float(cap)
+        self._sleep = sleep
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.cap, self.base * (2 ** attempt)))
+
+    def wait(self, attempt):
+        delay = self.backoff(attempt)
+        self._sleep(delay)
+        return delay
+
+
+# ─── Circuit Breaker ─────────────────────────────────────────
+
+class CircuitBreaker:
+    """
+    執行緒安全的斷路器：連續 threshold 次可重試錯誤後跳脫，
+    本次執行不再半開恢復；任何成功（或資料源有回應的致命錯誤）都會歸零計數。
+    """
+
+    def __init__(self, threshold=DEFAULT_BREAKER_THRESHOLD):
+        self.threshold = max(0, int(threshold))
+        self.consecutive = 0
+        self.trips = 0
+        self.is_open = False
+        self._lock = threading.Lock()
+
+    def check(self):
+        if self.is_open:
+            raise CircuitOpenError(f'資料源斷路器已跳脫（連續失敗 {self.threshold} 次）')
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive = 0
+
+    def record_failure(self):
+        """記錄一次失敗；回傳本次是否使斷路器跳脫。"""
+        with self._lock:
+            self.consecutive += 1
+            if self.threshold and not self.is_open and self.consecutive >= self.threshold:
+                self.is_open = True
+                self.trips += 1
+                return True
+            return False
+
+
+# ─── Provider 包裝 ───────────────────────────────────────────
+
+class ResilientProvider:
+    """
+    包裝任一 provider：所有會發出請求的呼叫都經過 RetryPolicy 與共用的 CircuitBreaker。
+    """
+
+    def __init__(self, inner, *, policy=None, breaker=None):
+        self._inner = inner
+        self.policy = policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'calls': 0,
+            'retries': 0,
+            'recovered': 0,
+            'gave_up': 0,
+            'fatal': 0,
+            'throttled': 0,
+            'short_circuited': 0,
+            'backoff_seconds': 0.0,
+        }
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+    def _bump(self, **kwargs):
+        with self._stats_lock:
+            for key, value in kwargs.items():
+                self._stats[key] += value
+
+    def call(self, fn, *args, **kwargs):
+        """執行 fn(*args, **kwargs)，依錯誤分類重試或失敗。"""
+        self._bump(calls=1)
+        for attempt in range(self.policy.retries + 1):
+            try:
+                self.breaker.check()
+            except CircuitOpenError:
+                self._bump(short_circuited=1)
+                raise
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                kind = classify_error(e)
+                if kind == 'throttle':
+                    self._bump(throttled=1)
+                    raise
+                if kind == 'fatal':
+                    self.breaker.record_success()
+                    self._bump(fatal=1)
+                    raise
+                if self.breaker.record_failure():
+                    print(f"    🔌 資料源連續失敗 {self.breaker.threshold} 次，斷路器跳脫，"
+                          f"其餘呼叫將立即失敗")
+                if attempt >= self.policy.retries or self.breaker.is_open:
+                    self._bump(gave_up=1)
+                    raise
+                delay = self.policy.wait(attempt)
+                self._bump(retries=1, backoff_seconds=delay)
+                print(f"    🔁 {type(e).__name__}: {e}（{delay:.1f} 秒後第 {attempt + 1} 次重試）")
+                continue
+            self.breaker.record_success()
+            if attempt:
+                self._bump(recovered=1)
+            return result
+
+    def ticker(self, symbol):
+        return _ResilientTicker(self._inner.ticker(symbol), self)
+
+    def download(self, symbols, **kwargs):
+        return self.call(self._inner.download, symbols, **kwargs)
+
+    def stats(self):
+        with self._stats_lock:
+            s = dict(self._stats)
+        s['trips'] = self.breaker.trips
+        s['open'] = self.breaker.is_open
+        return s
+
+
+class _ResilientTicker:
+    """payload 屬性與 history() 經由 ResilientProvider.call 取得，其餘直接轉發。"""
+
+    def __init__(self, stock, provider):
+        self._stock = stock
+        self._provider = provider
+
+    def __getattr__(self, name):
+        if name in PAYLOAD_ATTRS:
+            return self._provider.call(getattr, self._stock, name)
+        if name == 'history':
+            return lambda *args, **kwargs: self._provider.call(self._stock.history, *args, **kwargs)
+        return getattr(self._stock, name)
+
+
+def format_resilience_stats(stats):
+    """將 ResilientProvider.stats() 格式化為一行摘要。"""
+    line = (f"🔁 資料源呼叫 {stats['calls']} 次：重試 {stats['retries']} 次"
+            f"（退避 {stats['backoff_seconds']:.1f} 秒），重試後成功 {stats['recovered']}，"
+            f"放棄 {stats['gave_up']}，致命 {stats['fatal']}")
+    if stats['throttled']:
+        line += f"，節流 {stats['throttled']}"
+    if stats['trips']:
+        line += f"，🔌 斷路器跳脫（略過 {stats['short_circuited']} 次呼叫）"
+    return line
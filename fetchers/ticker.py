@@ -1,13 +1,128 @@
 """
 fetchers.ticker — Ticker 解析（.TW / .TWO 自動偵測）
+
+解析結果存入 tickers 維度表（suffix / exchange / verified_at）：
+  • 已登錄且未超過 TICKER_REGISTRY_TTL_DAYS → 只驗證登錄的 symbol
+  • 驗證失敗、未登錄或已過期             → 依 .TW → .TWO 重新探測
+
+探測時只有「查無此 symbol」才改試下一個後綴；節流、斷路器跳脫、重試用盡等
+資料源錯誤一律往上拋，由 run_pool 降速重排或記為失敗。
 """
 
-import yfinance as yf
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import stock_config
+from stock_config import TICKER_REGISTRY_TTL_DAYS
+from db.sink import write_rows
+from db.connection import shared_connection
+from .pool import http_statuses
+from .provider import ProviderError, get_provider
+
+SUFFIXES = ['.TW', '.TWO']
+EXCHANGES = {'.TW': 'TWSE', '.TWO': 'TPEx'}
+BULK_PROBE_CHUNK = 100
+
+# yfinance 查無此 symbol 時的例外（以類別名稱判斷，不需 import yfinance）
+_MISSING_SYMBOL_NAMES = {'YFTickerMissingError', 'YFPricesMissingError'}
+_MISSING_SYMBOL_STATUS = 404
+
+
+class TickerNotFoundError(LookupError):
+    """.TW / .TWO 都查無資料。"""
+
+
+# ─── tickers 交易所解析 ──────────────────────────────────────
+
+def _load_registry(tickers=None):
+    """讀取 tickers 中已解析交易所者，回傳 {ticker: (symbol, verified_at)}。"""
+    if not os.path.exists(stock_config.DB_PATH):
+        return {}
+    with shared_connection() as conn:
+        try:
+            rows = conn.execute(
+                'SELECT ticker, ticker || suffix, verified_at FROM tickers '
+                'WHERE suffix IS NOT NULL').fetchall()
+        except sqlite3.OperationalError:
+            return {}
+    wanted = set(tickers) if tickers is not None else None
+    return {t: (sym, ts) for t, sym, ts in rows if wanted is None or t in wanted}
 
 
-def resolve_ticker(ticker_code, check_attr='info'):
+def _is_fresh(verified_at, ttl_days):
+    if not verified_at:
+        return False
+    try:
+        verified = datetime.strptime(str(verified_at)[:19], '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return False
+    now = datetime.now(timezone.utc).replace(tzinfo=None)  # verified_at 為 UTC
+    return now - verified < timedelta(days=ttl_days)
+
+
+def _record(resolved):
+    """將 {ticker: symbol} 的交易所後綴寫入 tickers（verified_at = 現在）。"""
+    rows = []
+    for ticker, symbol in resolved.items():
+        suffix = symbol[len(ticker):]
+        rows.append((ticker, suffix, EXCHANGES.get(suffix, suffix)))
+    # 單支解析（fetch 流程內）歸在該 ticker 名下，與它的其他寫入同進退
+    owner = next(iter(resolved)) if len(resolved) == 1 else 'tickers'
+    write_rows(owner, '''
+        INSERT INTO tickers (ticker, suffix, exchange, verified_at)
+        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(ticker) DO UPDATE SET
+            suffix = excluded.suffix,
+            exchange = excluded.exchange,
+            verified_at = excluded.verified_at
+    ''', rows)
+
+
+def registered_symbols(tickers):
+    """回傳 {ticker: symbol}（僅限 tickers 中已解析交易所者，不檢查 TTL）。"""
+    return {t: sym for t, (sym, _) in _load_registry(tickers).items()}
+
+
+# ─── 單支解析 ────────────────────────────────────────────────
+
+def _is_missing_symbol(exc):
+    """例外代表資料源查無此 symbol（而不是資料源本身出錯）。"""
+    if isinstance(exc, ProviderError):
+        return True
+    if type(exc).__name__ in _MISSING_SYMBOL_NAMES:
+        return True
+    return http_statuses(exc) == {_MISSING_SYMBOL_STATUS}
+
+
+def _probe(symbol, check_attr):
+    """
+    由 provider 建立 ticker 並以 check_attr 驗證；有效回傳 ticker，查無資料回傳 None。
+    其餘例外（節流 / CircuitOpenError / 致命或重試用盡）照常拋出，不可當成查無此 symbol。
     """
-    嘗試 .TW（上市）→ .TWO（上櫃），回傳 (stock, symbol) 或 (None, None)。
+    stock = get_provider().ticker(symbol)
+    try:
+        if check_attr == 'info':
+            info = stock.info
+            if info and 'symbol' in info:
+                return stock
+        else:
+            data = getattr(stock, check_attr, None)
+            if data is not None and not data.empty:
+                return stock
+    except Exception as e:
+        if not _is_missing_symbol(e):
+            raise
+    return None
+
+
+def resolve_ticker(ticker_code, check_attr='info', *, ttl_days=None):
+    """
+    先查 tickers 已登錄的交易所，未命中或失效才嘗試 .TW（上市）→ .TWO（上櫃），
+    回傳 (stock, symbol) 或 (None, None)。
+
+    驗證登錄的 symbol 時所下載的 check_attr 會留在 ticker 物件內，
+    呼叫端隨後讀取同一屬性不會再發出請求，因此命中時只有一次 round-trip。
 
     Args:
         ticker_code: 台股代碼（如 '2330'）
@@ -15,22 +130,83 @@ def resolve_ticker(ticker_code, check_attr='info'):
                      'info'                 — 基本資訊（預設）
                      'quarterly_financials' — 季報
                      'financials'           — 年報
+        ttl_days: 登錄有效天數（預設 TICKER_REGISTRY_TTL_DAYS）
 
     Returns:
-        tuple: (yf.Ticker, str) 或 (None, None)
+        tuple: (ticker 物件, str) 或 (None, None)
+
+    Raises:
+        資料源錯誤（節流、斷路器跳脫、重試用盡等）照原例外拋出
     """
-    for suffix in ['.TW', '.TWO']:
+    ttl_days = TICKER_REGISTRY_TTL_DAYS if ttl_days is None else ttl_days
+    cached = _load_registry([ticker_code]).get(ticker_code)
+    if cached and _is_fresh(cached[1], ttl_days):
+        stock = _probe(cached[0], check_attr)
+        if stock is not None:
+            return stock, cached[0]
+
+    for suffix in SUFFIXES:
         symbol = f"{ticker_code}{suffix}"
-        stock = yf.Ticker(symbol)
+        stock = _probe(symbol, check_attr)
+        if stock is not None:
+            _record({ticker_code: symbol})
+            return stock, symbol
+    return None, None
+
+
+# ─── 批次解析 ────────────────────────────────────────────────
+
+def _symbols_with_data(symbols):
+    """以一次批次 download 探測多個 symbol，回傳有近期報價的 symbol 集合。"""
+    if not symbols:
+        return set()
+    try:
+        df = get_provider().download(symbols, period='5d', group_by='ticker',
+                                     progress=False, threads=True)
+    except Exception:
+        return set()
+    if df is None or df.empty:
+        return set()
+
+    found = set()
+    multi = getattr(df.columns, 'nlevels', 1) > 1
+    for symbol in symbols:
         try:
-            if check_attr == 'info':
-                info = stock.info
-                if info and 'symbol' in info:
-                    return stock, symbol
-            else:
-                data = getattr(stock, check_attr, None)
-                if data is not None and not data.empty:
-                    return stock, symbol
-        except Exception:
+            close = df[symbol]['Close'] if multi else df['Close']
+        except KeyError:
             continue
-    return None, None
+        if not close.dropna().empty:
+            found.add(symbol)
+    return found
+
+
+def resolve_unresolved(tickers, *, ttl_days=None):
+    """
+    批次解析尚未登錄（或已過期）的 ticker：先一起探測全部 .TW，
+    剩下的再一起探測 .TWO，結果寫入 tickers。
+
+    Returns:
+        tuple: (resolved, unresolved)
+            resolved   — {ticker: symbol}（本次新解析的）
+            unresolved — 兩個交易所都查無資料的 ticker list
+    """
+    ttl_days = TICKER_REGISTRY_TTL_DAYS if ttl_days is None else ttl_days
+    registry = _load_registry(tickers)
+    pending = [t for t in tickers
+               if t not in registry or not _is_fresh(registry[t][1], ttl_days)]
+
+    resolved = {}
+    for suffix in SUFFIXES:
+        if not pending:
+            break
+        for i in range(0, len(pending), BULK_PROBE_CHUNK):
+            chunk = pending[i:i + BULK_PROBE_CHUNK]
+            found = _symbols_with_data([f"{t}{suffix}" for t in chunk])
+            for t in chunk:
+                if f"{t}{suffix}" in found:
+                    resolved[t] = f"{t}{suffix}"
+        pending = [t for t in pending if t not in resolved]
+
+    if resolved:
+        _record(resolved)
+    return resolved, pending
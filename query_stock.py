@@ -1,13 +1,34 @@
 #!/usr/bin/env python3
 """
 股票資料庫查詢工具
+
+歷史 / 統計 / 匯出會跨年度歸檔（db.partitions）查詢；最新資料只在熱資料庫。
 """
-import csv
 import contextlib
+import csv
+import os
 import re
-import sqlite3
 import sys
-from stock_config import DB_PATH
+from db.connection import shared_connection
+from db.partitions import history_partitions, list_archives
+
+
+def _recent_history(conn, ticker, columns, limit, where=''):
+    """由新到舊跨分區取 ticker 最近 limit 筆（熱資料庫夠用時不掛載任何歸檔）。"""
+    rows = []
+    with contextlib.closing(history_partitions(conn, newest_first=True)) as parts:
+        for schema in parts:
+            rows += conn.execute(f'''
+            SELECT {columns}
+            FROM {schema}.stock_history h
+            LEFT JOIN main.tickers t ON t.ticker = h.ticker
+            WHERE h.ticker = ? {where}
+            ORDER BY h.fetch_time DESC
+            LIMIT ?
+            ''', (ticker, limit - len(rows))).fetchall()
+            if len(rows) >= limit:
+                break
+    return rows
 
 
 def _fmt(v, width, decimals=2, suffix=''):
@@ -34,18 +55,15 @@ def show_menu():
 
 def get_latest_data():
     """查詢最新資料"""
-    with contextlib.closing(sqlite3.connect(DB_PATH)) as conn:
+    with shared_connection() as conn:
         cursor = conn.cursor()
         
         cursor.execute('''
         SELECT s.ticker, s.name, s.price, s.eps, s.pe, s.pb, s.roe, s.dividend_yield, 
                s.fetch_time, s.fetch_error
-        FROM stock_history s
-        INNER JOIN (
-            SELECT ticker, MAX(fetch_time) AS max_time
-            FROM stock_history
-            GROUP BY ticker
-        ) latest ON s.ticker = latest.ticker AND s.fetch_time = latest.max_time
+        FROM stock_latest l
+        CROSS JOIN stock_history s
+            ON s.ticker_id = l.ticker_id AND s.trade_date = l.latest_date
         ORDER BY s.ticker
         ''')
         
@@ -69,18 +87,9 @@ def get_stock_history(ticker=None):
     if not ticker:
         ticker = input("\n請輸入股票代碼（例如：2330）: ").strip()
     
-    with contextlib.closing(sqlite3.connect(DB_PATH)) as conn:
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        SELECT name, price, eps, pe, roe, fetch_time, fetch_error
-        FROM stock_history
-        WHERE ticker = ?
-        ORDER BY fetch_time DESC
-        LIMIT 30
-        ''', (ticker,))
-        
-        results = cursor.fetchall()
+    with shared_connection() as conn:
+        results = _recent_history(
+            conn, ticker, 't.name, h.price, h.eps, h.pe, h.roe, h.fetch_time, h.fetch_error', 30)
     
     if not results:
         print(f"\n❌ 找不到股票 {ticker} 的歷史資料")
@@ -97,7 +106,7 @@ def get_stock_history(ticker=None):
 
 def get_update_logs():
     """查看更新日誌"""
-    with contextlib.closing(sqlite3.connect(DB_PATH)) as conn:
+    with shared_connection() as conn:
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -123,33 +132,36 @@ def get_update_logs():
         print(f"{time:<20} {total:>6} {success:>6} {failed:>6} {duration:>10.2f}")
 
 def get_statistics():
-    """查看資料庫統計"""
-    with contextlib.closing(sqlite3.connect(DB_PATH)) as conn:
-        cursor = conn.cursor()
-        
-        # 總記錄數
-        cursor.execute('SELECT COUNT(*) FROM stock_history')
-        total_records = cursor.fetchone()[0]
-        
-        # 股票數量
-        cursor.execute('SELECT COUNT(DISTINCT ticker) FROM stock_history')
-        total_stocks = cursor.fetchone()[0]
-        
-        # 最早與最晚記錄
-        cursor.execute('SELECT MIN(fetch_time), MAX(fetch_time) FROM stock_history')
-        earliest, latest = cursor.fetchone()
-        
-        # 平均成功率
-        cursor.execute('''
-        SELECT 
-            AVG(CASE WHEN fetch_error = 0 THEN 1.0 ELSE 0.0 END) * 100 as success_rate
-        FROM stock_history
-        ''')
-        success_rate = cursor.fetchone()[0]
-        
+    """查看資料庫統計（熱資料庫 + 全部年度歸檔）"""
+    total_records = 0
+    tickers = set()
+    earliest = latest = None
+    ok_records = 0
+    with shared_connection() as conn:
+        with contextlib.closing(history_partitions(conn)) as parts:
+            for schema in parts:
+                # 各分區的計數 / 極值可直接合併，不需同時掛載
+                count, ok, first, last = conn.execute(f'''
+                SELECT COUNT(*), SUM(fetch_error = 0), MIN(fetch_time), MAX(fetch_time)
+                FROM {schema}.stock_history
+                ''').fetchone()
+                total_records += count
+                ok_records += ok or 0
+                if first is not None:
+                    earliest = first if earliest is None else min(earliest, first)
+                    latest = last if latest is None else max(latest, last)
+                tickers.update(r[0] for r in conn.execute(
+                    f'SELECT DISTINCT ticker FROM {schema}.stock_history'))
+
         # 資料庫大小
+        cursor = conn.cursor()
         cursor.execute('SELECT page_count * page_size as size FROM pragma_page_count(), pragma_page_size()')
         db_size = cursor.fetchone()[0] / 1024 / 1024  # MB
+
+    archives = list_archives()
+    archive_size = sum(os.path.getsize(p) for p in archives.values()) / 1024 / 1024
+    total_stocks = len(tickers)
+    success_rate = ok_records / total_records * 100 if total_records else 0
     
     print(f"\n📊 資料庫統計資訊")
     print("-" * 60)
@@ -159,25 +171,27 @@ def get_statistics():
     print(f"  最新記錄: {latest}")
     print(f"  成功率: {success_rate:.2f}%")
     print(f"  資料庫大小: {db_size:.2f} MB")
+    if archives:
+        print(f"  年度歸檔: {min(archives)}–{max(archives)}（{len(archives)} 個，{archive_size:.2f} MB）")
 
 def export_to_csv(ticker=None):
     """匯出特定股票到 CSV"""
     if not ticker:
         ticker = input("\n請輸入股票代碼: ").strip()
     
-    with contextlib.closing(sqlite3.connect(DB_PATH)) as conn:
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        SELECT ticker, name, sector, price, eps, pe, pb, roe, 
-               dividend_yield, debt_to_equity, current_ratio, 
-               fcf, bvps, growth_rate, fetch_time, fetch_error
-        FROM stock_history
-        WHERE ticker = ?
-        ORDER BY fetch_time DESC
-        ''', (ticker,))
-        
-        results = cursor.fetchall()
+    with shared_connection() as conn:
+        results = []
+        with contextlib.closing(history_partitions(conn, newest_first=True)) as parts:
+            for schema in parts:
+                results += conn.execute(f'''
+                SELECT h.ticker, t.name, t.sector, h.price, h.eps, h.pe, h.pb, h.roe, 
+                       h.dividend_yield, h.debt_to_equity, h.current_ratio, 
+                       h.fcf, h.bvps, h.growth_rate, h.fetch_time, h.fetch_error
+                FROM {schema}.stock_history h
+                LEFT JOIN main.tickers t ON t.ticker = h.ticker
+                WHERE h.ticker = ?
+                ORDER BY h.fetch_time DESC
+                ''', (ticker,)).fetchall()
     
     if not results:
         print(f"\n❌ 找不到股票 {ticker}")
@@ -216,7 +230,7 @@ def compare_stocks():
         print("\n❌ 無有效的股票代碼（需 4-6 位數字）")
         return
     
-    with contextlib.closing(sqlite3.connect(DB_PATH)) as conn:
+    with shared_connection() as conn:
         cursor = conn.cursor()
         
         print(f"\n📊 股票比較（最新資料）")
@@ -225,11 +239,11 @@ def compare_stocks():
         
         for ticker in ticker_list:
             cursor.execute('''
-            SELECT ticker, name, price, pe, roe, dividend_yield
-            FROM stock_history
-            WHERE ticker = ?
-            ORDER BY fetch_time DESC
-            LIMIT 1
+            SELECT s.ticker, s.name, s.price, s.pe, s.roe, s.dividend_yield
+            FROM stock_latest l
+            INNER JOIN stock_history s
+                ON s.ticker_id = l.ticker_id AND s.trade_date = l.latest_date
+            WHERE s.ticker = ?
             ''', (ticker,))
             
             result = cursor.fetchone()
@@ -244,18 +258,9 @@ def get_price_trend(ticker=None):
     if not ticker:
         ticker = input("\n請輸入股票代碼: ").strip()
     
-    with contextlib.closing(sqlite3.connect(DB_PATH)) as conn:
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        SELECT price, fetch_time
-        FROM stock_history
-        WHERE ticker = ? AND fetch_error = 0
-        ORDER BY fetch_time DESC
-        LIMIT 30
-        ''', (ticker,))
-        
-        results = cursor.fetchall()
+    with shared_connection() as conn:
+        results = _recent_history(conn, ticker, 'h.price, h.fetch_time', 30,
+                                  where='AND h.fetch_error = 0')
     
     if not results:
         print(f"\n❌ 找不到股票 {ticker}")
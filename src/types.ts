@@ -99,6 +99,7 @@ export interface BaseValueResult {
 
 export interface StockDataResponse {
   lastUpdate: string;
+  dataVersion?: number | null;
   stocks: Stock[];
 }
 
@@ -10,15 +10,28 @@
   修改其中的 STOCK_LIST / STOCK_NAME_MAPPING / SECTOR_MAPPING。
   stock_config.local.json 已被 .gitignore 排除，不會提交到版本控制。
 """
-import sqlite3
-import contextlib
 import json
 import math
 import os
+import secrets
 
 # ─── 資料庫路徑 ──────────────────────────────────────────────
 DB_PATH = 'stock_history.db'
 
+# ─── Ticker 交易所解析快取 ──────────────────────────────────
+# tickers 中的交易所解析結果（suffix）超過此天數才重新依 .TW → .TWO 順序探測
+TICKER_REGISTRY_TTL_DAYS = 30
+
+# ─── 日線保留政策（sync_portfolio.py --compact） ─────────────
+# 早於此年數的日線壓實為週線（每週只留最後一個交易日）；None = 全部保留日線
+KEEP_DAILY_YEARS = 5
+
+# ─── 年度歸檔（sync_portfolio.py --archive） ────────────────
+# 已結束的年度搬到 ARCHIVE_DIR/stock_history_{年}.db（唯讀，查詢時才 ATTACH），
+# 熱資料庫只保留今年與前 HOT_YEARS-1 年（須涵蓋 365 天回填視窗）
+ARCHIVE_DIR = 'archive'                 # 相對於 DB_PATH 所在目錄
+HOT_YEARS = 2
+
 # ─── 預設股票清單（範例） ────────────────────────────────────
 # 這些是示範用的台股標的，請在 stock_config.local.json 中自訂你的持股
 STOCK_LIST = [
@@ -49,6 +62,8 @@ if os.path.isfile(_local_config):
         STOCK_NAME_MAPPING = _local_data['STOCK_NAME_MAPPING']
     if 'SECTOR_MAPPING' in _local_data and isinstance(_local_data['SECTOR_MAPPING'], dict):
         SECTOR_MAPPING = _local_data['SECTOR_MAPPING']
+    if isinstance(_local_data.get('TICKER_REGISTRY_TTL_DAYS'), int) and _local_data['TICKER_REGISTRY_TTL_DAYS'] >= 0:
+        TICKER_REGISTRY_TTL_DAYS = _local_data['TICKER_REGISTRY_TTL_DAYS']
     if 'DB_PATH' in _local_data and isinstance(_local_data['DB_PATH'], str):
         # S-2: DB_PATH 路徑安全驗證 — 必須在專案目錄內且為 .db 檔
         _resolved = os.path.realpath(os.path.join(_PROJECT_DIR, _local_data['DB_PATH']))
@@ -74,51 +89,350 @@ def safe_number(value, default=0):
 
 
 # ─── 資料庫初始化 ────────────────────────────────────────────
+
+# 價格（{b}）+ 基本面快照（{s}）→ 指標欄位；stock_history view 與
+# --restate 改寫年度歸檔（db.partitions.restate_archives）共用同一套公式
+HISTORY_METRICS_SQL = '''
+    {b}.price AS price,
+    {s}.eps AS eps,
+    CASE WHEN {s}.eps IS NULL OR {b}.price IS NULL THEN NULL
+         WHEN {s}.eps != 0 THEN round({b}.price / {s}.eps, 2) ELSE 0 END AS pe,
+    CASE WHEN {s}.bvps IS NULL OR {b}.price IS NULL THEN NULL
+         WHEN {s}.bvps > 0 THEN round({b}.price / {s}.bvps, 2) ELSE 0 END AS pb,
+    {s}.roe AS roe,
+    CASE WHEN {b}.price > 0 THEN round(COALESCE({s}.dividend, 0) / {b}.price * 100, 2)
+         ELSE 0 END AS dividend_yield,
+    {s}.debt_to_equity AS debt_to_equity,
+    {s}.current_ratio AS current_ratio,
+    {s}.fcf AS fcf,
+    {s}.bvps AS bvps,
+    {s}.growth_rate AS growth_rate,'''
+
+# 相容 view：與舊 stock_history 表同欄位，pe / pb / 殖利率由價格與快照即時推導
+_STOCK_HISTORY_VIEW_SQL = '''
+CREATE VIEW stock_history AS
+SELECT
+    t.ticker AS ticker,
+    t.name AS name,
+    t.sector AS sector,''' + HISTORY_METRICS_SQL.format(b='b', s='s') + '''
+    b.fetch_error AS fetch_error,
+    b.fetch_time AS fetch_time,
+    b.trade_date AS trade_date,
+    b.ticker_id AS ticker_id,
+    b.snapshot_id AS snapshot_id
+FROM price_bars b
+JOIN tickers t ON t.id = b.ticker_id
+LEFT JOIN fundamental_snapshots s ON s.id = b.snapshot_id
+'''
+
+
+def _migrate_stock_history(cursor):
+    """
+    舊資料庫遷移：寬表 stock_history → tickers / price_bars / fundamental_snapshots。
+
+    同一 ticker 同一天的多筆只保留一筆（成功列優先、最新 fetch_time 勝出）；
+    基本面欄位相同的連續列共用一筆 kind='legacy' 快照，
+    殖利率改存每股股利（殖利率 × 價格），之後由 view 依價格推導。
+    """
+    kind = cursor.execute(
+        "SELECT type FROM sqlite_master WHERE name = 'stock_history'").fetchone()
+    if kind is None or kind[0] != 'table':
+        return
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(stock_history)')}
+    day_expr = ('COALESCE(trade_date, date(fetch_time))' if 'trade_date' in columns
+                else 'date(fetch_time)')
+    page_size = cursor.execute('PRAGMA page_size').fetchone()[0]
+    before = cursor.execute('PRAGMA page_count').fetchone()[0] * page_size
+    n_rows = cursor.execute('SELECT COUNT(*) FROM stock_history').fetchone()[0]
+
+    cursor.execute('ALTER TABLE stock_history RENAME TO stock_history_legacy')
+    _create_price_tables(cursor)
+
+    cursor.execute(f'''
+    CREATE TEMP TABLE _legacy_bars AS
+    SELECT * FROM (
+        SELECT h.*, {day_expr} AS day, ROW_NUMBER() OVER (
+            PARTITION BY ticker, {day_expr}
+            ORDER BY fetch_error, fetch_time DESC, id DESC
+        ) AS rn
+        FROM stock_history_legacy h
+    ) WHERE rn = 1 AND day IS NOT NULL
+    ''')
+
+    # ticker 名稱 / 產業取最新一筆有名稱的列（失敗列名稱可能為 NULL）
+    cursor.execute('''
+    INSERT INTO tickers (ticker, name, sector)
+    SELECT ticker, name, sector FROM (
+        SELECT ticker, name, sector,
+               ROW_NUMBER() OVER (
+                   PARTITION BY ticker ORDER BY name IS NULL, day DESC
+               ) AS rn
+        FROM _legacy_bars
+    ) WHERE rn = 1
+    ON CONFLICT(ticker) DO NOTHING
+    ''')
+
+    cursor.execute('''
+    INSERT INTO fundamental_snapshots
+        (ticker_id, kind, available_from, eps, roe, debt_to_equity, current_ratio,
+         fcf, bvps, growth_rate, dividend)
+    SELECT t.id, 'legacy', MIN(b.day), b.eps, b.roe, b.debt_to_equity, b.current_ratio,
+           b.fcf, b.bvps, b.growth_rate,
+           round(AVG(b.dividend_yield * b.price / 100), 4)
+    FROM _legacy_bars b
+    JOIN tickers t ON t.ticker = b.ticker
+    GROUP BY t.id, b.eps, b.roe, b.debt_to_equity, b.current_ratio,
+             b.fcf, b.bvps, b.growth_rate
+    ''')
+
+    cursor.execute('''
+    INSERT INTO price_bars (ticker_id, trade_date, price, fetch_time, fetch_error, snapshot_id)
+    SELECT t.id, b.day, b.price, COALESCE(b.fetch_time, b.day), COALESCE(b.fetch_error, 0),
+           (SELECT s.id FROM fundamental_snapshots s
+            WHERE s.ticker_id = t.id AND s.kind = 'legacy'
+              AND s.eps IS b.eps AND s.roe IS b.roe
+              AND s.debt_to_equity IS b.debt_to_equity AND s.current_ratio IS b.current_ratio
+              AND s.fcf IS b.fcf AND s.bvps IS b.bvps AND s.growth_rate IS b.growth_rate)
+    FROM _legacy_bars b
+    JOIN tickers t ON t.ticker = b.ticker
+    ''')
+    n_bars = cursor.execute('SELECT COUNT(*) FROM price_bars').fetchone()[0]
+    n_snaps = cursor.execute('SELECT COUNT(*) FROM fundamental_snapshots').fetchone()[0]
+
+    cursor.execute('DROP TABLE _legacy_bars')
+    cursor.execute('DROP TABLE stock_history_legacy')
+    cursor.execute('DROP TABLE IF EXISTS stock_latest')   # 舊版以 stock_history.id 為指標
+    print(f"🔧 stock_history 已正規化：{n_rows} 列 → {n_bars} 筆日線 / {n_snaps} 筆快照"
+          f"（原 {before / 1024 / 1024:.1f} MB）")
+    return True
+
+
+def _create_with_foreign_keys(cursor, table, create_sql, *, ticker_column=None):
+    """
+    建立含外鍵的資料表；舊版無外鍵的同名表就地重建（SQLite 無法 ALTER 加外鍵）。
+
+    Args:
+        table: 表名
+        create_sql: CREATE TABLE IF NOT EXISTS 語句（含 REFERENCES tickers）
+        ticker_column: 以 ticker 代碼參照 tickers 時的欄位名，
+                       重建前先把舊表出現的代碼登錄進 tickers
+    """
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    if exists and not cursor.execute(f'PRAGMA foreign_key_list({table})').fetchall():
+        columns = [row[1] for row in cursor.execute(f'PRAGMA table_info({table})')]
+        if ticker_column:
+            cursor.execute(f'INSERT OR IGNORE INTO tickers (ticker) '
+                           f'SELECT DISTINCT {ticker_column} FROM {table}')
+        cursor.execute(f'ALTER TABLE {table} RENAME TO {table}_nofk')
+        cursor.execute(create_sql)
+        kept = [c for c in columns
+                if c in {row[1] for row in cursor.execute(f'PRAGMA table_info({table})')}]
+        where = ('ticker_id IN (SELECT id FROM tickers)' if 'ticker_id' in kept
+                 else f'{ticker_column} IN (SELECT ticker FROM tickers)' if ticker_column
+                 else 'true')
+        cols = ', '.join(kept)
+        cursor.execute(f'INSERT INTO {table} ({cols}) SELECT {cols} FROM {table}_nofk WHERE {where}')
+        cursor.execute(f'DROP TABLE {table}_nofk')
+        print(f"🔧 {table} 已重建為含外鍵（ON DELETE CASCADE）")
+    else:
+        cursor.execute(create_sql)
+
+
+def _create_price_tables(cursor):
+    """建立 tickers / fundamental_snapshots / price_bars。"""
+    # ticker 維度表：名稱 / 產業 / 交易所後綴只存一份，其他表以外鍵參照並連鎖刪除；
+    # archived_at 非 NULL 表示已移除（資料保留，--purge 才真正刪除）
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS tickers (
+        id INTEGER PRIMARY KEY,
+        ticker TEXT NOT NULL UNIQUE,
+        name TEXT,
+        sector TEXT,
+        suffix TEXT,
+        exchange TEXT,
+        verified_at TIMESTAMP,
+        archived_at TIMESTAMP
+    )
+    ''')
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(tickers)')}
+    for column, decl in (('suffix', 'TEXT'), ('exchange', 'TEXT'), ('verified_at', 'TIMESTAMP'),
+                         ('archived_at', 'TIMESTAMP')):
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE tickers ADD COLUMN {column} {decl}')
+
+    # 舊版交易所解析快取 ticker_registry 併入 tickers
+    if cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ticker_registry'"
+    ).fetchone():
+        cursor.execute('''
+        INSERT INTO tickers (ticker, suffix, exchange, verified_at)
+        SELECT ticker, substr(symbol, length(ticker) + 1), exchange, verified_at
+        FROM ticker_registry WHERE true
+        ON CONFLICT(ticker) DO UPDATE SET
+            suffix = excluded.suffix,
+            exchange = excluded.exchange,
+            verified_at = excluded.verified_at
+        ''')
+        cursor.execute('DROP TABLE ticker_registry')
+
+    # 基本面快照：kind = quote（info 即時，每日一筆）/ quarter（季報）/ legacy（遷移）
+    _create_with_foreign_keys(cursor, 'fundamental_snapshots', '''
+    CREATE TABLE IF NOT EXISTS fundamental_snapshots (
+        id INTEGER PRIMARY KEY,
+        ticker_id INTEGER NOT NULL REFERENCES tickers(id) ON DELETE CASCADE,
+        kind TEXT NOT NULL,
+        period_end TEXT,
+        available_from TEXT NOT NULL,
+        eps REAL,
+        roe REAL,
+        debt_to_equity REAL,
+        current_ratio REAL,
+        fcf REAL,
+        bvps REAL,
+        growth_rate REAL,
+        dividend REAL
+    )
+    ''')
+    cursor.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_snapshots_ticker_kind_from
+    ON fundamental_snapshots(ticker_id, kind, available_from)
+    ''')
+
+    # 日線：每檔每交易日一筆，基本面以 snapshot_id 指向快照
+    _create_with_foreign_keys(cursor, 'price_bars', '''
+    CREATE TABLE IF NOT EXISTS price_bars (
+        ticker_id INTEGER NOT NULL REFERENCES tickers(id) ON DELETE CASCADE,
+        trade_date TEXT NOT NULL,
+        price REAL,
+        fetch_time TEXT NOT NULL,
+        fetch_error INTEGER NOT NULL DEFAULT 0,
+        snapshot_id INTEGER,
+        PRIMARY KEY (ticker_id, trade_date)
+    ) WITHOUT ROWID
+    ''')
+
+
+# 重新計算單一 ticker 的最新交易日（price_bars 主鍵範圍查詢，成本與總列數無關）
+_LATEST_REFRESH_SQL = '''
+        INSERT INTO stock_latest (ticker_id, latest_date, latest_ok_date)
+        VALUES ({t},
+            (SELECT MAX(trade_date) FROM price_bars WHERE ticker_id = {t}),
+            (SELECT MAX(trade_date) FROM price_bars WHERE ticker_id = {t} AND fetch_error = 0))
+        ON CONFLICT(ticker_id) DO UPDATE SET
+            latest_date = excluded.latest_date,
+            latest_ok_date = excluded.latest_ok_date;
+        DELETE FROM stock_latest WHERE ticker_id = {t} AND latest_date IS NULL;'''
+
+
+def _create_latest_triggers(cursor):
+    """
+    stock_latest 的維護 trigger：price_bars 新增 / 刪除，
+    或 ticker_id / trade_date / fetch_error 被修改時，重算受影響 ticker 的指標。
+    只改 snapshot_id 的修正（restatement）不影響指標，不會觸發。
+    """
+    cursor.executescript(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_stock_latest_insert
+    AFTER INSERT ON price_bars BEGIN{_LATEST_REFRESH_SQL.format(t='NEW.ticker_id')}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_stock_latest_delete
+    AFTER DELETE ON price_bars BEGIN{_LATEST_REFRESH_SQL.format(t='OLD.ticker_id')}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_stock_latest_update
+    AFTER UPDATE OF ticker_id, trade_date, fetch_error ON price_bars BEGIN{_LATEST_REFRESH_SQL.format(t='OLD.ticker_id')}{_LATEST_REFRESH_SQL.format(t='NEW.ticker_id')}
+    END;
+    ''')
+
+
+def _create_fingerprint_triggers(cursor):
+    """
+    snapshot_fingerprints 的維護 trigger：新增早於 restated_through 的日線
+    （--full-backfill 補進舊缺口，先指向當日 quote 快照）時把 restated_through
+    退回該日，下次修正從這裡開始檢查，補進來的日線才會改指向季報快照。
+    """
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_fingerprint_backfill
+    AFTER INSERT ON price_bars BEGIN
+        UPDATE snapshot_fingerprints SET restated_through = NEW.trade_date
+        WHERE ticker_id = NEW.ticker_id AND restated_through > NEW.trade_date;
+    END
+    ''')
+
+
 def init_database(db_path=None):
     """
     初始化 SQLite 資料庫（CREATE IF NOT EXISTS）。
     
-    建立三張表：
-      - stock_history: 每日股票數據快照
+    建立資料表：
+      - tickers: ticker 維度表（id / 名稱 / 產業 / 交易所後綴 / 封存時間），其他表外鍵連鎖刪除
+      - price_bars: 每檔每交易日一筆日線（WITHOUT ROWID）
+      - fundamental_snapshots: 基本面快照（日線以 snapshot_id 參照）
+      - stock_history: 相容 view（pe / pb / 殖利率即時推導）
       - update_logs: 更新日誌
       - fundamentals_history: 季報歷史資料
+      - annual_fundamentals: 年度財報
+      - stock_latest: 每檔最新交易日的指標（trigger 維護）
+      - snapshot_fingerprints: 各檔上次套用的季報快照指紋（增量修正用）
+      - db_meta: 資料版本計數（data_version，每次有寫入的 commit +1，寫進匯出 JSON）
+                 與建立資料庫時產生的隨機 db_id（重建 DB 後與舊快取區隔）
     """
-    with contextlib.closing(sqlite3.connect(db_path or DB_PATH)) as conn:
+    from db.connection import shared_connection  # 延遲匯入：db.connection 依賴本模組
+    with shared_connection(db_path) as conn:
         cursor = conn.cursor()
 
-        # 股票歷史資料表
+        # 日線 / 快照 / ticker（舊寬表 stock_history 於此遷移）
+        migrated = _migrate_stock_history(cursor)
+        # view 每次重建，推導公式調整後舊 DB 立即生效（先移除，避免重建底層表時被改寫）
+        cursor.execute('DROP VIEW IF EXISTS stock_history')
+        _create_price_tables(cursor)
+        cursor.execute(_STOCK_HISTORY_VIEW_SQL)
+
+        # 每檔最新交易日：latest_date（含失敗列）/ latest_ok_date（fetch_error = 0）
+        has_latest = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stock_latest'"
+        ).fetchone()
         cursor.execute('''
-        CREATE TABLE IF NOT EXISTS stock_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ticker TEXT NOT NULL,
-            name TEXT,
-            sector TEXT,
-            price REAL,
-            eps REAL,
-            pe REAL,
-            pb REAL,
-            roe REAL,
-            dividend_yield REAL,
-            debt_to_equity REAL,
-            current_ratio REAL,
-            fcf REAL,
-            bvps REAL,
-            growth_rate REAL,
-            fetch_error INTEGER DEFAULT 0,
-            fetch_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        CREATE TABLE IF NOT EXISTS stock_latest (
+            ticker_id INTEGER PRIMARY KEY,
+            latest_date TEXT,
+            latest_ok_date TEXT
         )
         ''')
+        if not has_latest:
+            cursor.execute('''
+            INSERT INTO stock_latest (ticker_id, latest_date, latest_ok_date)
+            SELECT ticker_id, MAX(trade_date),
+                   MAX(CASE WHEN fetch_error = 0 THEN trade_date END)
+            FROM price_bars
+            GROUP BY ticker_id
+            ''')
+        _create_latest_triggers(cursor)
 
-        cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_ticker_time 
-        ON stock_history(ticker, fetch_time)
+        # 季報快照指紋：上次套用的快照清單 hash 與當時的最新成功交易日，
+        # 清單未變時修正只需檢查之後新增的日線
+        _create_with_foreign_keys(cursor, 'snapshot_fingerprints', '''
+        CREATE TABLE IF NOT EXISTS snapshot_fingerprints (
+            ticker_id INTEGER PRIMARY KEY REFERENCES tickers(id) ON DELETE CASCADE,
+            fingerprint TEXT NOT NULL,
+            restated_through TEXT,
+            restated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
         ''')
+        _create_fingerprint_triggers(cursor)
 
+        # 資料版本：db.meta.commit_versioned 每次有寫入的 commit +1
         cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_fetch_time 
-        ON stock_history(fetch_time)
+        CREATE TABLE IF NOT EXISTS db_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        ) WITHOUT ROWID
         ''')
+        cursor.execute("INSERT OR IGNORE INTO db_meta (key, value) VALUES ('data_version', 0)")
+        # 資料庫識別碼：刪除重建後 data_version 從 0 重數，快取鍵靠 db_id 區分新舊 DB
+        cursor.execute("INSERT OR IGNORE INTO db_meta (key, value) VALUES ('db_id', ?)",
+                       (secrets.randbits(63),))
 
         # 更新日誌表
         cursor.execute('''
@@ -134,10 +448,10 @@ def init_database(db_path=None):
         ''')
 
         # 財報歷史表（完整 schema，含季報所有欄位）
-        cursor.execute('''
+        _create_with_foreign_keys(cursor, 'fundamentals_history', '''
         CREATE TABLE IF NOT EXISTS fundamentals_history (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ticker TEXT NOT NULL,
+            ticker TEXT NOT NULL REFERENCES tickers(ticker) ON DELETE CASCADE,
             period_end DATE NOT NULL,
             fiscal_year INTEGER NOT NULL,
             fiscal_quarter INTEGER NOT NULL,
@@ -158,7 +472,7 @@ def init_database(db_path=None):
             fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             UNIQUE(ticker, period_end)
         )
-        ''')
+        ''', ticker_column='ticker')
 
         cursor.execute('''
         CREATE INDEX IF NOT EXISTS idx_fundamentals_ticker_period 
@@ -166,10 +480,10 @@ def init_database(db_path=None):
         ''')
 
         # 年度財報表
-        cursor.execute('''
+        _create_with_foreign_keys(cursor, 'annual_fundamentals', '''
         CREATE TABLE IF NOT EXISTS annual_fundamentals (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ticker TEXT NOT NULL,
+            ticker TEXT NOT NULL REFERENCES tickers(ticker) ON DELETE CASCADE,
             fiscal_year INTEGER NOT NULL,
             period_end DATE NOT NULL,
             eps REAL,
@@ -187,7 +501,7 @@ def init_database(db_path=None):
             fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             UNIQUE(ticker, fiscal_year)
         )
-        ''')
+        ''', ticker_column='ticker')
 
         cursor.execute('''
         CREATE INDEX IF NOT EXISTS idx_annual_ticker_year
@@ -195,4 +509,9 @@ def init_database(db_path=None):
         ''')
 
         conn.commit()
+        if migrated:
+            conn.execute('VACUUM')
+            size = conn.execute('PRAGMA page_count').fetchone()[0] * \
+                conn.execute('PRAGMA page_size').fetchone()[0]
+            print(f"🔧 VACUUM 完成，資料庫 {size / 1024 / 1024:.1f} MB")
     print("✅ 資料庫初始化完成")
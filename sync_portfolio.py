@@ -3,47 +3,103 @@
 持股同步主控腳本 v2（方案 B — 統一抓取）
 
 將 4 支 fetch 腳本的邏輯合併為單一迴圈：
-每支股票只建立一次 yf.Ticker，一次抓完所有資料。
+每支股票只建立一次 ticker 物件（fetchers.provider），一次抓完所有資料。
 
 功能：
-  • diff sync  — 比對 STOCK_LIST vs DB，自動新增/移除
+  • diff sync  — 比對 STOCK_LIST vs DB，自動新增/移除（移除 = 封存）
   • --add       — 從儀表板一鍵新增股票（更新 config + 抓取 + 重生 JSON）
-  • --remove    — 從儀表板一鍵移除股票（更新 config + 清 DB + 重生 JSON）
+                  已封存的股票只補抓封存後的缺口
+  • --remove    — 從儀表板一鍵移除股票（更新 config + 封存 DB 資料 + 重生 JSON）
+  • --purge     — 真正刪除已封存股票的資料並回收空間，回報回收量
+  • --compact   — 合併重複 / 孤兒快照，早於 N 年的日線壓實為週線
+                  （--keep-daily-years，預設 KEEP_DAILY_YEARS），
+                  incremental vacuum 後回報回收的列數與空間
+  • --archive   — 已結束的年度搬到 archive/stock_history_{年}.db（唯讀，查詢時才 ATTACH），
+                  熱資料庫只留近 --hot-years 年（預設 HOT_YEARS）
+  • --restate   — 只用 DB 已存的季報重建快照並修正全部（或指定）股票的歷史指標，
+                  年度歸檔中的攤平指標也一併重算；不連網；
+                  搭配 --workers 以 process pool 分批建快照
   • --refresh   — 強制全部重抓
   • --regen-only — 只重新生成 JSON
+  • --quotes-only — 盤中快速更新：批次抓報價，只重生 stock_data.json
+  • --full-backfill — 忽略水位線，重抓完整 365 天歷史走勢
+  • --force-fundamentals — 忽略申報期判斷，一律下載年報 / 季報
+  • --no-cache  — 不使用本地 payload 快取（財報 / 股利 / info 一律重新下載）；
+                  非 yfinance 資料源一律不使用快取
+  • --provider  — 資料源：yfinance / record（錄製到 fixtures）/ replay / synthetic
+                  後兩者不連網，搭配 --latency 可離線量測同步吞吐量；必須以 --db
+                  指定另一個資料庫，不會寫入正式的 DB_PATH
+  • --db        — 改用指定的資料庫檔（.db），取代 stock_config 的 DB_PATH
+  • --retries / --breaker — 資料源呼叫失敗時以指數退避重試；連續失敗 N 次後
+                  斷路器跳脫，剩餘呼叫立即失敗（不再逐支等逾時）
+  • --workers   — 並行抓取（共用 token-bucket 限速，取代固定 sleep）
+                  寫入統一交給單一 writer 執行緒（db.sink），每 N 支 commit 一次
 
 Usage:
   python3 sync_portfolio.py                                 # diff sync
   python3 sync_portfolio.py --add 2330 --name 台積電 --sector 半導體
   python3 sync_portfolio.py --remove 2330
+  python3 sync_portfolio.py --purge
+  python3 sync_portfolio.py --compact --keep-daily-years 3
+  python3 sync_portfolio.py --archive --hot-years 2
+  python3 sync_portfolio.py --restate --workers 4
+  python3 sync_portfolio.py --restate 2330 2454
   python3 sync_portfolio.py --refresh
   python3 sync_portfolio.py --dry-run
   python3 sync_portfolio.py --regen-only
+  python3 sync_portfolio.py --quotes-only
+  python3 sync_portfolio.py --refresh --workers 8 --rate 4 --burst 8
+  python3 sync_portfolio.py --refresh --full-backfill
+  python3 sync_portfolio.py --refresh --provider synthetic --latency 0.2 --workers 8 --db bench.db
 """
 
 import argparse
+import functools
 import json
 import os
 import re
 import time
-from datetime import datetime
+from datetime import date, datetime
 
+import stock_config
 from stock_config import (
     STOCK_LIST, STOCK_NAME_MAPPING, SECTOR_MAPPING,
-    DB_PATH, init_database,
+    KEEP_DAILY_YEARS, HOT_YEARS, init_database,
+)
+from fetchers.ticker import (
+    TickerNotFoundError, resolve_ticker, resolve_unresolved, registered_symbols,
+)
+from fetchers.price import (
+    save_current_snapshot, save_historical_prices, fetch_latest_quotes, save_quotes_only,
 )
-from fetchers.ticker import resolve_ticker
-from fetchers.price import save_current_snapshot, save_historical_prices
 from fetchers.fundamentals import save_annual_fundamentals, save_quarterly_and_fix
-from db.crud import get_db_tickers, remove_ticker_from_db
+from fetchers.pool import TokenBucket, run_pool, format_pool_stats
+from fetchers.cache import ResponseCache
+from fetchers.provider import PROVIDER_NAMES, DEFAULT_FIXTURES_DIR, make_provider, set_provider
+from fetchers.resilience import (
+    DEFAULT_RETRIES, DEFAULT_BREAKER_THRESHOLD,
+    ResilientProvider, RetryPolicy, CircuitBreaker, format_resilience_stats,
+)
+from db.crud import (
+    get_db_tickers, get_history_watermark, get_latest_period_ends,
+    archive_ticker, get_archived_tickers, purge_archived_tickers,
+)
+from db.maintenance import compact_database
+from db.partitions import archive_closed_years, hot_since, restate_archives
+from db.connection import export_snapshot, read_transaction
+from db.meta import get_data_version
+from db.sink import WriteSink, use_sink, end_ticker, format_sink_stats
+from transforms.snapshots import next_fundamentals_due, restate_from_db, restate_all_from_db
 from exporters.stock_data import generate_stock_data_json
 from exporters.history import export_history_json
 
 # ─── Constants ────────────────────────────────────────────────
 BACKFILL_DAYS = 365
 REQUEST_DELAY = 1.0
+MAX_WORKERS = 16
 TICKER_PATTERN = re.compile(r'^\d{4,6}$')
 MAX_NAME_LEN = 50
+OFFLINE_PROVIDERS = ('replay', 'synthetic')   # 不連網的資料源，不可寫入正式資料庫
 
 
 # ═════════════════════════════════════════════════════════════
@@ -76,40 +132,65 @@ def _write_config_local():
 # § Unified Fetch — 一支 Ticker 抓完全部
 # ═════════════════════════════════════════════════════════════
 
-def unified_fetch_one(ticker_code, *, backfill_days=BACKFILL_DAYS):
+def unified_fetch_one(ticker_code, *, backfill_days=BACKFILL_DAYS, full_backfill=False,
+                      cache=None, force_fundamentals=False):
     """
-    建立一個 yf.Ticker 物件，一次抓完：
-      1) 即時報價  → stock_history (today)
+    建立一個 ticker 物件，一次抓完：
+      1) 即時報價  → price_bars (today) + quote 快照
       2) 年報      → annual_fundamentals
-      3) 歷史走勢  → stock_history (backfill)
-      4) 季報修正  → fundamentals_history + UPDATE stock_history
+      3) 歷史走勢  → price_bars (backfill；有水位線時只抓缺口)
+      4) 季報修正  → fundamentals_history + 日線改指向季報快照
+
+    cache 為 ResponseCache 時，財報 / 股利先查本地快取；info 沿用解析交易所時剛下載的版本並寫回快取。
+    下一季財報尚未到申報期時（next_fundamentals_due），略過 2) 與 4) 的下載，
+    改以 DB 已存季報修正新寫入的走勢；force_fundamentals 可強制下載。
 
-    回傳 auto-detected name（成功）或 None（失敗）。
+    回傳 auto-detected name。.TW / .TWO 都查無資料時拋出 TickerNotFoundError，
+    資料源錯誤（節流、斷路器跳脫等）照常拋出：run_pool 才會降速重排或記為失敗。
     """
     name = STOCK_NAME_MAPPING.get(ticker_code, ticker_code)
     print(f"\n  📡 {ticker_code} ({name})")
 
     stock, symbol = resolve_ticker(ticker_code)
     if stock is None:
-        print(f"    ❌ 無法解析（.TW / .TWO 均無）")
-        return None
+        raise TickerNotFoundError(f'{ticker_code} 無法解析（.TW / .TWO 均無）')
 
     print(f"    ✓ 使用 {symbol}")
-    info = stock.info
+    if cache is not None:
+        # resolve_ticker 驗證時已下載最新的 info：直接沿用並寫回快取，不讀 10 分鐘內的舊報價
+        stock = cache.wrap(stock, symbol, prefetched=('info',))
+    # 水位線需在 Step 1 寫入今日報價前讀取
+    watermark = None if full_backfill else get_history_watermark(ticker_code)
+    due = next_fundamentals_due(get_latest_period_ends([ticker_code]).get(ticker_code))
+    fetch_statements = force_fundamentals or due is None or due <= date.today().isoformat()
+    try:
+        info = stock.info
 
-    detected_name = info.get('shortName', info.get('longName', ticker_code))
+        detected_name = info.get('shortName', info.get('longName', ticker_code))
 
-    # Step 1: 即時報價
-    save_current_snapshot(ticker_code, info)
+        # Step 1: 即時報價
+        save_current_snapshot(ticker_code, info)
 
-    # Step 2: 年報
-    save_annual_fundamentals(ticker_code, stock)
+        # Step 2: 年報
+        if fetch_statements:
+            save_annual_fundamentals(ticker_code, stock)
+        else:
+            print(f"    ▸ 年報 ⏭️  未到申報期（下次 {due}）")
 
-    # Step 3: 歷史走勢（需在 Step 4 前，因為 Step 4 會 UPDATE 這些 rows）
-    save_historical_prices(ticker_code, stock, symbol, info, backfill_days)
+        # Step 3: 歷史走勢（需在 Step 4 前，因為 Step 4 會 UPDATE 這些 rows）
+        save_historical_prices(ticker_code, stock, symbol, info, backfill_days,
+                               since=watermark)
 
-    # Step 4: 季報修正
-    save_quarterly_and_fix(ticker_code, stock)
+        # Step 4: 季報修正
+        if fetch_statements:
+            save_quarterly_and_fix(ticker_code, stock)
+        else:
+            n_quarters, updated, total = restate_from_db(ticker_code)
+            print(f"    ▸ 季報修正 ⏭️  未到申報期（下次 {due}），"
+                  f"以 DB {n_quarters} 季修正 {updated}/{total} 筆")
+    finally:
+        # 交易邊界：sink 啟用時，這支 ticker 的寫入在此之後才可能 commit
+        end_ticker(ticker_code)
 
     return detected_name
 
@@ -118,10 +199,24 @@ def unified_fetch_one(ticker_code, *, backfill_days=BACKFILL_DAYS):
 # § JSON Regeneration
 # ═════════════════════════════════════════════════════════════
 
-def regenerate_json():
-    """直接呼叫 exporters 模組重新生成 JSON（取代 subprocess 方式）。"""
+def regenerate_json(in_memory=False):
+    """
+    直接呼叫 exporters 模組重新生成 JSON（取代 subprocess 方式）。
+    兩個 exporter 在同一個讀交易內執行（db.connection.read_transaction），
+    同步在中途寫入也不會讓 stock_data.json 與 history_all.json 版本不一致；
+    不複製資料庫，記憶體用量與資料庫大小無關。
+
+    in_memory=True 改用 export_snapshot 先複製一份記憶體快照（峰值記憶體 = 熱資料庫大小）。
+    """
+    t0 = time.perf_counter()
+    with (export_snapshot() if in_memory else read_transaction()) as snapshot:
+        elapsed = time.perf_counter() - t0
+        return _regenerate_json(get_data_version(snapshot), elapsed)
+
+
+def _regenerate_json(version, snapshot_seconds):
     errors = []
-    print("\n  🔄 重新生成 JSON：")
+    print(f"\n  🔄 重新生成 JSON（資料版本 {version}，快照 {snapshot_seconds * 1000:.0f} ms）：")
     print("    ▸ stock_data.json ...", end=" ", flush=True)
     try:
         generate_stock_data_json()
@@ -153,21 +248,96 @@ def main():
                         help='新增股票代碼')
     parser.add_argument('--remove', type=str, metavar='TICKER',
                         help='移除股票代碼')
+    parser.add_argument('--purge', action='store_true',
+                        help='刪除已封存股票的全部資料並回收空間')
+    parser.add_argument('--compact', action='store_true',
+                        help='合併重複快照、舊日線壓實為週線並回收空間')
+    parser.add_argument('--keep-daily-years', type=int, default=KEEP_DAILY_YEARS, metavar='N',
+                        help='--compact 保留 N 年內的日線，更早的只留週線（預設 %(default)s）')
+    parser.add_argument('--archive', action='store_true',
+                        help='已結束的年度搬到唯讀的年度歸檔 DB')
+    parser.add_argument('--hot-years', type=int, default=HOT_YEARS, metavar='N',
+                        help='--archive 時熱資料庫保留的年數（含今年，預設 %(default)s）')
     parser.add_argument('--name', type=str,
                         help='新增股票名稱（可選，自動偵測）')
     parser.add_argument('--sector', type=str, default='',
                         help='新增股票產業（可選，預設 "電子"）')
+    parser.add_argument('--restate', nargs='*', metavar='TICKER',
+                        help='以 DB 季報重建快照並修正歷史指標（不連網；未指定 = 全部）')
     parser.add_argument('--refresh', action='store_true',
                         help='強制全部重抓')
+    parser.add_argument('--full-backfill', action='store_true',
+                        help=f'忽略水位線，重抓完整 {BACKFILL_DAYS} 天歷史走勢')
+    parser.add_argument('--force-fundamentals', action='store_true',
+                        help='忽略申報期判斷，一律下載年報 / 季報')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='不使用本地 payload 快取')
     parser.add_argument('--dry-run', action='store_true',
                         help='僅顯示差異，不執行')
     parser.add_argument('--regen-only', action='store_true',
                         help='只重新生成 JSON')
+    parser.add_argument('--quotes-only', action='store_true',
+                        help='只批次更新報價並重生 stock_data.json（不抓財報 / 歷史）')
+    parser.add_argument('--workers', type=int, default=1, metavar='N',
+                        help=f'並行抓取 worker 數 / --restate 的行程數（1-{MAX_WORKERS}，預設 1 = 循序）')
+    parser.add_argument('--rate', type=float, default=1.0 / REQUEST_DELAY, metavar='R',
+                        help='共用限速：每秒請求數（預設 %(default).1f）')
+    parser.add_argument('--burst', type=int, default=None, metavar='B',
+                        help='共用限速：可累積的突發請求數（預設 = workers）')
+    parser.add_argument('--commit-every', type=int, default=1, metavar='N',
+                        help='單一 writer 每完成 N 支 ticker commit 一次（預設 1）')
+    parser.add_argument('--provider', choices=PROVIDER_NAMES, default='yfinance',
+                        help='資料源（replay / synthetic 不連網，須搭配 --db；非 yfinance 不使用快取）')
+    parser.add_argument('--fixtures', type=str, default=DEFAULT_FIXTURES_DIR, metavar='DIR',
+                        help='record / replay 的 fixtures 目錄')
+    parser.add_argument('--latency', type=float, default=0.0, metavar='SEC',
+                        help='replay / synthetic 每次呼叫的人工延遲秒數')
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES, metavar='N',
+                        help=f'資料源暫時性錯誤的重試次數（預設 {DEFAULT_RETRIES}）')
+    parser.add_argument('--breaker', type=int, default=DEFAULT_BREAKER_THRESHOLD, metavar='N',
+                        help=f'連續失敗 N 次後斷路（預設 {DEFAULT_BREAKER_THRESHOLD}，0 = 停用）')
+    parser.add_argument('--db', type=str, default=None, metavar='PATH',
+                        help='改用指定的資料庫檔（.db），預設為 stock_config 的 DB_PATH')
     args = parser.parse_args()
 
+    if not 1 <= args.workers <= MAX_WORKERS:
+        parser.error(f'--workers 必須介於 1 與 {MAX_WORKERS} 之間')
+    if args.rate <= 0:
+        parser.error('--rate 必須大於 0')
+    if args.commit_every < 1:
+        parser.error('--commit-every 必須 >= 1')
+    if args.latency < 0:
+        parser.error('--latency 不可為負數')
+
+    if args.retries < 0 or args.breaker < 0:
+        parser.error('--retries / --breaker 不可為負數')
+    if args.keep_daily_years is not None and args.keep_daily_years < 0:
+        parser.error('--keep-daily-years 不可為負數')
+    if args.hot_years < 2:
+        parser.error(f'--hot-years 至少為 2（須涵蓋 {BACKFILL_DAYS} 天回填視窗）')
+    if args.db is not None:
+        if not args.db.endswith('.db'):
+            parser.error('--db 必須是 .db 檔')
+        # 各模組在呼叫時才讀 stock_config.DB_PATH，必須在第一次連線前切換
+        stock_config.DB_PATH = os.path.abspath(args.db)
+    elif args.provider in OFFLINE_PROVIDERS:
+        parser.error(f'--provider {args.provider} 不連網，必須以 --db 指定另一個資料庫')
+    # 離線 / 錄製資料源不走 payload 快取：快取鍵不含資料源，會與真實資料互相污染
+    use_cache = not args.no_cache and args.provider == 'yfinance'
+
+    provider = ResilientProvider(
+        make_provider(args.provider, fixtures=args.fixtures, latency=args.latency),
+        policy=RetryPolicy(args.retries), breaker=CircuitBreaker(args.breaker))
+    set_provider(provider)
+
     print("=" * 60)
     print("🔄 持股同步主控 v2")
     print(f"📅 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    if args.provider != 'yfinance':
+        print(f"🧪 資料源: {args.provider}"
+              + (f"（延遲 {args.latency:.2f} 秒/次）" if args.latency else ''))
+    if args.db is not None:
+        print(f"🗄️  資料庫: {stock_config.DB_PATH}")
     print("=" * 60)
 
     # ── 首次使用：自動建立 stock_config.local.json ──
@@ -200,6 +370,9 @@ def main():
             return
 
         print(f"\n🆕 新增股票: {ticker}")
+        archived_at = get_archived_tickers().get(ticker)
+        if archived_at:
+            print(f"   ♻️  從封存還原（{archived_at} 封存），只補抓之後的缺口")
 
         was_new = ticker not in STOCK_LIST
         if was_new:
@@ -208,7 +381,17 @@ def main():
         SECTOR_MAPPING.setdefault(ticker, user_sector)
 
         start = time.time()
-        detected_name = unified_fetch_one(ticker)
+        cache = ResponseCache() if use_cache else None
+        try:
+            detected_name = unified_fetch_one(ticker, full_backfill=args.full_backfill,
+                                              cache=cache,
+                                              force_fundamentals=args.force_fundamentals)
+        except Exception as e:
+            print(f"    ❌ {e}")
+            detected_name = None
+        finally:
+            if cache is not None:
+                cache.close()
 
         if detected_name:
             if not user_name and detected_name != ticker:
@@ -240,8 +423,9 @@ def main():
         name = STOCK_NAME_MAPPING.get(ticker, ticker)
         print(f"\n🗑️  移除股票: {ticker} ({name})")
 
-        deleted = remove_ticker_from_db(ticker)
-        print(f"   刪除 DB 記錄: {deleted} 筆")
+        kept = archive_ticker(ticker)
+        if kept is not None:
+            print(f"   已封存 DB 記錄: {kept} 筆（--purge 才會刪除）")
 
         if ticker in STOCK_LIST:
             STOCK_LIST.remove(ticker)
@@ -256,12 +440,105 @@ def main():
         print(f"{'='*60}")
         return
 
+    # ──────────── Mode: Purge ────────────
+    if args.purge:
+        result = purge_archived_tickers()
+        if not result['tickers']:
+            print("\n✅ 沒有已封存的股票")
+            return
+        reclaimed = result['bytes_before'] - result['bytes_after']
+        print(f"\n🧹 已刪除 {len(result['tickers'])} 檔封存股票：{', '.join(result['tickers'])}")
+        print(f"   刪除記錄: {result['rows']} 筆")
+        if result['archives']:
+            print("   年度歸檔: " + '、'.join(
+                f"{year} 年 {rows} 筆" for year, rows in result['archives'].items()))
+        print(f"   資料庫: {result['bytes_before'] / 1024 / 1024:.1f} MB → "
+              f"{result['bytes_after'] / 1024 / 1024:.1f} MB"
+              f"（回收 {reclaimed / 1024 / 1024:.1f} MB）")
+        return
+
+    # ──────────── Mode: Compact ────────────
+    if args.compact:
+        result = compact_database(keep_daily_years=args.keep_daily_years)
+        reclaimed = result['bytes_before'] - result['bytes_after']
+        print(f"\n🧹 資料庫壓實完成（共刪除 {result['rows']} 列）")
+        print(f"   重複快照: {result['duplicates']} 筆")
+        print(f"   孤兒快照: {result['orphans']} 筆")
+        if result['cutoff']:
+            print(f"   週線化日線: {result['bars']} 筆（{result['cutoff']} 之前）")
+        if result['full_vacuum']:
+            print("   已切換 auto_vacuum=INCREMENTAL（首次完整 VACUUM）")
+        print(f"   資料庫: {result['bytes_before'] / 1024 / 1024:.1f} MB → "
+              f"{result['bytes_after'] / 1024 / 1024:.1f} MB"
+              f"（回收 {reclaimed / 1024 / 1024:.1f} MB）")
+        return
+
+    # ──────────── Mode: Archive ────────────
+    if args.archive:
+        result = archive_closed_years(hot_years=args.hot_years)
+        if not result['years']:
+            print(f"\n✅ 熱資料庫沒有 {hot_since(args.hot_years)} 之前的日線可歸檔")
+            return
+        reclaimed = result['bytes_before'] - result['bytes_after']
+        print(f"\n📦 已歸檔 {len(result['years'])} 個年度（熱資料庫保留 {hot_since(args.hot_years)} 起）")
+        for year, rows in result['years'].items():
+            print(f"   {year}: {rows} 筆")
+        print(f"   孤兒快照: {result['orphans']} 筆")
+        print(f"   資料庫: {result['bytes_before'] / 1024 / 1024:.1f} MB → "
+              f"{result['bytes_after'] / 1024 / 1024:.1f} MB"
+              f"（回收 {reclaimed / 1024 / 1024:.1f} MB）")
+        return
+
+    # ──────────── Mode: Restate ────────────
+    if args.restate is not None:
+        tickers = [t.strip() for t in args.restate] or None
+        invalid = [t for t in tickers or [] if not TICKER_PATTERN.match(t)]
+        if invalid:
+            print(f"\n❌ 無效的股票代碼格式：{', '.join(invalid)}（應為 4-6 位數字）")
+            return
+        start = time.time()
+        print(f"\n🔁 以 DB 季報修正 {'全部股票' if tickers is None else ', '.join(tickers)}"
+              f"（{args.workers} 個行程）")
+        n_tickers, updated, total = restate_all_from_db(tickers, workers=args.workers)
+        if not n_tickers:
+            print("\n⚠️ 沒有可用的季報（fundamentals_history 為空）")
+            return
+        archived = restate_archives(tickers)
+        print(f"   {n_tickers} 檔，檢查 {total} 筆日線，改寫 {updated} 筆"
+              f"（{time.time() - start:.1f} 秒）")
+        if archived:
+            print("   歸檔改寫: " + "、".join(
+                f"{year} 年 {rows} 筆" for year, rows in archived.items()))
+        regenerate_json()
+        return
+
     # ──────────── Mode: Regen Only ────────────
     if args.regen_only:
         regenerate_json()
         print("\n✅ JSON 重新生成完成")
         return
 
+    # ──────────── Mode: Quotes Only ────────────
+    if args.quotes_only:
+        start = time.time()
+        tickers = sorted(STOCK_LIST)
+        resolve_unresolved(tickers)
+        symbols = registered_symbols(tickers)
+        quotes = fetch_latest_quotes(sorted(symbols.values()))
+        by_ticker = {t: quotes[sym] for t, sym in symbols.items() if sym in quotes}
+        save_quotes_only(by_ticker)
+
+        print(f"\n💹 批次報價：{len(by_ticker)}/{len(tickers)} 檔")
+        missing = sorted(set(tickers) - set(by_ticker))
+        if missing:
+            print(f"   ⚠️  無報價: {', '.join(missing)}")
+        try:
+            generate_stock_data_json()
+        except Exception as e:
+            print(f"❌ stock_data.json: {e}")
+        print(f"\n✅ 報價更新完成！耗時 {time.time() - start:.1f} 秒")
+        return
+
     # ──────────── Mode: Diff Sync ────────────
     config_set = set(STOCK_LIST)
     db_set = get_db_tickers()
@@ -275,53 +552,81 @@ def main():
     print(f"  🆕 新增: {len(added)} 檔  {sorted(added) if added else ''}")
     print(f"  🗑️  移除: {len(removed)} 檔  {sorted(removed) if removed else ''}")
     print(f"  ✓  保留: {len(existing)} 檔")
+    restored = sorted(added & set(get_archived_tickers()))
+    if restored:
+        print(f"  ♻️  其中 {len(restored)} 檔從封存還原（只補抓缺口）: {restored}")
 
     if args.dry_run:
+        # 各股下一季財報最早可取得日（未到期的股票同步時不會下載財報）
+        today = date.today().isoformat()
+        period_ends = get_latest_period_ends(config_set)
+        print(f"\n{'代碼':<8} {'最新季度':<12} {'下次財報':<12} 狀態")
+        for ticker in sorted(config_set):
+            latest = period_ends.get(ticker)
+            due = next_fundamentals_due(latest)
+            status = '下載' if due is None or due <= today else '略過'
+            print(f"{ticker:<8} {latest or '—':<12} {due or '立即':<12} {status}")
+
         print("\n📝 [Dry Run] 僅顯示差異，未執行任何操作")
         regenerate_json()
         return
 
     start_time = time.time()
 
-    # 新增
+    # 所有抓取共用同一個限速器（取代每支之間的固定 sleep）
+    limiter = TokenBucket(args.rate, args.burst or args.workers)
+    cache = ResponseCache() if use_cache else None
+    fetch_one = functools.partial(unified_fetch_one, full_backfill=args.full_backfill,
+                                  cache=cache, force_fundamentals=args.force_fundamentals)
+
+    # 批次解析尚未登錄的交易所代碼（.TW 一起探測，剩下再一起探測 .TWO）
+    to_fetch = sorted(added | existing) if args.refresh else sorted(added)
+    if to_fetch:
+        resolved, unresolved = resolve_unresolved(to_fetch)
+        if resolved or unresolved:
+            n_two = sum(1 for sym in resolved.values() if sym.endswith('.TWO'))
+            print(f"\n🔎 交易所解析：新登錄 {len(resolved)} 檔"
+                  f"（上市 {len(resolved) - n_two} / 上櫃 {n_two}）"
+                  + (f"，批次查無 {len(unresolved)} 檔" if unresolved else ''))
+
+    pool_stats = []
     failures = []
-    if added:
-        print(f"\n{'─' * 40}")
-        print(f"🆕 新增 {len(added)} 檔股票（統一抓取）")
-        for i, ticker in enumerate(sorted(added)):
-            try:
-                unified_fetch_one(ticker)
-            except Exception as e:
-                print(f"    ⚠️ {ticker} 失敗: {e}")
-                failures.append(ticker)
-            if i < len(added) - 1:
-                time.sleep(REQUEST_DELAY)
 
-    # 移除幽靈股
+    # 所有 DB 寫入交給單一 writer 執行緒，fetch worker 之間不會互搶鎖
+    with WriteSink(commit_every=args.commit_every) as sink, use_sink(sink):
+        # 新增
+        if added:
+            print(f"\n{'─' * 40}")
+            print(f"🆕 新增 {len(added)} 檔股票（統一抓取）")
+            failed, stats = run_pool(sorted(added), fetch_one,
+                                     workers=args.workers, limiter=limiter)
+            failures.extend(failed)
+            pool_stats.append(stats)
+
+        # 強制重抓
+        if args.refresh and existing:
+            print(f"\n{'─' * 40}")
+            print(f"🔄 重新抓取 {len(existing)} 檔既有股票（統一抓取）")
+            failed, stats = run_pool(sorted(existing), fetch_one,
+                                     workers=args.workers, limiter=limiter)
+            failures.extend(failed)
+            pool_stats.append(stats)
+    sink_stats = sink.stats()
+    # 已 end_ticker 後才因同一交易的其他失敗而回滾的 ticker
+    failures.extend(t for t in sink.failures() if t not in failures)
+
+    # 封存幽靈股（資料保留，--purge 才刪除）
     if removed:
         print(f"\n{'─' * 40}")
-        print(f"🗑️  移除 {len(removed)} 檔幽靈股")
+        print(f"🗑️  封存 {len(removed)} 檔幽靈股")
         for ticker in sorted(removed):
             try:
-                n = remove_ticker_from_db(ticker)
-                print(f"  ✗ {ticker}: 刪除 {n} 筆")
+                n = archive_ticker(ticker)
+                print(f"  ✗ {ticker}: 封存 {n} 筆")
             except Exception as e:
                 print(f"  ⚠️ {ticker} 移除失敗: {e}")
                 failures.append(ticker)
 
-    # 強制重抓
-    if args.refresh and existing:
-        print(f"\n{'─' * 40}")
-        print(f"🔄 重新抓取 {len(existing)} 檔既有股票（統一抓取）")
-        for i, ticker in enumerate(sorted(existing)):
-            try:
-                unified_fetch_one(ticker)
-            except Exception as e:
-                print(f"    ⚠️ {ticker} 失敗: {e}")
-                failures.append(ticker)
-            if i < len(existing) - 1:
-                time.sleep(REQUEST_DELAY)
-
     # JSON
     regenerate_json()
 
@@ -334,6 +639,17 @@ def main():
         print(f"   🗑️  移除: {', '.join(sorted(removed))}")
     if failures:
         print(f"   ⚠️  失敗: {', '.join(failures)}")
+    for stats in pool_stats:
+        print(f"   {format_pool_stats(stats)}")
+    if sink_stats['rows'] or sink_stats['calls']:
+        print(f"   {format_sink_stats(sink_stats)}")
+    provider_stats = provider.stats()
+    if provider_stats['retries'] or provider_stats['gave_up'] or provider_stats['trips']:
+        print(f"   {format_resilience_stats(provider_stats)}")
+    if cache is not None:
+        if cache.stats['hits'] or cache.stats['misses']:
+            print(f"   {cache.summary()}")
+        cache.close()
     print(f"{'=' * 60}")
 
 
@@ -0,0 +1,98 @@
+"""
+測試共用：暫存資料庫與 DataFrame 替身
+
+fetchers 只用到 DataFrame / Series 的一小部分介面（.empty / .index / .columns /
+.loc[列, 欄] / .items() / .iterrows()），這裡以純 Python 物件實作，測試不需安裝 pandas。
+"""
+
+import contextlib
+import io
+import os
+import sqlite3
+import tempfile
+from datetime import datetime
+
+import stock_config
+from db.connection import close_connection
+
+
+class TempDatabaseMixin:
+    """setUp 建立暫存目錄與已初始化的資料庫，並把 stock_config.DB_PATH 指過去。"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self._db_path = stock_config.DB_PATH
+        stock_config.DB_PATH = os.path.join(self.tmp.name, 'test.db')
+        with contextlib.redirect_stdout(io.StringIO()):
+            stock_config.init_database()
+
+    def tearDown(self):
+        close_connection()
+        stock_config.DB_PATH = self._db_path
+        self.tmp.cleanup()
+
+    def query(self, sql, params=()):
+        """以獨立連線讀取（只看得到已 commit 的資料）。"""
+        with contextlib.closing(sqlite3.connect(stock_config.DB_PATH)) as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def execute(self, sql, params=()):
+        with contextlib.closing(sqlite3.connect(stock_config.DB_PATH)) as conn, conn:
+            conn.execute('PRAGMA foreign_keys = ON')
+            conn.execute(sql, params)
+
+    def table_rows(self, *tables):
+        """各表全部資料（依所有欄位排序），比對前後是否有任何改變。"""
+        return {table: self.query(f'SELECT * FROM {table} ORDER BY 1, 2, 3') for table in tables}
+
+
+def day(text):
+    return datetime.strptime(text, '%Y-%m-%d')
+
+
+class Frame:
+    """財報 DataFrame 替身：{列標籤: {欄（datetime）: 值}}，frame.loc[列, 欄] 取值。"""
+
+    def __init__(self, data):
+        self._data = data
+        self.index = list(data)
+        self.columns = sorted({col for row in data.values() for col in row})
+        self.empty = not self.columns
+        self.loc = self
+
+    def __getitem__(self, key):
+        label, col = key
+        return self._data[label][col]
+
+
+class Series:
+    """股利 Series 替身：[(datetime, 值)]。"""
+
+    def __init__(self, items):
+        self._items = list(items)
+        self.empty = not self._items
+
+    def items(self):
+        return iter(self._items)
+
+
+class _Usage(list):
+    def sum(self):
+        return sum(self, 0)
+
+
+class PriceHistory:
+    """ticker.history() 的替身：[(datetime, 收盤價)]，每列只有 Close。"""
+
+    def __init__(self, closes):
+        self._rows = [(d, {'Close': close}) for d, close in closes]
+        self.empty = not self._rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def iterrows(self):
+        return iter(self._rows)
+
+    def memory_usage(self, index=True):
+        return _Usage([16] * len(self._rows))
@@ -0,0 +1,115 @@
+"""
+db.partitions.restate_archives：--restate 也要改寫年度歸檔中攤平的指標，
+結果與從未歸檔的資料庫以 stock_history view 推導的值相同
+
+執行：python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import os
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+import stock_config
+from _support import TempDatabaseMixin, day
+from db.connection import close_connection, shared_connection
+from db.partitions import HISTORY_COLUMNS, archive_closed_years, history_partitions, restate_archives
+from transforms import snapshots
+from transforms.snapshots import restate_all_from_db
+
+_QUARTER_ENDS = ['2021-03-31', '2021-06-30', '2021-09-30', '2021-12-31',
+                 '2022-03-31', '2022-06-30', '2022-09-30', '2022-12-31']
+_COLUMNS = ', '.join(HISTORY_COLUMNS)
+
+
+class ArchiveRestateTest(TempDatabaseMixin, unittest.TestCase):
+
+    def populate(self, eps_bump=0.0):
+        self.execute("INSERT INTO tickers (ticker) VALUES ('2330'), ('1101')")
+        for ticker, scale in (('2330', 1.0), ('1101', 0.3)):
+            for k, period_end in enumerate(_QUARTER_ENDS):
+                self.execute('''
+                    INSERT INTO fundamentals_history
+                    (ticker, period_end, fiscal_year, fiscal_quarter, eps, net_income, revenue,
+                     equity, total_debt, shares_outstanding, fcf, dividend_per_share)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (ticker, period_end, int(period_end[:4]), k % 4 + 1,
+                      (3.1 + 0.27 * k) * scale + eps_bump, 8.1e10 * scale * (1 + 0.03 * k),
+                      2.3e11 * scale * (1 + 0.02 * k), 1.2e12 * scale, 3.2e11 * scale,
+                      2.6e10, 6.5e4 * scale, 2.75 if k % 4 == 3 else None))
+            start = day('2021-01-04')
+            for n in range(0, 1000, 7):
+                trade_date = (start + timedelta(days=n)).strftime('%Y-%m-%d')
+                self.execute('''
+                    INSERT INTO price_bars (ticker_id, trade_date, price, fetch_time)
+                    SELECT id, ?, ?, ? || ' 13:30:00' FROM tickers WHERE ticker = ?
+                ''', (trade_date, (500.0 + n % 37) * scale, trade_date, ticker))
+
+    def restate(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            restate_all_from_db()
+            return restate_archives()
+
+    def history_rows(self):
+        """全部分區的日線（歸檔 + 熱資料庫），依 ticker / 日期排序。"""
+        rows = []
+        with shared_connection() as conn, contextlib.closing(history_partitions(conn)) as parts:
+            for schema in parts:
+                rows += conn.execute(f'SELECT {_COLUMNS} FROM {schema}.stock_history').fetchall()
+        return sorted(rows)
+
+    def reference_rows(self, eps_bump):
+        """同樣的資料、同樣的設定，在從未歸檔的資料庫上修正後 view 推導的結果。"""
+        close_connection()
+        path = stock_config.DB_PATH
+        stock_config.DB_PATH = os.path.join(self.tmp.name, 'reference', 'test.db')
+        os.makedirs(os.path.dirname(stock_config.DB_PATH))
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                stock_config.init_database()
+            self.populate(eps_bump)
+            self.restate()
+            return sorted(self.query(f'SELECT {_COLUMNS} FROM stock_history'))
+        finally:
+            close_connection()
+            stock_config.DB_PATH = path
+
+    def test_restate_reaches_archived_years(self):
+        self.populate()
+        self.restate()
+        with contextlib.redirect_stdout(io.StringIO()):
+            moved = archive_closed_years(hot_years=1)['years']
+        self.assertEqual(sorted(moved), [2021, 2022, 2023])
+
+        # 申報延遲與季報數字都改了：歸檔年度也要跟著修正
+        self.execute('UPDATE fundamentals_history SET eps = eps + 0.5')
+        with mock.patch.object(snapshots, 'REPORT_DELAY_DAYS', 60):
+            stale = self.history_rows()
+            rewritten = self.restate()
+            expected = self.reference_rows(eps_bump=0.5)
+        self.assertNotEqual(stale, expected)
+        self.assertEqual(sorted(rewritten), [2021, 2022, 2023])
+        self.assertEqual(self.history_rows(), expected)
+
+        # 已一致時不再改寫
+        with mock.patch.object(snapshots, 'REPORT_DELAY_DAYS', 60):
+            self.assertEqual(self.restate(), {})
+
+    def test_restate_limited_to_tickers(self):
+        self.populate()
+        self.restate()
+        with contextlib.redirect_stdout(io.StringIO()):
+            archive_closed_years(hot_years=1)
+        self.execute("UPDATE fundamentals_history SET eps = eps + 0.5 WHERE ticker = '2330'")
+        with contextlib.redirect_stdout(io.StringIO()):
+            restate_all_from_db(['2330'])
+        before = [row for row in self.history_rows() if row[0] == '1101']
+        self.assertEqual(restate_archives(['1101']), {})
+        self.assertTrue(restate_archives(['2330']))
+        self.assertEqual([row for row in self.history_rows() if row[0] == '1101'], before)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+--compact：重複的 quote 快照合併、孤兒快照刪除、早於保留年限的日線只留每週最後一個交易日，
+保留下來的日線在 stock_history 中的數值不變
+
+執行：python -m unittest discover -s tests
+"""
+
+import contextlib
+import sqlite3
+import unittest
+from datetime import date, timedelta
+
+import stock_config
+from _support import TempDatabaseMixin
+from db.maintenance import _years_ago, compact_database
+
+_VIEW_SQL = '''
+    SELECT ticker, trade_date, price, eps, pe, pb, roe, dividend_yield, fcf, bvps
+    FROM stock_history ORDER BY ticker, trade_date
+'''
+
+
+class CompactTest(TempDatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.execute("INSERT INTO tickers (id, ticker) VALUES (1, '2330'), (2, '1101')")
+        self.today = date.today()
+        self.days = [self.today - timedelta(days=k) for k in range(800, -1, -1)
+                     if (self.today - timedelta(days=k)).weekday() < 5]
+        self.execute('''
+            INSERT INTO fundamental_snapshots (id, ticker_id, kind, period_end, available_from,
+                                               eps, bvps)
+            VALUES (1, 1, 'quarter', '2022-12-31', '2023-02-14', 8.0, 100.0),
+                   (2, 1, 'quarter', '2023-03-31', '2023-05-15', 9.0, 105.0)
+        ''')
+        # quote 快照每日一筆，內容在三種之間每 30 天輪替：同內容的應合併為一筆
+        with contextlib.closing(sqlite3.connect(stock_config.DB_PATH)) as conn, conn:
+            for ticker_id in (1, 2):
+                for k, d in enumerate(self.days):
+                    snapshot_id = conn.execute('''
+                        INSERT INTO fundamental_snapshots (ticker_id, kind, available_from, eps,
+                                                           bvps, dividend)
+                        VALUES (?, 'quote', ?, ?, 50.0, 2.5)
+                    ''', (ticker_id, d.isoformat(), 3.0 + (k // 30) % 3)).lastrowid
+                    conn.execute('''
+                        INSERT INTO price_bars (ticker_id, trade_date, price, fetch_time,
+                                                snapshot_id)
+                        VALUES (?, ?, ?, ? || ' 13:30:00', ?)
+                    ''', (ticker_id, d.isoformat(), 100.0 + k, d.isoformat(), snapshot_id))
+        # 沒有日線指向的 quote 快照：較舊的是孤兒，每檔最新一筆保留
+        self.execute('''
+            INSERT INTO fundamental_snapshots (ticker_id, kind, available_from, eps)
+            VALUES (2, 'quote', '2000-01-03', 1.0), (2, 'quote', '2099-01-01', 1.5)
+        ''')
+
+    def test_weekly_retention_before_cutoff(self):
+        before = self.query(_VIEW_SQL)
+        stats = compact_database(keep_daily_years=1)
+        cutoff = _years_ago(1).isoformat()
+        self.assertEqual(stats['cutoff'], cutoff)
+
+        weeks = {}
+        for d in self.days:
+            if d.isoformat() < cutoff:
+                weeks[d.strftime('%Y-%W')] = d.isoformat()
+        expected_dates = sorted(set(weeks.values())
+                                | {d.isoformat() for d in self.days if d.isoformat() >= cutoff})
+        for ticker_id in (1, 2):
+            self.assertEqual([r[0] for r in self.query(
+                'SELECT trade_date FROM price_bars WHERE ticker_id = ? ORDER BY trade_date',
+                (ticker_id,))], expected_dates)
+        self.assertEqual(stats['bars'], 2 * (len(self.days) - len(expected_dates)))
+
+        kept = set(expected_dates)
+        self.assertEqual(self.query(_VIEW_SQL), [r for r in before if r[1] in kept])
+
+    def test_merges_duplicates_and_drops_orphans(self):
+        before = self.query(_VIEW_SQL)
+        stats = compact_database()
+        self.assertIsNone(stats['cutoff'])
+        self.assertEqual(stats['bars'], 0)
+        self.assertEqual(self.query(_VIEW_SQL), before)
+
+        # 每種內容只剩一筆（保留最新的 available_from），日線改指向它；季報快照不動
+        self.assertEqual(self.query("SELECT ticker_id, COUNT(*) FROM fundamental_snapshots "
+                                    "WHERE kind = 'quote' AND eps >= 3 GROUP BY ticker_id"),
+                         [(1, 3), (2, 3)])
+        self.assertEqual(stats['duplicates'], 2 * (len(self.days) - 3))
+        self.assertEqual(self.query('SELECT COUNT(DISTINCT snapshot_id) FROM price_bars'), [(6,)])
+        self.assertEqual(self.query("SELECT id FROM fundamental_snapshots WHERE kind = 'quarter'"),
+                         [(1,), (2,)])
+        self.assertEqual(stats['orphans'], 1)
+        self.assertEqual(self.query("SELECT available_from FROM fundamental_snapshots "
+                                    "WHERE eps < 3"), [('2099-01-01',)])
+        self.assertEqual(stats['rows'], stats['duplicates'] + stats['orphans'])
+
+        # 已壓實：再跑一次沒有可刪的
+        self.assertEqual(compact_database()['rows'], 0)
+
+    def test_years_ago_leap_day(self):
+        self.assertEqual(_years_ago(1, date(2024, 2, 29)), date(2023, 2, 28))
+        self.assertEqual(_years_ago(2, date(2024, 6, 3)), date(2022, 6, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
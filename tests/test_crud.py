@@ -0,0 +1,140 @@
+"""
+db.crud 的查詢與刪除（刪除由外鍵連鎖到所有子表）
+
+執行：python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import unittest
+
+import stock_config
+from _support import TempDatabaseMixin
+from db.connection import close_connection, shared_connection
+from db.crud import get_latest_period_ends, remove_ticker_from_db
+
+# 參照 tickers 的子表：(欄位, tickers 的對應欄位)
+_CASCADE_TABLES = {
+    'price_bars': ('ticker_id', 'id'),
+    'fundamental_snapshots': ('ticker_id', 'id'),
+    'snapshot_fingerprints': ('ticker_id', 'id'),
+    'stock_latest': ('ticker_id', 'id'),
+    'fundamentals_history': ('ticker', 'ticker'),
+    'annual_fundamentals': ('ticker', 'ticker'),
+}
+
+
+class LatestPeriodEndsTest(TempDatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.execute("INSERT INTO tickers (ticker) VALUES ('2330'), ('2317'), ('1101')")
+        self.execute("UPDATE tickers SET archived_at = '2025-01-01' WHERE ticker = '1101'")
+        for ticker, period_ends in (('2330', ('2024-06-30', '2024-09-30')),
+                                    ('2317', ('2024-03-31',)),
+                                    ('1101', ('2024-12-31',))):
+            for period_end in period_ends:
+                self.execute('INSERT INTO fundamentals_history '
+                             '(ticker, period_end, fiscal_year, fiscal_quarter) VALUES (?, ?, ?, ?)',
+                             (ticker, period_end, int(period_end[:4]),
+                              int(period_end[5:7]) // 3))
+
+    def test_all_skips_archived(self):
+        self.assertEqual(get_latest_period_ends(), {'2330': '2024-09-30', '2317': '2024-03-31'})
+
+    def test_explicit_tickers(self):
+        self.assertEqual(get_latest_period_ends(['2330']), {'2330': '2024-09-30'})
+        self.assertEqual(get_latest_period_ends({'2317', '1101', '9999'}),
+                         {'2317': '2024-03-31', '1101': '2024-12-31'})
+        self.assertEqual(get_latest_period_ends([]), {})
+
+    def test_explicit_tickers_filter_in_sql(self):
+        statements = []
+        with shared_connection() as conn:
+            conn.set_trace_callback(statements.append)
+            try:
+                get_latest_period_ends(['2330'])
+                get_latest_period_ends(['2330', '2317'])
+            finally:
+                conn.set_trace_callback(None)
+            self.assertEqual(len(statements), 2)
+            for sql in statements:
+                plan = ' '.join(row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql))
+                # 走 (ticker, period_end) 索引，不掃整張表
+                self.assertIn('USING', plan)
+                self.assertNotIn('SCAN fundamentals_history', plan)
+
+
+class RemoveTickerTest(TempDatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.execute("INSERT INTO tickers (ticker) VALUES ('2330'), ('1101')")
+        for ticker in ('2330', '1101'):
+            self.add_rows(ticker)
+
+    def add_rows(self, ticker):
+        self.execute('''
+            INSERT INTO fundamental_snapshots (ticker_id, kind, available_from, eps)
+            SELECT id, 'quarter', '2024-05-15', 8.0 FROM tickers WHERE ticker = ?
+        ''', (ticker,))
+        for trade_date in ('2024-06-03', '2024-06-04'):
+            self.execute('''
+                INSERT INTO price_bars (ticker_id, trade_date, price, fetch_time, snapshot_id)
+                SELECT t.id, ?, 100.0, ? || ' 13:30:00', s.id
+                FROM tickers t JOIN fundamental_snapshots s ON s.ticker_id = t.id
+                WHERE t.ticker = ?
+            ''', (trade_date, trade_date, ticker))
+        self.execute('''
+            INSERT INTO snapshot_fingerprints (ticker_id, fingerprint, restated_through)
+            SELECT id, 'f', '2024-06-04' FROM tickers WHERE ticker = ?
+        ''', (ticker,))
+        self.execute('INSERT INTO fundamentals_history (ticker, period_end, fiscal_year, '
+                     "fiscal_quarter) VALUES (?, '2024-03-31', 2024, 1)", (ticker,))
+        self.execute('INSERT INTO annual_fundamentals (ticker, fiscal_year, period_end) '
+                     "VALUES (?, 2023, '2023-12-31')", (ticker,))
+
+    def counts(self, ticker):
+        return {table: self.query(f'SELECT COUNT(*) FROM {table} x JOIN tickers t '
+                                  f'ON t.{key} = x.{column} WHERE t.ticker = ?', (ticker,))[0][0]
+                for table, (column, key) in _CASCADE_TABLES.items()}
+
+    def test_cascades_to_every_child_table(self):
+        self.assertEqual(set(self.counts('2330').values()), {1, 2})
+        kept = self.counts('1101')
+
+        # 2 日線 + 1 快照 + 1 季報 + 1 年報
+        self.assertEqual(remove_ticker_from_db('2330'), 5)
+        self.assertEqual(self.query("SELECT COUNT(*) FROM tickers WHERE ticker = '2330'"), [(0,)])
+        for table, (column, key) in _CASCADE_TABLES.items():
+            self.assertEqual(self.query(f'SELECT COUNT(*) FROM {table} '
+                                        f'WHERE {column} NOT IN (SELECT {key} FROM tickers)'),
+                             [(0,)], table)
+        self.assertEqual(self.counts('1101'), kept)
+        self.assertEqual(remove_ticker_from_db('2330'), 0)
+
+    def test_legacy_table_without_foreign_key_is_rebuilt(self):
+        # 舊版 annual_fundamentals 沒有外鍵：重新初始化時就地重建，代碼登錄進 tickers
+        self.execute('DROP TABLE annual_fundamentals')
+        self.execute('''
+            CREATE TABLE annual_fundamentals (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, ticker TEXT NOT NULL,
+                fiscal_year INTEGER NOT NULL, period_end DATE NOT NULL, eps REAL,
+                UNIQUE(ticker, fiscal_year))
+        ''')
+        self.execute("INSERT INTO annual_fundamentals (ticker, fiscal_year, period_end, eps) "
+                     "VALUES ('2330', 2023, '2023-12-31', 32.3), ('2454', 2023, '2023-12-31', 48.5)")
+        close_connection()
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            stock_config.init_database()
+        self.assertIn('annual_fundamentals 已重建', out.getvalue())
+        self.assertTrue(self.query('PRAGMA foreign_key_list(annual_fundamentals)'))
+        self.assertEqual(self.query('SELECT ticker, eps FROM annual_fundamentals ORDER BY ticker'),
+                         [('2330', 32.3), ('2454', 48.5)])
+
+        self.assertEqual(remove_ticker_from_db('2454'), 1)
+        self.assertEqual(self.query('SELECT ticker FROM annual_fundamentals'), [('2330',)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+"""
+exporters.stock_data 的進階估值欄位：SQL 版與原本逐筆 Python 計算的輸出一致，
+快取鍵區分重建的資料庫
+
+執行：python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+from collections import defaultdict
+from unittest import mock
+
+import stock_config
+from db.connection import close_connection, shared_connection
+from db.meta import get_data_version, get_db_id
+from exporters import stock_data
+from exporters.stock_data import compute_fundamentals_enrichment
+
+
+def _reference_enrichment(cursor):
+    """改寫為 SQL 前的逐筆 Python 計算（對照用，須以 sqlite3.Row 游標呼叫）。"""
+    enrichment = {}
+
+    cursor.execute('''
+        SELECT ticker, fiscal_year, eps, fcf, shares_outstanding
+        FROM annual_fundamentals
+        ORDER BY ticker, fiscal_year ASC
+    ''')
+    annual_by_ticker = defaultdict(list)
+    for r in cursor.fetchall():
+        annual_by_ticker[r['ticker']].append(dict(r))
+
+    for ticker, years in annual_by_ticker.items():
+        recent = years[-3:] if len(years) >= 3 else years
+
+        eps_values = [y['eps'] for y in recent if y['eps'] is not None]
+        avg_eps = round(sum(eps_values) / len(eps_values), 2) if eps_values else None
+
+        historical_eps = [y['eps'] for y in years if y['eps'] is not None]
+
+        fcfps_values = []
+        for y in recent:
+            if y['fcf'] is not None and y['shares_outstanding'] and y['shares_outstanding'] > 0:
+                fcfps_values.append(y['fcf'] / y['shares_outstanding'])
+        avg_fcfps = round(sum(fcfps_values) / len(fcfps_values), 2) if fcfps_values else None
+
+        enrichment[ticker] = {
+            'avgEps': avg_eps,
+            'avgFcfPerShare': avg_fcfps,
+            'fcfPerShare': None,
+            'historicalEps': historical_eps,
+            'shareDilutionRate': None,
+        }
+
+        shares_data = [(y['fiscal_year'], y['shares_outstanding'])
+                       for y in years if y.get('shares_outstanding') and y['shares_outstanding'] > 0]
+        if len(shares_data) >= 2:
+            shares_data.sort(key=lambda x: x[0])
+            oldest_year, oldest_shares = shares_data[0]
+            newest_year, newest_shares = shares_data[-1]
+            n_years = newest_year - oldest_year
+            if n_years > 0 and oldest_shares > 0:
+                dilution = ((newest_shares / oldest_shares) ** (1 / n_years) - 1) * 100
+                enrichment[ticker]['shareDilutionRate'] = round(dilution, 2)
+
+    cursor.execute('''
+        SELECT ticker, period_end, eps, fcf, shares_outstanding
+        FROM fundamentals_history
+        ORDER BY ticker, period_end ASC
+    ''')
+    quarterly_by_ticker = defaultdict(list)
+    for r in cursor.fetchall():
+        quarterly_by_ticker[r['ticker']].append(dict(r))
+
+    for ticker, quarters in quarterly_by_ticker.items():
+        shares = 0
+        for q in reversed(quarters):
+            if q['shares_outstanding'] and q['shares_outstanding'] > 0:
+                shares = q['shares_outstanding']
+                break
+
+        fcf_per_share = None
+        if len(quarters) >= 4 and shares > 0:
+            ttm_fcf_m = sum(quarters[j]['fcf'] or 0 for j in range(len(quarters) - 4, len(quarters)))
+            fcf_per_share = round(ttm_fcf_m * 1_000_000 / shares, 2)
+
+        if ticker not in enrichment:
+            enrichment[ticker] = {
+                'avgEps': None, 'avgFcfPerShare': None,
+                'fcfPerShare': None, 'historicalEps': [],
+                'shareDilutionRate': None,
+            }
+
+        enrichment[ticker]['fcfPerShare'] = fcf_per_share
+        if enrichment[ticker]['avgFcfPerShare'] is None and fcf_per_share is not None:
+            enrichment[ticker]['avgFcfPerShare'] = fcf_per_share
+
+    return enrichment
+
+
+def _maybe(rng, value, p_none=0.15):
+    return None if rng.random() < p_none else value
+
+
+def _populate(conn, rng, n_tickers=60):
+    for k in range(n_tickers):
+        ticker = str(1101 + k)
+        conn.execute('INSERT INTO tickers (ticker) VALUES (?)', (ticker,))
+        for year in rng.sample(range(2010, 2025), rng.randint(0, 8)):
+            conn.execute('''
+                INSERT INTO annual_fundamentals
+                (ticker, fiscal_year, period_end, eps, fcf, shares_outstanding)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (ticker, year, f'{year}-12-31',
+                  _maybe(rng, rng.choice([rng.uniform(-5, 40), 0.1 + 0.2, 1 / 3, -0.0, 3])),
+                  _maybe(rng, rng.uniform(-2e10, 9e10)),
+                  _maybe(rng, rng.choice([0, rng.uniform(1e8, 3e10)]))))
+        for year, quarter in rng.sample([(y, q) for y in range(2019, 2025) for q in (1, 2, 3, 4)],
+                                        rng.randint(0, 10)):
+            conn.execute('''
+                INSERT INTO fundamentals_history
+                (ticker, period_end, fiscal_year, fiscal_quarter, eps, fcf, shares_outstanding)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (ticker, f'{year}-{quarter * 3:02d}-28', year, quarter,
+                  _maybe(rng, rng.uniform(-2, 12)),
+                  _maybe(rng, rng.choice([0.0, rng.uniform(-5e3, 2e4)])),
+                  _maybe(rng, rng.choice([0, rng.uniform(1e8, 3e10)]))))
+
+
+class EnrichmentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self._db_path = stock_config.DB_PATH
+        stock_config.DB_PATH = os.path.join(self.tmp.name, 'enrich.db')
+        with contextlib.redirect_stdout(io.StringIO()):
+            stock_config.init_database()
+
+    def tearDown(self):
+        close_connection()
+        stock_config.DB_PATH = self._db_path
+        self.tmp.cleanup()
+
+    def test_matches_reference_implementation(self):
+        with shared_connection(row_factory=sqlite3.Row) as conn:
+            _populate(conn, random.Random(20240603))
+            conn.commit()
+            expected = _reference_enrichment(conn.cursor())
+            actual = compute_fundamentals_enrichment(conn.cursor())
+        self.assertTrue(any(len(e['historicalEps']) > 3 for e in expected.values()))
+        # 以 JSON 文字比對：浮點數逐位元相同、-0.0 與 0.0 也須一致
+        self.assertEqual(json.dumps(actual, sort_keys=True), json.dumps(expected, sort_keys=True))
+
+    def test_historical_eps_keeps_full_precision(self):
+        with shared_connection() as conn:
+            conn.execute("INSERT INTO tickers (ticker) VALUES ('2330')")
+            conn.executemany('''
+                INSERT INTO annual_fundamentals (ticker, fiscal_year, period_end, eps)
+                VALUES ('2330', ?, ?, ?)
+            ''', [(2022, '2022-12-31', 0.1 + 0.2), (2023, '2023-12-31', 1 / 3)])
+            conn.commit()
+            enrichment = compute_fundamentals_enrichment(conn.cursor(), ['2330'])
+        self.assertEqual(enrichment['2330']['historicalEps'], [0.1 + 0.2, 1 / 3])
+
+    def test_cache_key_differs_after_rebuild(self):
+        cache_path = os.path.join(self.tmp.name, 'enrichment.json')
+        with mock.patch.object(stock_data, 'ENRICHMENT_CACHE_PATH', cache_path), \
+                mock.patch.object(stock_data, 'compute_fundamentals_enrichment',
+                                  side_effect=[{'2330': 'old'}, {'2330': 'new'}]) as compute:
+            with shared_connection() as conn:
+                version, db_id = get_data_version(conn), get_db_id(conn)
+                self.assertIsNotNone(db_id)
+                first = stock_data._cached_enrichment(conn.cursor(), ['2330'], version, db_id)
+                again = stock_data._cached_enrichment(conn.cursor(), ['2330'], version, db_id)
+            self.assertEqual(first, {'2330': 'old'})
+            self.assertEqual(again, {'2330': 'old'})
+            self.assertEqual(compute.call_count, 1)
+
+            # 同一路徑刪除重建：data_version 從 0 重數，db_id 不同
+            close_connection()
+            os.remove(stock_config.DB_PATH)
+            with contextlib.redirect_stdout(io.StringIO()):
+                stock_config.init_database()
+            with shared_connection() as conn:
+                self.assertEqual(get_data_version(conn), version)
+                rebuilt = stock_data._cached_enrichment(
+                    conn.cursor(), ['2330'], get_data_version(conn), get_db_id(conn))
+            self.assertEqual(rebuilt, {'2330': 'new'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+"""
+JSON 匯出：兩個 exporter 讀同一版資料；串流寫出的 history 檔與整份 json.dump 逐位元組相同
+
+執行：python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import json
+import os
+import random
+import unittest
+from unittest import mock
+
+import stock_config
+import sync_portfolio
+from _support import TempDatabaseMixin
+from db.connection import read_transaction, shared_connection
+from db.meta import get_data_version
+from exporters import history
+from exporters.history import export_history_json, fetch_history_from_db
+
+
+class ReadTransactionTest(TempDatabaseMixin, unittest.TestCase):
+
+    def count_tickers(self):
+        with shared_connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM tickers').fetchone()[0]
+
+    def test_block_reads_one_version(self):
+        version = get_data_version()
+        with read_transaction() as conn:
+            # 其他連線照常 commit（WAL 下讀交易不擋 writer）
+            self.execute("INSERT INTO tickers (ticker) VALUES ('2330')")
+            self.execute("UPDATE db_meta SET value = value + 1 WHERE key = 'data_version'")
+            self.assertEqual(self.query('SELECT COUNT(*) FROM tickers'), [(1,)])
+
+            self.assertEqual(self.count_tickers(), 0)
+            self.assertEqual(get_data_version(), version)
+            # 巢狀 shared_connection 離開時不會結束讀交易
+            self.assertTrue(conn.in_transaction)
+            self.assertEqual(self.count_tickers(), 0)
+        self.assertFalse(conn.in_transaction)
+        self.assertEqual(self.count_tickers(), 1)
+        self.assertEqual(get_data_version(), version + 1)
+
+    def test_refuses_pending_writes(self):
+        with shared_connection() as conn:
+            conn.execute("INSERT INTO tickers (ticker) VALUES ('2330')")
+            with self.assertRaises(RuntimeError):
+                with read_transaction():
+                    pass
+        self.assertEqual(self.count_tickers(), 0)
+
+    def test_regenerate_json_reads_the_file_without_copying(self):
+        seen = []
+
+        def exporters(version, seconds):
+            with shared_connection() as conn:
+                seen.append((conn.in_transaction, conn.execute('PRAGMA database_list').fetchone()[2]))
+            return True
+
+        with mock.patch.object(sync_portfolio, '_regenerate_json', exporters):
+            sync_portfolio.regenerate_json()
+            sync_portfolio.regenerate_json(in_memory=True)
+        self.assertEqual(seen, [(True, os.path.abspath(stock_config.DB_PATH)), (False, '')])
+
+
+def _dump(payload):
+    """串流化之前的寫法：整份 payload 交給 json.dump(indent=2) 再補換行。"""
+    return (json.dumps(payload, ensure_ascii=False, indent=2) + '\n').encode('utf-8')
+
+
+class StreamingHistoryExportTest(TempDatabaseMixin, unittest.TestCase):
+
+    _TICKERS = ('1101', '2330', '00679B', '6488')
+
+    def setUp(self):
+        super().setUp()
+        rng = random.Random(20240614)
+        for ticker_id, ticker in enumerate(self._TICKERS, 1):
+            self.execute('INSERT INTO tickers (id, ticker) VALUES (?, ?)', (ticker_id, ticker))
+            # 各種數值：負值、0、整數、很小的浮點數、缺值
+            self.execute('''
+                INSERT INTO fundamental_snapshots (id, ticker_id, kind, available_from, eps, bvps,
+                                                   roe, dividend, growth_rate)
+                VALUES (?, ?, 'quarter', '2024-01-01', ?, ?, ?, ?, ?)
+            ''', (ticker_id, ticker_id, rng.choice([-1.37, 0, 12, 3.3e-7, None]),
+                  rng.choice([0, 18.25, -2.0]), rng.choice([None, 25.123, 0]),
+                  rng.choice([None, 0, 2.5]), rng.choice([None, -12.4, 1e-5])))
+            for k in range(rng.randint(1, 6)):
+                failed = rng.random() < 0.2
+                self.execute('''
+                    INSERT INTO price_bars (ticker_id, trade_date, price, fetch_time, fetch_error,
+                                            snapshot_id)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (ticker_id, f'2024-06-{k + 1:02d}',
+                      None if failed else rng.choice([812.5, 0.07, 1005, 33.333333333]),
+                      f'2024-06-{k + 1:02d} 13:30:00', int(failed),
+                      rng.choice([ticker_id, None])))
+        self.execute("UPDATE db_meta SET value = 7 WHERE key = 'data_version'")
+
+    def export(self, stock_list):
+        with contextlib.redirect_stdout(io.StringIO()), \
+                mock.patch.object(history, 'STOCK_LIST', list(stock_list)):
+            expected = fetch_history_from_db()
+            export_history_json(self.tmp.name)
+        return expected
+
+    def read(self, *parts):
+        with open(os.path.join(self.tmp.name, 'public', *parts), 'rb') as f:
+            return f.read()
+
+    def test_matches_json_dump(self):
+        expected = self.export(self._TICKERS)
+        self.assertEqual(sorted(expected), sorted(self._TICKERS))
+
+        combined = self.read('history_all.json')
+        generated_at = json.loads(combined)['generatedAt']
+        self.assertEqual(combined, _dump({'generatedAt': generated_at, 'dataVersion': 7,
+                                          'history': expected}))
+        for ticker, points in expected.items():
+            self.assertEqual(self.read('history', f'{ticker}.json'),
+                             _dump({'generatedAt': generated_at, 'dataVersion': 7,
+                                    'ticker': ticker, 'history': points}))
+
+        # 第二次匯出全部略過個股檔：history_all.json 由快取片段拼接，仍與 json.dump 相同
+        self.execute("UPDATE db_meta SET value = 8 WHERE key = 'data_version'")
+        expected = self.export(self._TICKERS)
+        combined = self.read('history_all.json')
+        self.assertEqual(combined, _dump({'generatedAt': json.loads(combined)['generatedAt'],
+                                          'dataVersion': 8, 'history': expected}))
+
+    def test_empty_history_matches_json_dump(self):
+        self.assertEqual(self.export(()), {})
+        combined = self.read('history_all.json')
+        self.assertEqual(combined, _dump({'generatedAt': json.loads(combined)['generatedAt'],
+                                          'dataVersion': 7, 'history': {}}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""
+fetchers.pool / fetchers.resilience 的錯誤分類
+
+執行：python -m unittest discover -s tests
+"""
+
+import unittest
+
+from fetchers.pool import http_statuses, is_throttle_error
+from fetchers.resilience import classify_error
+
+
+class _Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class _HTTPError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.response = _Response(status_code)
+
+
+class _OSHTTPError(OSError):
+    """模擬 requests.HTTPError（繼承 OSError）。"""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.response = _Response(status_code)
+
+
+class ThrottleClassificationTest(unittest.TestCase):
+
+    def test_status_code_in_message(self):
+        self.assertTrue(is_throttle_error(Exception('HTTP Error 429: Too Many Requests')))
+        self.assertTrue(is_throttle_error(Exception('status 429.')))
+
+    def test_ticker_containing_429_is_not_throttle(self):
+        self.assertFalse(is_throttle_error(Exception('No data found for 1429.TW')))
+        self.assertFalse(is_throttle_error(Exception('HTTP Error 404: symbol 4290.TWO')))
+
+    def test_response_status_wins_over_message(self):
+        self.assertTrue(is_throttle_error(_HTTPError('request failed', 429)))
+        self.assertFalse(is_throttle_error(_HTTPError('HTTP 429 for 1429.TW', 404)))
+
+    def test_http_statuses(self):
+        self.assertEqual(http_statuses(Exception('HTTP Error 404: Quote not found for symbol: 6504.TW')),
+                         {404})
+        self.assertEqual(http_statuses(_HTTPError('boom', 503)), {503})
+        self.assertEqual(http_statuses(Exception('No data found for 1429.TW')), set())
+
+
+class RetryClassificationTest(unittest.TestCase):
+
+    def test_ticker_digits_are_not_server_errors(self):
+        self.assertEqual(classify_error(Exception('HTTP Error 404: Quote not found for symbol: 6504.TW')),
+                         'fatal')
+        self.assertEqual(classify_error(Exception('No data found for 5020.TW')), 'fatal')
+        self.assertEqual(classify_error(Exception('possibly delisted: 1503.TWO')), 'fatal')
+
+    def test_server_status_is_retryable(self):
+        self.assertEqual(classify_error(Exception('HTTP Error 503: Service Unavailable')), 'retryable')
+        self.assertEqual(classify_error(_HTTPError('request failed', 502)), 'retryable')
+
+    def test_client_status_wins_over_oserror(self):
+        self.assertEqual(classify_error(_OSHTTPError('request failed', 404)), 'fatal')
+        self.assertEqual(classify_error(_OSHTTPError('request failed', 500)), 'retryable')
+        self.assertEqual(classify_error(ConnectionResetError('connection reset by peer')), 'retryable')
+
+    def test_text_markers(self):
+        self.assertEqual(classify_error(Exception('Read timed out.')), 'retryable')
+        self.assertEqual(classify_error(Exception('Bad Gateway')), 'retryable')
+
+
+if __name__ == '__main__':
+    unittest.main()
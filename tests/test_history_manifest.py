@@ -0,0 +1,136 @@
+"""
+增量匯出 history：manifest 雜湊未變的股票不重寫個股檔（保留上次的 generatedAt / dataVersion），
+內容有變、檔案遺失或 manifest 格式不符時才重寫；history_all.json 每次完整重建
+
+執行：python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import json
+import os
+import unittest
+from unittest import mock
+
+from _support import TempDatabaseMixin
+from exporters import history
+from exporters.history import export_history_json
+
+
+class HistoryManifestTest(TempDatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.execute("INSERT INTO tickers (id, ticker) VALUES (1, '2330'), (2, '1101')")
+        self.execute('''
+            INSERT INTO fundamental_snapshots (id, ticker_id, kind, available_from, eps, bvps, roe)
+            VALUES (1, 1, 'quarter', '2024-05-15', 32.5, 130.0, 25.1),
+                   (2, 2, 'quarter', '2024-05-15', 2.0, 40.0, 5.3)
+        ''')
+        for trade_date in ('2024-06-03', '2024-06-04'):
+            self.add_bar(1, trade_date, 800.0)
+            self.add_bar(2, trade_date, 40.0)
+        self.log = ''
+
+    def add_bar(self, ticker_id, trade_date, price):
+        self.execute('''
+            INSERT INTO price_bars (ticker_id, trade_date, price, fetch_time, snapshot_id)
+            VALUES (?, ?, ?, ? || ' 13:30:00', ?)
+        ''', (ticker_id, trade_date, price, trade_date, ticker_id))
+        self.execute("UPDATE db_meta SET value = value + 1 WHERE key = 'data_version'")
+
+    def path(self, *parts):
+        return os.path.join(self.tmp.name, *parts)
+
+    def export(self, stock_list=('2330', '1101')):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out), \
+                mock.patch.object(history, 'STOCK_LIST', list(stock_list)):
+            export_history_json(self.tmp.name)
+        self.log = out.getvalue()
+
+    def ticker_file(self, ticker):
+        with open(self.path('public', 'history', f'{ticker}.json'), 'rb') as f:
+            return f.read()
+
+    def mark_untouched(self, ticker):
+        """把個股檔的 mtime 設為 0：之後若被重寫，mtime 就會改變。"""
+        os.utime(self.path('public', 'history', f'{ticker}.json'), ns=(0, 0))
+
+    def mtime(self, ticker):
+        return os.stat(self.path('public', 'history', f'{ticker}.json')).st_mtime_ns
+
+    def combined(self):
+        with open(self.path('public', 'history_all.json'), encoding='utf-8') as f:
+            return json.load(f)
+
+    def test_unchanged_ticker_is_skipped(self):
+        self.export()
+        self.assertIn('重寫 2 檔，略過 0 檔', self.log)
+        first = {t: self.ticker_file(t) for t in ('2330', '1101')}
+        self.mark_untouched('2330')
+        self.mark_untouched('1101')
+
+        self.add_bar(2, '2024-06-05', 41.0)
+        self.export()
+        self.assertIn('重寫 1 檔，略過 1 檔', self.log)
+
+        # 2330 沒變：檔案沒被重寫，generatedAt / dataVersion 維持上次的值
+        self.assertEqual(self.mtime('2330'), 0)
+        self.assertEqual(self.ticker_file('2330'), first['2330'])
+        # 1101 多一天：重寫，標記本次的版本
+        self.assertNotEqual(self.mtime('1101'), 0)
+        rewritten = json.loads(self.ticker_file('1101'))
+        self.assertEqual([p['date'] for p in rewritten['history']],
+                         ['2024-06-03', '2024-06-04', '2024-06-05'])
+        self.assertGreater(rewritten['dataVersion'], json.loads(first['1101'])['dataVersion'])
+
+        # history_all.json 每次重建：版本為本次，略過的股票由快取片段拼接
+        combined = self.combined()
+        self.assertEqual(combined['dataVersion'], rewritten['dataVersion'])
+        self.assertEqual(combined['history']['2330'], json.loads(first['2330'])['history'])
+        self.assertEqual(combined['history']['1101'], rewritten['history'])
+
+    def test_changed_value_is_rewritten(self):
+        self.export()
+        self.mark_untouched('2330')
+        # 同一天的價格改變（日期不變）也要重寫
+        self.execute("UPDATE price_bars SET price = 810.0 WHERE ticker_id = 1 "
+                     "AND trade_date = '2024-06-04'")
+        self.export()
+        self.assertIn('重寫 1 檔，略過 1 檔', self.log)
+        self.assertNotEqual(self.mtime('2330'), 0)
+        self.assertEqual(json.loads(self.ticker_file('2330'))['history'][-1]['price'], 810.0)
+        self.assertEqual(self.combined()['history']['2330'][-1]['price'], 810.0)
+
+    def test_missing_file_or_stale_manifest_is_rewritten(self):
+        self.export()
+        os.remove(self.path('public', 'history', '2330.json'))
+        self.export()
+        self.assertIn('重寫 1 檔，略過 1 檔', self.log)
+        self.assertTrue(os.path.exists(self.path('public', 'history', '2330.json')))
+
+        manifest_path = self.path('.cache', 'history_export', 'manifest.json')
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        self.assertEqual(sorted(manifest['tickers']), ['1101', '2330'])
+        manifest['format'] = 0
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        self.export()
+        self.assertIn('重寫 2 檔，略過 0 檔', self.log)
+
+    def test_dropped_ticker_leaves_no_files(self):
+        self.export()
+        self.export(stock_list=('2330',))
+        self.assertFalse(os.path.exists(self.path('public', 'history', '1101.json')))
+        self.assertFalse(os.path.exists(self.path('.cache', 'history_export', '1101.json')))
+        self.assertEqual(list(self.combined()['history']), ['2330'])
+
+        # 再加回來：manifest 已無記錄，重新寫出
+        self.export()
+        self.assertIn('重寫 1 檔，略過 1 檔', self.log)
+
+
+if __name__ == '__main__':
+    unittest.main()
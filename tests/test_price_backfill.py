@@ -0,0 +1,96 @@
+"""
+fetchers.price.save_historical_prices：有水位線時只抓缺口（往前重疊幾天），
+重疊區間已存的日線不重複寫入
+
+執行：python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import unittest
+from datetime import datetime, timedelta
+
+from _support import PriceHistory, TempDatabaseMixin
+from db.crud import get_history_watermark
+from fetchers.price import WATERMARK_OVERLAP_DAYS, save_historical_prices
+
+_TICKER = '2330'
+_DAYS = 365
+_INFO = {'currentPrice': 600.0, 'trailingEps': 30.0, 'bookValue': 120.0}
+
+
+def _midnight(days_ago):
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=days_ago)
+
+
+class _Stock:
+    """history() 回傳 [start, end] 內的日線，並記錄每次請求的區間。"""
+
+    def __init__(self, closes):
+        self.closes = closes
+        self.requests = []
+
+    def history(self, start, end):
+        self.requests.append((start, end))
+        return PriceHistory([(d, c) for d, c in self.closes if start <= d <= end])
+
+
+class WatermarkBackfillTest(TempDatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.out = io.StringIO()
+
+    def backfill(self, stock, since):
+        with contextlib.redirect_stdout(self.out):
+            save_historical_prices(_TICKER, stock, f'{_TICKER}.TW', _INFO, _DAYS, since=since)
+
+    def bars(self):
+        return dict(self.query('SELECT trade_date, price FROM price_bars ORDER BY trade_date'))
+
+    def test_full_window_without_watermark(self):
+        stock = _Stock([(_midnight(k), 500.0 + k) for k in range(400, 0, -1)])
+        self.backfill(stock, since=None)
+        (start, end), = stock.requests
+        self.assertAlmostEqual((end - start).total_seconds(), _DAYS * 86400, delta=5)
+        self.assertEqual(len(self.bars()), _DAYS - 1)
+        self.assertNotIn('增量', self.out.getvalue())
+
+    def test_incremental_overlaps_watermark(self):
+        first = _Stock([(_midnight(k), 500.0 + k) for k in range(60, 20, -1)])
+        self.backfill(first, since=None)
+        watermark = get_history_watermark(_TICKER)
+        self.assertEqual(watermark, _midnight(21).strftime('%Y-%m-%d'))
+        stored = self.bars()
+
+        # 資料源修改了重疊區間內的價格，並補上一天先前漏掉的日線
+        closes = [(_midnight(k), 900.0 + k) for k in range(60, 0, -1)]
+        missing = _midnight(23).strftime('%Y-%m-%d')
+        self.execute('DELETE FROM price_bars WHERE trade_date = ?', (missing,))
+        stored.pop(missing)
+        second = _Stock(closes)
+        self.backfill(second, since=watermark)
+
+        (start, _), = second.requests
+        self.assertEqual(start, _midnight(21 + WATERMARK_OVERLAP_DAYS))
+        bars = self.bars()
+        # 重疊區間已存的日線不被覆寫；漏掉的那天與水位線之後的新日線補進來
+        for trade_date, price in stored.items():
+            self.assertEqual(bars[trade_date], price)
+        self.assertEqual(bars[missing], 923.0)
+        self.assertEqual([bars[_midnight(k).strftime('%Y-%m-%d')] for k in range(20, 0, -1)],
+                         [900.0 + k for k in range(20, 0, -1)])
+        self.assertIn(f'增量 {21 + WATERMARK_OVERLAP_DAYS}/{_DAYS} 天', self.out.getvalue())
+        self.assertIn('省下約', self.out.getvalue())
+
+    def test_stale_watermark_falls_back_to_full_window(self):
+        stock = _Stock([(_midnight(k), 500.0 + k) for k in range(400, 0, -1)])
+        self.backfill(stock, since=_midnight(_DAYS + 30).strftime('%Y-%m-%d'))
+        (start, end), = stock.requests
+        self.assertAlmostEqual((end - start).total_seconds(), _DAYS * 86400, delta=5)
+        self.assertNotIn('增量', self.out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
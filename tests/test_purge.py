@@ -0,0 +1,67 @@
+"""
+db.crud.purge_archived_tickers：封存股票的日線也要自年度歸檔刪除
+
+執行：python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import stock_config
+from db.connection import close_connection, shared_connection
+from db.crud import purge_archived_tickers
+from db.partitions import archive_path, attach_archive
+
+
+class PurgeArchivesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self._db_path = stock_config.DB_PATH
+        stock_config.DB_PATH = os.path.join(self.tmp.name, 'purge.db')
+        with contextlib.redirect_stdout(io.StringIO()):
+            stock_config.init_database()
+        with shared_connection() as conn:
+            conn.execute("INSERT INTO tickers (ticker, archived_at) VALUES ('1101', '2025-01-01')")
+            conn.execute("INSERT INTO tickers (ticker) VALUES ('2330')")
+            conn.commit()
+            for year in (2021, 2022):
+                with attach_archive(conn, year, readonly=False) as schema:
+                    conn.executemany(
+                        f'INSERT INTO {schema}.stock_history (ticker, trade_date, price) '
+                        'VALUES (?, ?, 10.0)',
+                        [(ticker, f'{year}-0{month}-01')
+                         for ticker in ('1101', '2330') for month in (1, 2, 3)])
+                    conn.commit()
+
+    def tearDown(self):
+        close_connection()
+        stock_config.DB_PATH = self._db_path
+        self.tmp.cleanup()
+
+    def archive_tickers(self, year):
+        with contextlib.closing(sqlite3.connect(archive_path(year))) as conn:
+            return sorted({r[0] for r in conn.execute('SELECT ticker FROM stock_history')})
+
+    def test_purge_deletes_archived_rows(self):
+        result = purge_archived_tickers()
+        self.assertEqual(result['tickers'], ['1101'])
+        self.assertEqual(result['archives'], {2021: 3, 2022: 3})
+        self.assertEqual(result['rows'], 6)
+        self.assertEqual(self.archive_tickers(2021), ['2330'])
+        self.assertEqual(self.archive_tickers(2022), ['2330'])
+        with shared_connection() as conn:
+            self.assertEqual([r[0] for r in conn.execute('SELECT ticker FROM tickers')], ['2330'])
+
+    def test_purge_limited_to_other_tickers_keeps_archives(self):
+        result = purge_archived_tickers(['2330'])
+        self.assertEqual((result['tickers'], result['rows'], result['archives']), ([], 0, {}))
+        self.assertEqual(self.archive_tickers(2021), ['1101', '2330'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+"""
+--quotes-only 的寫入路徑：當日日線沿用最新一筆成功日線的快照，
+pe / pb / 殖利率由 view 依新價格推導
+
+執行：python -m unittest discover -s tests
+"""
+
+import unittest
+
+from _support import TempDatabaseMixin
+from fetchers.price import save_quotes_only
+
+
+class QuotesOnlyTest(TempDatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.execute("INSERT INTO tickers (ticker) VALUES ('2330'), ('1101')")
+        self.execute('''
+            INSERT INTO fundamental_snapshots (ticker_id, kind, available_from, eps, bvps, dividend)
+            SELECT id, 'quarter', '2024-05-15', 32.5, 130.0, 13.0 FROM tickers WHERE ticker = '2330'
+        ''')
+        self.execute('''
+            INSERT INTO fundamental_snapshots (ticker_id, kind, available_from, eps)
+            SELECT id, 'quote', '2024-06-04', 99.0 FROM tickers WHERE ticker = '2330'
+        ''')
+        # 最新一筆成功日線指向季報快照；之後一筆抓取失敗的日線不應被沿用
+        for trade_date, price, error, kind in (('2024-06-03', 800.0, 0, 'quarter'),
+                                                ('2024-06-04', None, 1, 'quote')):
+            self.execute('''
+                INSERT INTO price_bars (ticker_id, trade_date, price, fetch_time, fetch_error,
+                                        snapshot_id)
+                SELECT t.id, ?, ?, ? || ' 13:30:00', ?, s.id
+                FROM tickers t JOIN fundamental_snapshots s ON s.ticker_id = t.id AND s.kind = ?
+                WHERE t.ticker = '2330'
+            ''', (trade_date, price, trade_date, error, kind))
+
+    def bar(self, trade_date):
+        return self.query('''
+            SELECT price, eps, pe, pb, dividend_yield, fetch_error FROM stock_history
+            WHERE ticker = '2330' AND trade_date = ?
+        ''', (trade_date,))
+
+    def test_reuses_latest_ok_snapshot(self):
+        written = save_quotes_only({'2330': ('2024-06-05', 812.5), '1101': ('2024-06-05', 40.0)})
+        # 1101 沒有任何日線：沒有可沿用的快照，不寫入
+        self.assertEqual(written, 1)
+        self.assertEqual(self.bar('2024-06-05'), [(812.5, 32.5, 25.0, 6.25, 1.6, 0)])
+        self.assertEqual(self.query("SELECT COUNT(*) FROM price_bars WHERE ticker_id = "
+                                    "(SELECT id FROM tickers WHERE ticker = '1101')"), [(0,)])
+        self.assertEqual(self.query('SELECT latest_date, latest_ok_date FROM stock_latest '
+                                    "WHERE ticker_id = (SELECT id FROM tickers WHERE ticker = '2330')"),
+                         [('2024-06-05', '2024-06-05')])
+
+    def test_same_day_update_replaces_price_only(self):
+        save_quotes_only({'2330': ('2024-06-05', 812.5)})
+        snapshot = self.query("SELECT snapshot_id FROM price_bars WHERE trade_date = '2024-06-05'")
+        save_quotes_only({'2330': ('2024-06-05', 780.0)})
+        self.assertEqual(self.bar('2024-06-05'), [(780.0, 32.5, 24.0, 6.0, 1.67, 0)])
+        self.assertEqual(
+            self.query("SELECT snapshot_id FROM price_bars WHERE trade_date = '2024-06-05'"),
+            snapshot)
+
+    def test_failed_bar_is_overwritten_by_quote(self):
+        save_quotes_only({'2330': ('2024-06-04', 805.0)})
+        price, eps, *_, error = self.bar('2024-06-04')[0]
+        self.assertEqual((price, error), (805.0, 0))
+        # 失敗列原本的快照保留（不改指向），只更新價格與狀態
+        self.assertEqual(eps, 99.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
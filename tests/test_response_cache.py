@@ -0,0 +1,43 @@
+"""
+fetchers.cache.ResponseCache / CachedTicker
+
+執行：python -m unittest discover -s tests
+"""
+
+import os
+import tempfile
+import unittest
+
+from fetchers.cache import ResponseCache
+
+
+class _Stock:
+    def __init__(self, info):
+        self.info = info
+        self.financials = 'annual'
+
+
+class CachedTickerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = ResponseCache(os.path.join(self.tmp.name, 'cache.db'))
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp.cleanup()
+
+    def test_cached_payload_is_served(self):
+        self.cache.put('2330.TW', 'financials', 'cached annual')
+        stock = self.cache.wrap(_Stock({'price': 1}), '2330.TW')
+        self.assertEqual(stock.financials, 'cached annual')
+
+    def test_prefetched_info_is_not_replaced_by_stale_cache(self):
+        self.cache.put('2330.TW', 'info', {'price': 100})
+        stock = self.cache.wrap(_Stock({'price': 105}), '2330.TW', prefetched=('info',))
+        self.assertEqual(stock.info, {'price': 105})
+        self.assertEqual(self.cache.get('2330.TW', 'info'), (True, {'price': 105}))
+
+
+if __name__ == '__main__':
+    unittest.main()
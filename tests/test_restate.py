@@ -0,0 +1,100 @@
+"""
+transforms.snapshots 的增量修正：快照未變時補進舊缺口的日線也要改指向季報快照
+
+執行：python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import stock_config
+from db.connection import close_connection
+from transforms.snapshots import update_stock_history
+
+_TICKER = '2330'
+
+
+def _snapshot(period_end, available_from, eps):
+    return {
+        'period_end': period_end, 'available_from': available_from, 'trailing_eps': eps,
+        'roe': None, 'de_ratio': None, 'fcf': None, 'bvps': None,
+        'growth_rate': None, 'dividend': None,
+    }
+
+
+_SNAPSHOTS = [
+    _snapshot('2023-12-31', '2024-02-14', 10.0),
+    _snapshot('2024-06-30', '2024-08-14', 12.0),
+]
+
+# 同 fetchers.price.save_historical_prices：新日線先指向當日 quote 快照
+_INSERT_BAR = '''
+INSERT INTO price_bars (ticker_id, trade_date, price, fetch_time, fetch_error, snapshot_id)
+SELECT t.id, ?, 100.0, ?, 0, (
+    SELECT s.id FROM fundamental_snapshots s
+    WHERE s.ticker_id = t.id AND s.kind = 'quote' AND s.available_from = '2025-03-01')
+FROM tickers t WHERE t.ticker = ?
+ON CONFLICT(ticker_id, trade_date) DO NOTHING
+'''
+
+
+class RestateBackfillTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self._db_path = stock_config.DB_PATH
+        stock_config.DB_PATH = os.path.join(self.tmp.name, 'restate.db')
+        self.out = io.StringIO()
+        with contextlib.redirect_stdout(self.out):
+            stock_config.init_database()
+        with contextlib.closing(sqlite3.connect(stock_config.DB_PATH)) as conn, conn:
+            conn.execute("INSERT INTO tickers (ticker, name) VALUES (?, '台積電')", (_TICKER,))
+            conn.execute('''
+                INSERT INTO fundamental_snapshots (ticker_id, kind, available_from, eps)
+                SELECT id, 'quote', '2025-03-01', 99.0 FROM tickers WHERE ticker = ?
+            ''', (_TICKER,))
+            for day in ('2024-09-02', '2025-02-27', '2025-02-28'):
+                self.insert_bar(conn, day)
+
+    def tearDown(self):
+        close_connection()
+        stock_config.DB_PATH = self._db_path
+        self.tmp.cleanup()
+
+    @staticmethod
+    def insert_bar(conn, day):
+        conn.execute(_INSERT_BAR, (day, f'{day} 13:30:00', _TICKER))
+
+    def eps_by_date(self):
+        with contextlib.closing(sqlite3.connect(stock_config.DB_PATH)) as conn:
+            return dict(conn.execute('''
+                SELECT b.trade_date, s.eps FROM price_bars b
+                INNER JOIN fundamental_snapshots s ON s.id = b.snapshot_id
+                ORDER BY b.trade_date
+            ''').fetchall())
+
+    def test_backfilled_bar_before_restated_through_is_repointed(self):
+        update_stock_history(_TICKER, _SNAPSHOTS)
+        self.assertEqual(self.eps_by_date(),
+                         {'2024-09-02': 12.0, '2025-02-27': 12.0, '2025-02-28': 12.0})
+
+        # --full-backfill 補進遠早於 restated_through 的缺口
+        with contextlib.closing(sqlite3.connect(stock_config.DB_PATH)) as conn, conn:
+            self.insert_bar(conn, '2024-06-03')
+        self.assertEqual(self.eps_by_date()['2024-06-03'], 99.0)
+
+        updated, _ = update_stock_history(_TICKER, _SNAPSHOTS)
+        self.assertEqual(updated, 1)
+        self.assertEqual(self.eps_by_date()['2024-06-03'], 10.0)
+
+        # 修正後 restated_through 回到最新交易日，之後只檢查新日線
+        updated, total = update_stock_history(_TICKER, _SNAPSHOTS)
+        self.assertEqual((updated, total), (0, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+集合式修正（update_stock_history）與原本逐列套用 get_applicable_snapshot 的結果相同，
+快照清單增減、數值改變、補進舊日線的增量修正後也一樣
+
+執行：python -m unittest discover -s tests
+"""
+
+import random
+import unittest
+from datetime import date, timedelta
+
+from _support import TempDatabaseMixin
+from transforms.snapshots import get_applicable_snapshot, update_stock_history
+
+_TICKERS = ('2330', '1101')
+
+
+def _reference_row(price, fetch_time, snapshots):
+    """改寫為 SQL 前逐列修正的計算：(eps, pe, pb, roe, 殖利率, D/E, fcf, bvps, 成長率)。"""
+    snapshot = get_applicable_snapshot(fetch_time, snapshots) or snapshots[0]
+    trailing_eps = snapshot['trailing_eps']
+    bvps = snapshot['bvps']
+    pe = (price / trailing_eps) if trailing_eps != 0 else 0
+    pb = (price / bvps) if bvps > 0 else 0
+    dividend_yield = (snapshot['dividend'] / price * 100) if price > 0 else 0
+    return (trailing_eps, round(pe, 2), round(pb, 2), snapshot['roe'], round(dividend_yield, 2),
+            snapshot['de_ratio'], snapshot['fcf'], bvps, snapshot['growth_rate'])
+
+
+def _snapshots(rng, quarter_ends):
+    return [{
+        'period_end': period_end,
+        'available_from': (date.fromisoformat(period_end) + timedelta(days=45)).isoformat(),
+        'trailing_eps': rng.choice([round(rng.uniform(-3, 45), 2), 0]),
+        'bvps': rng.choice([round(rng.uniform(-5, 300), 2), 0]),
+        'roe': round(rng.uniform(-10, 40), 2),
+        'de_ratio': round(rng.uniform(0, 2), 4),
+        'fcf': round(rng.uniform(-1e5, 1e6), 0),
+        'growth_rate': round(rng.uniform(-30, 60), 1),
+        'dividend': rng.choice([0, round(rng.uniform(0, 20), 2)]),
+    } for period_end in quarter_ends]
+
+
+def _quarter_ends(first_year, last_year):
+    return [f'{y}-{md}' for y in range(first_year, last_year + 1)
+            for md in ('03-31', '06-30', '09-30', '12-31')]
+
+
+class SetBasedRestateTest(TempDatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.rng = random.Random(20240610)
+        for ticker in _TICKERS:
+            self.execute('INSERT INTO tickers (ticker) VALUES (?)', (ticker,))
+        self.add_bars(date(2021, 1, 4), date(2024, 6, 28))
+
+    def add_bars(self, start, end, step=3):
+        day = start
+        while day <= end:
+            for ticker in _TICKERS:
+                failed = self.rng.random() < 0.05
+                self.execute('''
+                    INSERT INTO price_bars (ticker_id, trade_date, price, fetch_time, fetch_error)
+                    SELECT id, ?, ?, ? || ' 13:30:00', ? FROM tickers WHERE ticker = ?
+                    ON CONFLICT(ticker_id, trade_date) DO NOTHING
+                ''', (day.isoformat(), None if failed else round(self.rng.uniform(10, 900), 2),
+                      day.isoformat(), int(failed), ticker))
+            day += timedelta(days=step)
+
+    def restate(self, snapshots_by_ticker):
+        for ticker, snapshots in snapshots_by_ticker.items():
+            update_stock_history(ticker, snapshots)
+        for ticker, snapshots in snapshots_by_ticker.items():
+            rows = self.query('''
+                SELECT price, fetch_time, eps, pe, pb, roe, dividend_yield, debt_to_equity,
+                       fcf, bvps, growth_rate
+                FROM stock_history WHERE ticker = ? AND price IS NOT NULL ORDER BY trade_date
+            ''', (ticker,))
+            self.assertTrue(rows)
+            for price, fetch_time, *actual in rows:
+                self.assertEqual(tuple(actual), _reference_row(price, fetch_time, snapshots),
+                                 (ticker, fetch_time))
+
+    def test_matches_per_row_reference(self):
+        quarters = _quarter_ends(2020, 2023)
+        current = {t: _snapshots(self.rng, quarters) for t in _TICKERS}
+        self.restate(current)
+
+        # 新增一季、修改一季的數值
+        current['2330'] = current['2330'] + _snapshots(self.rng, ['2024-03-31'])
+        current['2330'][5] = _snapshots(self.rng, [current['2330'][5]['period_end']])[0]
+        self.restate(current)
+
+        # 最早一季被移除（更早的日線改沿用新的第一季）；另一檔快照不變
+        current['2330'] = current['2330'][1:]
+        self.restate(current)
+
+        # 補進舊缺口的日線（先沒有快照），快照不變也要被修正
+        self.add_bars(date(2021, 1, 5), date(2024, 6, 28), step=7)
+        self.restate(current)
+
+        # 申報延遲改變：全部 available_from 位移
+        for snapshots in current.values():
+            for s in snapshots:
+                s['available_from'] = (date.fromisoformat(s['period_end'])
+                                       + timedelta(days=60)).isoformat()
+        self.restate(current)
+
+
+if __name__ == '__main__':
+    unittest.main()
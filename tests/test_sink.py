@@ -0,0 +1,104 @@
+"""
+db.sink.WriteSink 的失敗處理：回滾、回報與 writer 中止
+
+執行：python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from db.sink import SinkError, WriteSink, end_ticker, run_write, use_sink, write_rows
+
+_INSERT = 'INSERT INTO bars (ticker, day) VALUES (?, ?)'
+
+
+class WriteSinkFailureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, 'sink.db')
+        with contextlib.closing(sqlite3.connect(self.db_path)) as conn:
+            conn.executescript('''
+                CREATE TABLE bars (ticker TEXT NOT NULL, day INTEGER NOT NULL,
+                                   PRIMARY KEY (ticker, day));
+                CREATE TABLE db_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+                INSERT INTO db_meta VALUES ('data_version', 0);
+            ''')
+        self.out = io.StringIO()
+        self._redirect = contextlib.redirect_stdout(self.out)
+        self._redirect.__enter__()
+
+    def tearDown(self):
+        self._redirect.__exit__(None, None, None)
+        self.tmp.cleanup()
+
+    def rows(self):
+        with contextlib.closing(sqlite3.connect(self.db_path)) as conn:
+            return conn.execute('SELECT ticker, day FROM bars ORDER BY 1, 2').fetchall()
+
+    def test_failed_batch_rolls_back_ticker_and_raises_from_end_ticker(self):
+        with WriteSink(self.db_path) as sink, use_sink(sink):
+            write_rows('1111', _INSERT, [('1111', 1)])
+            end_ticker('1111')
+            write_rows('2222', _INSERT, [('2222', 1), ('2222', 2)])
+            write_rows('2222', _INSERT, [('2222', 3), ('2222', 3)])     # 主鍵衝突
+            write_rows('2222', _INSERT, [('2222', 4)])                  # 失敗後捨棄
+            with self.assertRaises(SinkError):
+                end_ticker('2222')
+            write_rows('3333', _INSERT, [('3333', 1)])
+            end_ticker('3333')
+        self.assertEqual(self.rows(), [('1111', 1), ('3333', 1)])
+        self.assertEqual(sink.failures(), ['2222'])
+        self.assertEqual(sink.stats()['dropped'], 1)
+
+    def test_failed_call_reports_ticker(self):
+        def boom(conn):
+            conn.execute(_INSERT, ('4444', 2))
+            raise ValueError('bad payload')
+
+        with WriteSink(self.db_path) as sink, use_sink(sink):
+            write_rows('4444', _INSERT, [('4444', 1)])
+            with self.assertRaises(ValueError):
+                run_write('4444', boom)
+            with self.assertRaises(SinkError):
+                end_ticker('4444')
+        self.assertEqual(self.rows(), [])
+        self.assertEqual(sink.failures(), ['4444'])
+
+    def test_interleaved_tickers_are_rolled_back_together(self):
+        with WriteSink(self.db_path) as sink, use_sink(sink):
+            write_rows('1111', _INSERT, [('1111', 1)])
+            write_rows('2222', _INSERT, [('2222', 1)])
+            write_rows('1111', _INSERT, [('1111', 1)])                  # 主鍵衝突
+            with self.assertRaises(SinkError):
+                end_ticker('1111')
+            with self.assertRaises(SinkError):
+                end_ticker('2222')
+        self.assertEqual(self.rows(), [])
+        self.assertEqual(sink.failures(), ['1111', '2222'])
+
+    def test_dead_writer_fails_producers_instead_of_blocking(self):
+        def die(conn):
+            raise SystemExit('writer killed')
+
+        sink = WriteSink(self.db_path, maxsize=1).start()
+        with use_sink(sink):
+            write_rows('1111', _INSERT, [('1111', 1)])
+            with self.assertRaises(SinkError):
+                run_write('1111', die)
+            with self.assertRaises(SinkError):
+                for day in range(10):                                    # 佇列滿也不阻塞
+                    write_rows('1111', _INSERT, [('1111', day)])
+            with self.assertRaises(SinkError):
+                end_ticker('1111')
+        sink.close()
+        self.assertEqual(self.rows(), [])
+        self.assertEqual(sink.failures(), ['1111'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+"""
+季報快照的輸入來源：下載財報、未到申報期、--restate 三條路徑建出相同的快照，
+路徑交替時日線、快照與匯出檔都不變
+
+執行：python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import os
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+from _support import Frame, Series, TempDatabaseMixin, day
+from db.sink import WriteSink, end_ticker, use_sink
+from exporters import history
+from exporters.history import export_history_json
+from fetchers.fundamentals import save_quarterly_and_fix
+from transforms.snapshots import restate_all_from_db, restate_from_db
+
+_TICKER = '2330'
+_QUARTER_ENDS = ['2021-03-31', '2021-06-30', '2021-09-30', '2021-12-31',
+                 '2022-03-31', '2022-06-30', '2022-09-30', '2022-12-31',
+                 '2023-03-31', '2023-06-30', '2023-09-30', '2023-12-31']
+_STATE_TABLES = ('price_bars', 'fundamental_snapshots', 'snapshot_fingerprints')
+_HISTORY_SQL = '''
+    SELECT ticker, trade_date, eps, pe, pb, roe, dividend_yield, debt_to_equity,
+           fcf, bvps, growth_rate
+    FROM stock_history ORDER BY ticker, trade_date
+'''
+
+
+def _quarter_values(k):
+    """第 k 季的財報數字（帶多位小數，存進 DB 時會被四捨五入）。"""
+    return {
+        'Net Income': 8.123456789e10 * (1 + 0.0371 * k),
+        'Total Revenue': 2.34567891e11 * (1 + 0.0213 * k),
+        'Basic EPS': 3.1415926 + 0.2718281 * k,
+        'Operating Income': 9.87654321e10,
+        'Stockholders Equity': 1.23456789e12 * (1 + 0.011 * k),
+        'Total Debt': 3.21e11,
+        'Total Assets': 2.5e12,
+        'Ordinary Shares Number': 25932733242.0,
+        'Free Cash Flow': 6.54321987e10 * (1 + 0.05 * k),
+    }
+
+
+class _Stock:
+    """只提供 save_quarterly_and_fix 用到的屬性。"""
+
+    def __init__(self, period_ends, scale=1.0):
+        income, balance, cash = {}, {}, {}
+        for period_end in period_ends:
+            col = day(period_end)
+            values = {label: value * scale for label, value
+                      in _quarter_values(_QUARTER_ENDS.index(period_end)).items()}
+            for label in ('Net Income', 'Total Revenue', 'Basic EPS', 'Operating Income'):
+                income.setdefault(label, {})[col] = values[label]
+            for label in ('Stockholders Equity', 'Total Debt', 'Total Assets',
+                          'Ordinary Shares Number'):
+                balance.setdefault(label, {})[col] = values[label]
+            cash.setdefault('Free Cash Flow', {})[col] = values['Free Cash Flow']
+        self.quarterly_financials = Frame(income)
+        self.quarterly_balance_sheet = Frame(balance)
+        self.quarterly_cashflow = Frame(cash)
+        self.dividends = Series([(day('2022-07-14'), 2.75), (day('2023-07-13'), 3.0)])
+
+
+class SnapshotSourceTest(TempDatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.out = io.StringIO()
+        self.add_ticker(_TICKER)
+
+    def add_ticker(self, ticker):
+        self.execute('INSERT INTO tickers (ticker) VALUES (?)', (ticker,))
+        start = day('2021-01-04')
+        for n in range(0, 1200, 7):
+            trade_date = (start + timedelta(days=n)).strftime('%Y-%m-%d')
+            self.execute('''
+                INSERT INTO price_bars (ticker_id, trade_date, price, fetch_time)
+                SELECT id, ?, 500.0 + ?, ? || ' 13:30:00' FROM tickers WHERE ticker = ?
+            ''', (trade_date, n % 37, trade_date, ticker))
+
+    def run_quiet(self, fn, *args):
+        with contextlib.redirect_stdout(self.out):
+            return fn(*args)
+
+    def download(self, period_ends, ticker=_TICKER, scale=1.0):
+        """到申報期：下載最新幾季並修正。"""
+        self.run_quiet(save_quarterly_and_fix, ticker, _Stock(period_ends, scale))
+
+    def export(self):
+        """匯出並回傳個股檔內容（內容未變時不重寫，generatedAt 也不變）。"""
+        with mock.patch.object(history, 'STOCK_LIST', [_TICKER]):
+            self.run_quiet(export_history_json, self.tmp.name)
+        with open(os.path.join(self.tmp.name, 'public', 'history', f'{_TICKER}.json'), 'rb') as f:
+            return f.read()
+
+    def test_due_and_not_due_runs_produce_identical_snapshots(self):
+        # 較早的下載留下前 8 季；之後的下載只回傳最新 8 季
+        self.download(_QUARTER_ENDS[:8])
+        latest = _QUARTER_ENDS[4:]
+
+        self.download(latest)
+        state, exported = self.table_rows(*_STATE_TABLES), self.export()
+        self.assertTrue(all(state.values()))
+
+        self.run_quiet(restate_from_db, _TICKER)                  # 未到申報期
+        self.assertEqual(self.table_rows(*_STATE_TABLES), state)
+        self.assertEqual(self.export(), exported)
+
+        self.download(latest)                                     # 再次到申報期
+        self.assertEqual(self.table_rows(*_STATE_TABLES), state)
+        self.assertEqual(self.export(), exported)
+
+    def test_download_through_sink_reads_its_own_uncommitted_quarters(self):
+        self.download(_QUARTER_ENDS[:8])
+        self.download(_QUARTER_ENDS[4:])
+        expected = self.table_rows(*_STATE_TABLES)
+        self.execute('DELETE FROM fundamentals_history')
+        self.execute('DELETE FROM snapshot_fingerprints')
+
+        # sink 批次內：季報尚未 commit，修正仍須用到本次寫入的季
+        with WriteSink(commit_every=10) as sink, use_sink(sink):
+            self.download(_QUARTER_ENDS[:8])
+            self.download(_QUARTER_ENDS[4:])
+            end_ticker(_TICKER)
+        self.assertEqual(sink.failures(), [])
+        state = self.table_rows(*_STATE_TABLES)
+        self.assertEqual(state['fundamental_snapshots'], expected['fundamental_snapshots'])
+        self.assertEqual(state['price_bars'], expected['price_bars'])
+
+    def download_two_tickers(self):
+        self.add_ticker('2454')
+        self.download(_QUARTER_ENDS[:8])
+        self.download(_QUARTER_ENDS[4:])
+        self.download(_QUARTER_ENDS[2:10], ticker='2454', scale=0.37)
+        self.download(_QUARTER_ENDS[6:], ticker='2454', scale=0.37)
+
+    def test_restate_keeps_what_the_download_path_wrote(self):
+        self.download_two_tickers()
+        state = self.table_rows(*_STATE_TABLES)
+        for tickers in (None, [_TICKER, '2454']):
+            self.assertEqual(self.run_quiet(restate_all_from_db, tickers)[1], 0)
+            self.assertEqual(self.table_rows(*_STATE_TABLES), state)
+
+    def test_restate_from_scratch_matches_download_path(self):
+        self.download_two_tickers()
+        expected = self.query(_HISTORY_SQL)
+        self.execute('UPDATE price_bars SET snapshot_id = NULL')
+        self.execute("DELETE FROM fundamental_snapshots WHERE kind = 'quarter'")
+        self.execute('DELETE FROM snapshot_fingerprints')
+
+        for workers in (1, 2):      # 2：process pool 分批建快照
+            with self.subTest(workers=workers):
+                self.run_quiet(restate_all_from_db, None, workers)
+                self.assertEqual(self.query(_HISTORY_SQL), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
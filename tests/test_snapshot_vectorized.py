@@ -0,0 +1,79 @@
+"""
+build_all_fundamental_snapshots（NumPy）與逐檔 build_fundamental_snapshots 的輸出逐位元相同：
+數值、整數 0 與浮點數的型別、快照指紋都一致
+
+執行：python -m unittest discover -s tests
+"""
+
+import json
+import random
+import unittest
+
+from db.crud import _rows_to_quarters
+from transforms.snapshots import (
+    build_all_fundamental_snapshots,
+    build_fundamental_snapshots,
+    snapshots_fingerprint,
+)
+
+
+def _value(rng, low, high):
+    """fundamentals_history 的欄位：缺值（None / 0）、負值與多位小數都會出現。"""
+    roll = rng.random()
+    if roll < 0.08:
+        return None
+    if roll < 0.12:
+        return 0
+    return round(rng.uniform(low, high), rng.choice([0, 2, 6]))
+
+
+def _stored(rng, n_tickers):
+    stored = {}
+    for k in range(n_tickers):
+        rows = []
+        year = rng.randint(2015, 2020)
+        for q in range(rng.choice([0, 1, 2, 3, 4, 5, 8, 13])):
+            fy, fq = year + q // 4, q % 4 + 1
+            period_end = f'{fy}-{("03-31", "06-30", "09-30", "12-31")[fq - 1]}'
+            rows.append((period_end, fy, fq,
+                         _value(rng, -5, 30), _value(rng, -1e9, 9e10), _value(rng, 0, 3e11),
+                         _value(rng, -1e9, 1e11), _value(rng, -1e10, 2e12),
+                         _value(rng, 0, 1e12), _value(rng, 0, 5e12), _value(rng, 0, 2.6e10),
+                         _value(rng, -5e4, 5e5), _value(rng, 0, 15)))
+        # 季報不一定依期別排序
+        rng.shuffle(rows)
+        stored[f'{1000 + k}'] = _rows_to_quarters(rows)
+    return stored
+
+
+class VectorizedSnapshotsTest(unittest.TestCase):
+
+    def test_matches_per_ticker_builder(self):
+        rng = random.Random(20240612)
+        for _ in range(20):
+            stored = _stored(rng, 30)
+            expected = {ticker: build_fundamental_snapshots(quarters, dividend_data)
+                        for ticker, (quarters, dividend_data) in stored.items() if quarters}
+            actual = build_all_fundamental_snapshots(stored)
+            self.assertEqual(list(actual), list(expected))
+            for ticker, snapshots in expected.items():
+                # json 區分 0 與 0.0，指紋也依此計算
+                self.assertEqual(json.dumps(actual[ticker]), json.dumps(snapshots), ticker)
+                self.assertEqual(snapshots_fingerprint(actual[ticker]),
+                                 snapshots_fingerprint(snapshots))
+
+    def test_all_integer_quarters_keep_int_eps(self):
+        rows = [(f'2023-{md}', 2023, q + 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, None)
+                for q, md in enumerate(('03-31', '06-30', '09-30', '12-31'))]
+        stored = {'2330': _rows_to_quarters(rows), '1101': ([], {})}
+        actual = build_all_fundamental_snapshots(stored)
+        self.assertEqual(list(actual), ['2330'])
+        expected = build_fundamental_snapshots(*stored['2330'])
+        self.assertEqual([type(s['trailing_eps']) for s in actual['2330']],
+                         [type(s['trailing_eps']) for s in expected])
+        self.assertEqual([type(s['trailing_eps']) for s in expected], [int, float, float, int])
+        self.assertEqual(build_all_fundamental_snapshots({}), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+"""
+stock_history view：日線與快照分開存放，pe / pb / 殖利率依各日價格即時推導
+
+執行：python -m unittest discover -s tests
+"""
+
+import unittest
+
+from _support import TempDatabaseMixin
+
+
+def _expected(price, eps, bvps, dividend):
+    """與正規化前寫入寬表時相同的計算（None 表示缺值）。"""
+    if eps is None or price is None:
+        pe = None
+    else:
+        pe = round(price / eps, 2) if eps != 0 else 0
+    if bvps is None or price is None:
+        pb = None
+    else:
+        pb = round(price / bvps, 2) if bvps > 0 else 0
+    dividend_yield = round((dividend or 0) / price * 100, 2) if price and price > 0 else 0
+    return pe, pb, dividend_yield
+
+
+class StockHistoryViewTest(TempDatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.execute("INSERT INTO tickers (id, ticker, name, sector) VALUES (1, '2330', '台積電', '半導體')")
+
+    def add(self, trade_date, price, eps, bvps, dividend, fetch_error=0):
+        self.execute('''
+            INSERT INTO fundamental_snapshots (ticker_id, kind, available_from, eps, bvps, dividend,
+                                               roe, fcf)
+            VALUES (1, 'quote', ?, ?, ?, ?, 25.1, 8.8e5)
+        ''', (trade_date, eps, bvps, dividend))
+        self.execute('''
+            INSERT INTO price_bars (ticker_id, trade_date, price, fetch_time, fetch_error, snapshot_id)
+            VALUES (1, ?, ?, ? || ' 13:30:00', ?,
+                    (SELECT id FROM fundamental_snapshots WHERE available_from = ?))
+        ''', (trade_date, price, trade_date, fetch_error, trade_date))
+
+    def test_derivations(self):
+        cases = [
+            (812.5, 32.5, 130.0, 13.0),
+            (812.5, -4.1, -12.0, None),     # 虧損 / 淨值為負
+            (812.5, 0.0, 0.0, 0.0),         # 分母為 0
+            (812.5, None, None, None),      # 快照缺值
+            (None, 32.5, 130.0, 13.0),      # 抓取失敗列沒有價格
+            (0.07, 3.0, 7.0, 0.2),
+        ]
+        for k, (price, eps, bvps, dividend) in enumerate(cases):
+            self.add(f'2024-06-{k + 1:02d}', price, eps, bvps, dividend)
+        rows = self.query('''
+            SELECT name, sector, price, eps, pe, pb, dividend_yield, roe, fcf, bvps
+            FROM stock_history ORDER BY trade_date
+        ''')
+        self.assertEqual(len(rows), len(cases))
+        for row, (price, eps, bvps, dividend) in zip(rows, cases):
+            self.assertEqual(row, ('台積電', '半導體', price, eps,
+                                   *_expected(price, eps, bvps, dividend), 25.1, 8.8e5, bvps))
+
+    def test_bar_without_snapshot(self):
+        self.execute('''
+            INSERT INTO price_bars (ticker_id, trade_date, price, fetch_time)
+            VALUES (1, '2024-06-03', 800.0, '2024-06-03 13:30:00')
+        ''')
+        self.assertEqual(self.query('SELECT price, eps, pe, pb, dividend_yield FROM stock_history'),
+                         [(800.0, None, None, None, 0)])
+
+    def test_bars_share_one_snapshot(self):
+        self.add('2024-06-03', 800.0, 32.0, 128.0, 12.0)
+        self.execute('''
+            INSERT INTO price_bars (ticker_id, trade_date, price, fetch_time, snapshot_id)
+            SELECT 1, '2024-06-04', 880.0, '2024-06-04 13:30:00', snapshot_id FROM price_bars
+        ''')
+        self.assertEqual(self.query('SELECT COUNT(*) FROM fundamental_snapshots'), [(1,)])
+        self.assertEqual(self.query('SELECT trade_date, pe, pb, dividend_yield FROM stock_history '
+                                    'ORDER BY trade_date'),
+                         [('2024-06-03', 25.0, 6.25, 1.5), ('2024-06-04', 27.5, 6.88, 1.36)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+stock_latest 由 price_bars 的 trigger 維護：任何新增 / 刪除 / 修改後
+都與直接對 price_bars 取 MAX 的結果相同
+
+執行：python -m unittest discover -s tests
+"""
+
+import random
+import unittest
+
+from _support import TempDatabaseMixin
+
+_RECOMPUTE_SQL = '''
+    SELECT ticker_id, MAX(trade_date), MAX(CASE WHEN fetch_error = 0 THEN trade_date END)
+    FROM price_bars GROUP BY ticker_id ORDER BY ticker_id
+'''
+
+
+class StockLatestTriggerTest(TempDatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.execute("INSERT INTO tickers (id, ticker) VALUES (1, '2330'), (2, '1101'), (3, '2317')")
+
+    def insert(self, ticker_id, trade_date, fetch_error=0):
+        self.execute('''
+            INSERT INTO price_bars (ticker_id, trade_date, price, fetch_time, fetch_error)
+            VALUES (?, ?, 100.0, ? || ' 13:30:00', ?)
+        ''', (ticker_id, trade_date, trade_date, fetch_error))
+
+    def latest(self, ticker_id=1):
+        rows = self.query('SELECT latest_date, latest_ok_date FROM stock_latest WHERE ticker_id = ?',
+                          (ticker_id,))
+        return rows[0] if rows else None
+
+    def test_insert_update_delete(self):
+        self.insert(1, '2024-06-03')
+        self.insert(1, '2024-06-04', fetch_error=1)
+        self.assertEqual(self.latest(), ('2024-06-04', '2024-06-03'))
+
+        self.execute("UPDATE price_bars SET fetch_error = 0 WHERE trade_date = '2024-06-04'")
+        self.assertEqual(self.latest(), ('2024-06-04', '2024-06-04'))
+
+        self.execute("DELETE FROM price_bars WHERE trade_date = '2024-06-04'")
+        self.assertEqual(self.latest(), ('2024-06-03', '2024-06-03'))
+
+        # 改 ticker_id：舊、新兩檔都重算
+        self.insert(2, '2024-05-31')
+        self.execute("UPDATE price_bars SET ticker_id = 2 WHERE ticker_id = 1")
+        self.assertIsNone(self.latest(1))
+        self.assertEqual(self.latest(2), ('2024-06-03', '2024-06-03'))
+
+        # 只有失敗列：latest_ok_date 為 NULL；全部刪除後整列移除
+        self.insert(3, '2024-06-03', fetch_error=1)
+        self.assertEqual(self.latest(3), ('2024-06-03', None))
+        self.execute('DELETE FROM price_bars WHERE ticker_id = 3')
+        self.assertIsNone(self.latest(3))
+
+    def test_matches_recompute_after_random_writes(self):
+        rng = random.Random(20240605)
+        days = [f'2024-{m:02d}-{d:02d}' for m in (4, 5, 6) for d in range(1, 29)]
+        for _ in range(300):
+            ticker_id, trade_date = rng.randint(1, 3), rng.choice(days)
+            op = rng.random()
+            if op < 0.5:
+                self.execute('''
+                    INSERT INTO price_bars (ticker_id, trade_date, price, fetch_time, fetch_error)
+                    VALUES (?, ?, 1.0, 'x', ?)
+                    ON CONFLICT(ticker_id, trade_date) DO UPDATE SET fetch_error = excluded.fetch_error
+                ''', (ticker_id, trade_date, int(rng.random() < 0.3)))
+            elif op < 0.7:
+                self.execute('UPDATE price_bars SET fetch_error = 1 - fetch_error '
+                             'WHERE ticker_id = ? AND trade_date = ?', (ticker_id, trade_date))
+            elif op < 0.8:
+                self.execute('UPDATE OR IGNORE price_bars SET trade_date = ? '
+                             'WHERE ticker_id = ? AND trade_date = ?',
+                             (rng.choice(days), ticker_id, trade_date))
+            else:
+                self.execute('DELETE FROM price_bars WHERE ticker_id = ? AND trade_date >= ?',
+                             (ticker_id, trade_date))
+            self.assertEqual(
+                self.query('SELECT ticker_id, latest_date, latest_ok_date FROM stock_latest '
+                           'ORDER BY ticker_id'),
+                self.query(_RECOMPUTE_SQL))
+
+    def test_snapshot_repoint_leaves_latest_untouched(self):
+        self.insert(1, '2024-06-03')
+        self.execute("UPDATE stock_latest SET latest_date = 'sentinel' WHERE ticker_id = 1")
+        # restatement 只改 snapshot_id：trigger 不觸發，不必逐列重算
+        self.execute('UPDATE price_bars SET snapshot_id = 42')
+        self.assertEqual(self.latest(), ('sentinel', '2024-06-03'))
+        self.execute('UPDATE price_bars SET price = 101.0')
+        self.assertEqual(self.latest(), ('sentinel', '2024-06-03'))
+
+
+if __name__ == '__main__':
+    unittest.main()
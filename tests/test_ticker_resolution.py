@@ -0,0 +1,175 @@
+"""
+fetchers.ticker 解析交易所：只有查無此 symbol 才改試下一個後綴；
+節流、斷路器跳脫與查無資料都要回報給 run_pool，不能當成功；
+登錄的交易所在 TTL 內只驗證登錄的 symbol，過期或驗證失敗才重新探測
+
+執行：python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import unittest
+
+from _support import TempDatabaseMixin
+from fetchers.pool import TokenBucket, run_pool
+from fetchers.provider import ProviderError, use_provider
+from fetchers.resilience import CircuitBreaker, ResilientProvider, RetryPolicy
+from fetchers.ticker import TickerNotFoundError, resolve_ticker
+from sync_portfolio import unified_fetch_one
+
+
+class _Ticker:
+    def __init__(self, provider, symbol):
+        self._provider = provider
+        self.symbol = symbol
+
+    @property
+    def info(self):
+        return self._provider.info(self.symbol)
+
+
+class _ThrottlingProvider:
+    """前 throttles 次請求回 429，之後所有 symbol 都查無資料。"""
+
+    def __init__(self, throttles):
+        self.throttles = throttles
+        self.requests = []
+
+    def ticker(self, symbol):
+        return _Ticker(self, symbol)
+
+    def info(self, symbol):
+        self.requests.append(symbol)
+        if len(self.requests) <= self.throttles:
+            raise Exception('HTTP Error 429: Too Many Requests')
+        return {}
+
+
+class _FixedProvider:
+    """每個 symbol 的 info 固定為 responses[symbol]（例外則拋出）。"""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def ticker(self, symbol):
+        return _Ticker(self, symbol)
+
+    def info(self, symbol):
+        self.requests.append(symbol)
+        value = self.responses.get(symbol, {})
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+
+class ResolutionThrottleTest(TempDatabaseMixin, unittest.TestCase):
+
+    def fetch(self, provider, tickers):
+        limiter = TokenBucket(1000, 1)
+        with use_provider(provider), contextlib.redirect_stdout(io.StringIO()):
+            failures, stats = run_pool(tickers, unified_fetch_one, limiter=limiter)
+        return failures, stats, limiter
+
+    def test_throttle_during_resolution_reaches_pool(self):
+        failures, stats, limiter = self.fetch(_ThrottlingProvider(throttles=2), ['1101'])
+        self.assertEqual(limiter.throttle_events, 2)
+        self.assertEqual(stats['throttled'], 2)
+        # 第三次嘗試 .TW / .TWO 都查無資料：記為失敗而非成功
+        self.assertEqual(failures, ['1101'])
+
+    def test_persistent_throttle_is_a_failure(self):
+        provider = _ThrottlingProvider(throttles=100)
+        failures, _, limiter = self.fetch(provider, ['1101'])
+        self.assertEqual(failures, ['1101'])
+        self.assertEqual(limiter.throttle_events, 2)
+        # 429 不會被當成 .TW 查無資料而改試 .TWO
+        self.assertEqual(provider.requests, ['1101.TW'] * 3)
+
+    def test_unresolved_ticker_raises(self):
+        with use_provider(_ThrottlingProvider(throttles=0)), \
+                contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaises(TickerNotFoundError):
+                unified_fetch_one('1101')
+
+
+class ResolutionErrorTest(TempDatabaseMixin, unittest.TestCase):
+
+    def test_missing_symbol_falls_through_to_next_suffix(self):
+        for miss in (Exception('HTTP Error 404: Quote not found for symbol: 6488.TW'),
+                     ProviderError('6488.TW: 查無資料'), {}):
+            provider = _FixedProvider({'6488.TW': miss, '6488.TWO': {'symbol': '6488.TWO'}})
+            with use_provider(provider):
+                _, symbol = resolve_ticker('6488', ttl_days=0)
+            self.assertEqual(symbol, '6488.TWO')
+
+    def test_provider_errors_are_not_misses(self):
+        for error in (KeyError('quoteSummary'), Exception('HTTP Error 401: Unauthorized'),
+                      ConnectionError('connection reset')):
+            provider = _FixedProvider({'6488.TW': error, '6488.TWO': {'symbol': '6488.TWO'}})
+            with use_provider(provider), self.assertRaises(type(error)):
+                resolve_ticker('6488', ttl_days=0)
+            self.assertEqual(provider.requests, ['6488.TW'])
+
+    def test_open_circuit_fails_every_ticker(self):
+        down = ConnectionError('connection reset')
+        inner = _FixedProvider({f'{code}{suffix}': down
+                                for code in ('1101', '1102', '1103') for suffix in ('.TW', '.TWO')})
+        provider = ResilientProvider(inner, policy=RetryPolicy(0), breaker=CircuitBreaker(2))
+        with use_provider(provider), contextlib.redirect_stdout(io.StringIO()):
+            failures, _ = run_pool(['1101', '1102', '1103'], unified_fetch_one)
+        self.assertEqual(failures, ['1101', '1102', '1103'])
+        self.assertTrue(provider.breaker.is_open)
+        # 跳脫後不再對資料源發出請求，也不會改試 .TWO
+        self.assertEqual(inner.requests, ['1101.TW', '1102.TW'])
+        self.assertEqual(provider.stats()['short_circuited'], 1)
+
+
+
+class RegistryTtlTest(TempDatabaseMixin, unittest.TestCase):
+
+    def register(self, days_ago):
+        self.execute('''
+            INSERT INTO tickers (ticker, suffix, exchange, verified_at)
+            VALUES ('6488', '.TWO', 'TPEx', datetime('now', ?))
+        ''', (f'-{days_ago} days',))
+
+    def resolve(self, provider, ttl_days):
+        with use_provider(provider):
+            return resolve_ticker('6488', ttl_days=ttl_days)
+
+    def verified_at(self):
+        return self.query("SELECT suffix, verified_at FROM tickers WHERE ticker = '6488'")[0]
+
+    def test_fresh_entry_probes_only_registered_symbol(self):
+        self.register(days_ago=2)
+        before = self.verified_at()
+        provider = _FixedProvider({'6488.TWO': {'symbol': '6488.TWO'}})
+        _, symbol = self.resolve(provider, ttl_days=30)
+        self.assertEqual(symbol, '6488.TWO')
+        self.assertEqual(provider.requests, ['6488.TWO'])
+        self.assertEqual(self.verified_at(), before)
+
+    def test_expired_entry_is_probed_again(self):
+        self.register(days_ago=2)
+        _, old_verified = self.verified_at()
+        provider = _FixedProvider({'6488.TWO': {'symbol': '6488.TWO'}})
+        _, symbol = self.resolve(provider, ttl_days=1)
+        self.assertEqual(symbol, '6488.TWO')
+        self.assertEqual(provider.requests, ['6488.TW', '6488.TWO'])
+        suffix, verified = self.verified_at()
+        self.assertEqual(suffix, '.TWO')
+        self.assertGreater(verified, old_verified)
+
+    def test_fresh_entry_that_fails_is_replaced(self):
+        # 轉上市：登錄的 .TWO 已無資料，改解析為 .TW
+        self.register(days_ago=2)
+        provider = _FixedProvider({'6488.TW': {'symbol': '6488.TW'}})
+        _, symbol = self.resolve(provider, ttl_days=30)
+        self.assertEqual(symbol, '6488.TW')
+        self.assertEqual(provider.requests, ['6488.TWO', '6488.TW'])
+        self.assertEqual(self.verified_at()[0], '.TW')
+
+
+if __name__ == '__main__':
+    unittest.main()
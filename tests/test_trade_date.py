@@ -0,0 +1,130 @@
+"""
+日線以 (ticker, trade_date) 為鍵：舊寬表遷移時每檔每日只留一筆，
+回填以單一批次 upsert 寫入、已存在的日期直接跳過
+
+執行：python -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+import stock_config
+from _support import PriceHistory, TempDatabaseMixin
+from db.connection import close_connection
+from fetchers import price
+from fetchers.price import save_historical_prices
+
+# 正規化前的寬表 stock_history（沒有 trade_date，以 date(fetch_time) 判斷交易日）
+_LEGACY_SQL = '''
+CREATE TABLE stock_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ticker TEXT NOT NULL,
+    name TEXT,
+    sector TEXT,
+    price REAL,
+    eps REAL,
+    pe REAL,
+    pb REAL,
+    roe REAL,
+    dividend_yield REAL,
+    debt_to_equity REAL,
+    current_ratio REAL,
+    fcf REAL,
+    bvps REAL,
+    growth_rate REAL,
+    fetch_error INTEGER DEFAULT 0,
+    fetch_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+'''
+
+
+class LegacyMigrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self._db_path = stock_config.DB_PATH
+        stock_config.DB_PATH = os.path.join(self.tmp.name, 'legacy.db')
+
+    def tearDown(self):
+        close_connection()
+        stock_config.DB_PATH = self._db_path
+        self.tmp.cleanup()
+
+    def test_one_bar_per_ticker_and_day(self):
+        with contextlib.closing(sqlite3.connect(stock_config.DB_PATH)) as conn, conn:
+            conn.execute(_LEGACY_SQL)
+            conn.executemany('''
+                INSERT INTO stock_history (ticker, name, price, eps, fetch_error, fetch_time)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [
+                ('2330', '台積電', 580.0, 30.0, 0, '2024-05-02 09:10:00'),
+                ('2330', '台積電', 585.0, 30.0, 0, '2024-05-02 13:30:00'),   # 同日較新的成功列勝出
+                ('2330', None, None, None, 1, '2024-05-02 14:00:00'),        # 失敗列不蓋掉成功列
+                ('2330', '台積電', 590.0, 31.0, 0, '2024-05-03 13:30:00'),
+                ('1101', '台泥', 40.0, 2.0, 0, '2024-05-02 13:30:00'),
+            ])
+        with contextlib.redirect_stdout(io.StringIO()):
+            stock_config.init_database()
+
+        with contextlib.closing(sqlite3.connect(stock_config.DB_PATH)) as conn:
+            rows = conn.execute('''
+                SELECT ticker, trade_date, price, eps, fetch_error FROM stock_history
+                ORDER BY ticker, trade_date
+            ''').fetchall()
+            primary_key = [r[1] for r in conn.execute('PRAGMA table_info(price_bars)') if r[5]]
+        self.assertEqual(rows, [
+            ('1101', '2024-05-02', 40.0, 2.0, 0),
+            ('2330', '2024-05-02', 585.0, 30.0, 0),
+            ('2330', '2024-05-03', 590.0, 31.0, 0),
+        ])
+        self.assertEqual(primary_key, ['ticker_id', 'trade_date'])
+
+
+class _Stock:
+    def __init__(self, closes):
+        self.closes = closes
+
+    def history(self, start, end):
+        return PriceHistory(self.closes)
+
+
+class BulkUpsertTest(TempDatabaseMixin, unittest.TestCase):
+
+    def backfill(self, closes):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out), \
+                mock.patch.object(price, 'write_rows', wraps=price.write_rows) as write_rows:
+            save_historical_prices('2330', _Stock(closes), '2330.TW', {'currentPrice': 600.0},
+                                   365)
+        bar_writes = [c for c in write_rows.call_args_list if 'price_bars' in c.args[1]]
+        return out.getvalue(), bar_writes
+
+    def test_whole_frame_in_one_write_and_existing_dates_skipped(self):
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        closes = [(today - timedelta(days=k), 500.0 + k) for k in range(30, 0, -1)]
+
+        log, writes = self.backfill(closes)
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(len(writes[0].args[2]), 30)
+        self.assertIn('30 交易日', log)
+
+        # 資料源價格改變、多一天：已存在的日期不覆寫，只新增那一天
+        log, writes = self.backfill([(d, c + 1) for d, c in closes] + [(today, 999.0)])
+        self.assertEqual(len(writes), 1)
+        self.assertIn('✅  1 交易日', log)
+        bars = dict(self.query('SELECT trade_date, price FROM price_bars'))
+        self.assertEqual(len(bars), 31)
+        for d, c in closes:
+            self.assertEqual(bars[d.strftime('%Y-%m-%d')], c)
+        self.assertEqual(bars[today.strftime('%Y-%m-%d')], 999.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
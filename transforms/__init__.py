@@ -4,12 +4,20 @@ transforms — 資料轉換 / 快照計算模組
 
 from .snapshots import (                  # noqa: F401
     build_fundamental_snapshots,
+    build_all_fundamental_snapshots,
     get_applicable_snapshot,
     update_stock_history,
+    next_fundamentals_due,
+    restate_from_db,
+    restate_all_from_db,
 )
 
 __all__ = [
     'build_fundamental_snapshots',
+    'build_all_fundamental_snapshots',
     'get_applicable_snapshot',
     'update_stock_history',
+    'next_fundamentals_due',
+    'restate_from_db',
+    'restate_all_from_db',
 ]
@@ -3,15 +3,24 @@ transforms.snapshots — 財報快照建立與歷史修正
 
 提供：
   build_fundamental_snapshots — 從季報 list 建立每季基本面快照
+  build_all_fundamental_snapshots — 向量化（NumPy）一次建立全部 ticker 的快照
   get_applicable_snapshot     — 根據 fetch_time 找到適用的快照
-  update_stock_history        — 用快照修正 stock_history 中的財報欄位
+  update_stock_history        — 季報快照寫入 fundamental_snapshots，集合式 UPDATE 改指向適用快照
+  next_fundamentals_due       — 依最新季度推算下一季財報最早可取得日
+  restate_from_db             — 以 DB 已存季報重建快照並修正（不需連網）
+  restate_all_from_db         — 全部 ticker 於單一交易內批次修正（可用 process pool 建快照）
 """
 
-import sqlite3
-import contextlib
+import hashlib
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 
-from stock_config import DB_PATH
+import stock_config
+from db.connection import close_connection
+from db.crud import load_stored_quarters, load_all_stored_quarters, get_latest_period_ends
+from db.sink import run_write
 
 REPORT_DELAY_DAYS = 45
 
@@ -91,6 +100,139 @@ def build_fundamental_snapshots(quarters, dividend_data):
     return snapshots
 
 
+def build_all_fundamental_snapshots(stored):
+    """
+    向量化版 build_fundamental_snapshots：全部 ticker 的季報攤平成 NumPy 陣列，
+    trailing 4Q EPS / 淨利 / FCF、YoY 營收成長、BVPS、ROE、D/E 一次算完。
+
+    輸出與逐檔呼叫 build_fundamental_snapshots 逐位元相同（加總順序、round、
+    整數 0 的型別都一致），兩條路徑產生的快照指紋不會互相觸發重算。
+    numpy 列於 requirements.txt；環境缺少時退回逐檔計算。
+
+    Args:
+        stored: {ticker: (quarters, dividend_data)}，即 load_all_stored_quarters() 的回傳值
+
+    Returns:
+        dict: {ticker: snapshots}（略過沒有季報的 ticker）
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        return {ticker: build_fundamental_snapshots(quarters, dividend_data)
+                for ticker, (quarters, dividend_data) in stored.items() if quarters}
+
+    groups = []
+    rows = []
+    for ticker, (quarters, dividend_data) in stored.items():
+        if quarters:
+            ordered = sorted(quarters, key=lambda x: x['period_end'])
+            groups.append((ticker, len(ordered), dividend_data))
+            rows.extend(ordered)
+    if not rows:
+        return {}
+
+    n = len(rows)
+
+    def column(key):
+        return np.fromiter((r[key] for r in rows), dtype=np.float64, count=n)
+
+    eps, net_income, fcf = column('basic_eps'), column('net_income'), column('fcf')
+    revenue, equity = column('revenue'), column('equity')
+    shares, total_debt = column('shares'), column('total_debt')
+    # 季報缺值還原為整數 0（`or 0`）；全由整數加總的 trailing EPS 在原版仍是 int
+    eps_is_int = np.fromiter((type(r['basic_eps']) is int for r in rows), dtype=bool, count=n)
+
+    counts = np.array([count for _, count, _ in groups])
+    i = np.arange(n) - np.repeat(np.cumsum(counts) - counts, counts)   # 各檔內的季序
+
+    def lag(a, k):
+        out = np.zeros_like(a)
+        out[k:] = a[:-k]
+        return out
+
+    def trailing(a):
+        # 與 sum(a[j] for j in range(...)) 相同的由左至右加總順序（跨檔的 lag 值不會被選到）
+        two = lag(a, 1) + a
+        three = lag(a, 2) + lag(a, 1) + a
+        four = lag(a, 3) + lag(a, 2) + lag(a, 1) + a
+        return np.where(i >= 3, four,
+                        np.where(i == 2, three * (4 / 3), np.where(i == 1, two * (4 / 2), a)))
+
+    trailing_eps = trailing(eps)
+    trailing_net_income = trailing(net_income)
+    trailing_fcf = trailing(fcf)
+    eps_int = np.where(i >= 3, lag(eps_is_int, 3) & lag(eps_is_int, 2)
+                       & lag(eps_is_int, 1) & eps_is_int,
+                       (i == 0) & eps_is_int)
+
+    prev_revenue = lag(revenue, 4)
+    has_equity = equity > 0
+    has_shares = shares > 0
+    has_growth = (i >= 4) & (prev_revenue > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bvps = equity / shares
+        roe = trailing_net_income / equity * 100
+        de_ratio = total_debt / equity
+        growth_rate = (revenue - prev_revenue) / prev_revenue * 100
+    fcf_m = trailing_fcf / 1_000_000
+
+    period_ends = [r['period_end'] for r in rows]
+    available_from = (np.array(period_ends, dtype='datetime64[D]')
+                      + np.timedelta64(REPORT_DELAY_DAYS, 'D')).astype(str).tolist()
+
+    columns = zip(
+        period_ends, available_from,
+        trailing_eps.tolist(), eps_int.tolist(),
+        bvps.tolist(), has_shares.tolist(),
+        roe.tolist(), de_ratio.tolist(), has_equity.tolist(),
+        fcf_m.tolist(), growth_rate.tolist(), has_growth.tolist(),
+        (r['fiscal_year'] for r in rows),
+    )
+    result = {}
+    for ticker, count, dividend_data in groups:
+        snapshots = result[ticker] = []
+        for _ in range(count):
+            (period_end, avail, t_eps, t_eps_int, b, ok_shares, r, de, ok_equity,
+             f, g, ok_growth, fiscal_year) = next(columns)
+            snapshots.append({
+                'period_end': period_end,
+                'available_from': avail,
+                'trailing_eps': int(t_eps) if t_eps_int else round(t_eps, 2),
+                'bvps': round(b, 2) if ok_shares else 0,
+                'roe': round(r, 2) if ok_equity else 0,
+                'de_ratio': round(de, 4) if ok_equity else 0,
+                'fcf': round(f, 0),
+                'dividend': dividend_data.get(fiscal_year, 0),
+                'growth_rate': round(g, 1) if ok_growth else 0,
+            })
+    return result
+
+
+# ─── 下一季財報申報期 ────────────────────────────────────────
+
+def next_fundamentals_due(period_end):
+    """
+    最新季度 period_end 的下一季季底 + REPORT_DELAY_DAYS，
+    在此日期之前不可能有新的季報。
+
+    Args:
+        period_end: 'YYYY-MM-DD'；None 表示尚無季報（立即到期）
+
+    Returns:
+        str | None: 'YYYY-MM-DD'，或 None（立即到期）
+    """
+    if not period_end:
+        return None
+    end = datetime.strptime(period_end[:10], '%Y-%m-%d')
+    # 下一季季底：往後 3 個月的月底
+    month = end.month + 3
+    year = end.year + (month - 1) // 12
+    month = (month - 1) % 12 + 1
+    first_of_following = datetime(year + month // 12, month % 12 + 1, 1)
+    next_quarter_end = first_of_following - timedelta(days=1)
+    return (next_quarter_end + timedelta(days=REPORT_DELAY_DAYS)).strftime('%Y-%m-%d')
+
+
 # ─── 查找適用快照 ────────────────────────────────────────────
 
 def get_applicable_snapshot(fetch_time_str, snapshots):
@@ -104,63 +246,324 @@ def get_applicable_snapshot(fetch_time_str, snapshots):
     return applicable
 
 
-# ─── 修正 stock_history ──────────────────────────────────────
+# ─── 修正 stock_history（集合式 SQL）──────────────────────────
+
+# 日線回填會往水位線前重抓的天數（同 fetchers.price.WATERMARK_OVERLAP_DAYS），
+# 快照未變時從 restated_through 往前這麼多天開始檢查，涵蓋補進來的缺口日線
+RESTATE_OVERLAP_DAYS = 7
+
+# 本次修正的季報快照先載入 temp 表，再以單一 UPDATE ... FROM 依 as-of 區間套用
+# （逐句 execute：executescript 會先 COMMIT，打斷 sink 的批次交易）
+_RESTATE_TEMP_SQL = ('''
+CREATE TEMP TABLE IF NOT EXISTS _restate_snapshots (
+    ticker_id INTEGER NOT NULL,
+    period_end TEXT,
+    available_from TEXT NOT NULL,
+    eps REAL, roe REAL, debt_to_equity REAL, current_ratio REAL, fcf REAL,
+    bvps REAL, growth_rate REAL, dividend REAL,
+    PRIMARY KEY (ticker_id, available_from)
+) WITHOUT ROWID
+''', '''
+CREATE TEMP TABLE IF NOT EXISTS _restate_tickers (
+    ticker_id INTEGER PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    changed INTEGER NOT NULL DEFAULT 1,
+    scan_from TEXT NOT NULL DEFAULT ''
+)
+''', 'DELETE FROM _restate_snapshots', 'DELETE FROM _restate_tickers',
+    'DROP TABLE IF EXISTS _restate_ranges')
+
+_LOAD_TICKER_SQL = '''
+INSERT OR REPLACE INTO _restate_tickers (ticker_id, fingerprint)
+SELECT t.id, ? FROM tickers t WHERE t.ticker = ?
+'''
+
+# 同 available_from 以後者為準（與 get_applicable_snapshot 取最後一筆一致）
+_LOAD_RESTATE_SQL = '''
+INSERT OR REPLACE INTO _restate_snapshots
+(ticker_id, period_end, available_from, eps, roe, debt_to_equity, fcf, bvps, growth_rate, dividend)
+SELECT t.id, ?, ?, ?, ?, ?, ?, ?, ?, ? FROM tickers t WHERE t.ticker = ?
+'''
+
+# 指紋相同 → 快照不變；預設只檢查上次修正後（含回填重疊天數）新增的日線，
+# 從未修正過的 ticker 由頭檢查；補進更早缺口的日線會由 trigger 把 restated_through
+# 退回該日（stock_config._create_fingerprint_triggers）
+_MARK_UNCHANGED_SQL = f'''
+UPDATE _restate_tickers SET
+    changed = fingerprint IS NOT (
+        SELECT f.fingerprint FROM snapshot_fingerprints f
+        WHERE f.ticker_id = _restate_tickers.ticker_id),
+    scan_from = COALESCE((
+        SELECT date(f.restated_through, '-{RESTATE_OVERLAP_DAYS} days') FROM snapshot_fingerprints f
+        WHERE f.ticker_id = _restate_tickers.ticker_id), '')
+'''
+
+# 快照清單有增減時，從最早增減的 available_from 起重新指向；
+# 增減的是最早一季時，更早的日線（沿用第一季）也要重算
+_MARK_CHANGED_FROM_SQL = '''
+UPDATE _restate_tickers SET scan_from = CASE
+    WHEN d.first_changed <= d.first_any THEN ''
+    ELSE MIN(scan_from, d.first_changed) END
+FROM (
+    SELECT k.ticker_id,
+        (SELECT MIN(a) FROM (
+            SELECT r.available_from AS a FROM _restate_snapshots r
+            WHERE r.ticker_id = k.ticker_id AND NOT EXISTS (
+                SELECT 1 FROM fundamental_snapshots s
+                WHERE s.ticker_id = r.ticker_id AND s.kind = 'quarter'
+                  AND s.available_from = r.available_from)
+            UNION ALL
+            SELECT s.available_from FROM fundamental_snapshots s
+            WHERE s.ticker_id = k.ticker_id AND s.kind = 'quarter' AND NOT EXISTS (
+                SELECT 1 FROM _restate_snapshots r
+                WHERE r.ticker_id = s.ticker_id AND r.available_from = s.available_from)
+        )) AS first_changed,
+        MIN(
+            (SELECT MIN(available_from) FROM _restate_snapshots WHERE ticker_id = k.ticker_id),
+            COALESCE((SELECT MIN(available_from) FROM fundamental_snapshots
+                      WHERE ticker_id = k.ticker_id AND kind = 'quarter'), '9999-12-31')
+        ) AS first_any
+    FROM _restate_tickers k WHERE k.changed
+) AS d
+WHERE _restate_tickers.ticker_id = d.ticker_id AND d.first_changed IS NOT NULL
+'''
+
+# 季報不含流動比率，沿用各股最新一筆 info 快照的值
+_FILL_CURRENT_RATIO_SQL = '''
+UPDATE _restate_snapshots SET current_ratio = (
+    SELECT f.current_ratio FROM fundamental_snapshots f
+    WHERE f.ticker_id = _restate_snapshots.ticker_id AND f.kind != 'quarter'
+      AND f.current_ratio IS NOT NULL
+    ORDER BY f.available_from DESC LIMIT 1)
+WHERE ticker_id IN (SELECT ticker_id FROM _restate_tickers WHERE changed)
+'''
+
+# 只 upsert 內容有變的快照（既有快照的 id 不變，指向它的日線免改寫）
+_UPSERT_QUARTERS_SQL = '''
+INSERT INTO fundamental_snapshots
+(ticker_id, kind, period_end, available_from, eps, roe, debt_to_equity,
+ current_ratio, fcf, bvps, growth_rate, dividend)
+SELECT r.ticker_id, 'quarter', r.period_end, r.available_from, r.eps, r.roe, r.debt_to_equity,
+       r.current_ratio, r.fcf, r.bvps, r.growth_rate, r.dividend
+FROM _restate_snapshots r
+INNER JOIN _restate_tickers k ON k.ticker_id = r.ticker_id AND k.changed
+WHERE NOT EXISTS (
+    SELECT 1 FROM fundamental_snapshots s
+    WHERE s.ticker_id = r.ticker_id AND s.kind = 'quarter' AND s.available_from = r.available_from
+      AND s.period_end IS r.period_end AND s.eps IS r.eps AND s.roe IS r.roe
+      AND s.debt_to_equity IS r.debt_to_equity AND s.current_ratio IS r.current_ratio
+      AND s.fcf IS r.fcf AND s.bvps IS r.bvps AND s.growth_rate IS r.growth_rate
+      AND s.dividend IS r.dividend)
+ON CONFLICT(ticker_id, kind, available_from) DO UPDATE SET
+    period_end = excluded.period_end,
+    eps = excluded.eps,
+    roe = excluded.roe,
+    debt_to_equity = excluded.debt_to_equity,
+    current_ratio = excluded.current_ratio,
+    fcf = excluded.fcf,
+    bvps = excluded.bvps,
+    growth_rate = excluded.growth_rate,
+    dividend = excluded.dividend
+'''
+
+# as-of 區間：每個快照適用 [valid_from, valid_to)，第一季往前涵蓋更早的日線；
+# 區間再裁切到 scan_from 之後，只掃描需要檢查的日線
+_RESTATE_RANGES_SQL = '''
+CREATE TEMP TABLE _restate_ranges AS
+SELECT ticker_id, id, MAX(valid_from, scan_from) AS valid_from, valid_to FROM (
+    SELECT s.ticker_id, s.id, k.scan_from,
+           CASE WHEN ROW_NUMBER() OVER w = 1 THEN '' ELSE s.available_from END AS valid_from,
+           COALESCE(LEAD(s.available_from) OVER w, '9999-12-31') AS valid_to
+    FROM _restate_snapshots r
+    INNER JOIN _restate_tickers k ON k.ticker_id = r.ticker_id
+    INNER JOIN fundamental_snapshots s
+        ON s.ticker_id = r.ticker_id AND s.kind = 'quarter' AND s.available_from = r.available_from
+    WINDOW w AS (PARTITION BY s.ticker_id ORDER BY s.available_from)
+) WHERE valid_to > scan_from
+'''
+
+# 由快照區間驅動、以主鍵範圍掃描日線；只 UPDATE 指向改變的列
+_APPLY_RESTATE_SQL = '''
+UPDATE price_bars SET snapshot_id = m.id
+FROM _restate_ranges AS m
+WHERE price_bars.ticker_id = m.ticker_id
+  AND price_bars.trade_date >= m.valid_from AND price_bars.trade_date < m.valid_to
+  AND price_bars.price IS NOT NULL
+  AND price_bars.snapshot_id IS NOT m.id
+'''
+
+_COUNT_SCANNED_SQL = '''
+SELECT COUNT(*) FROM _restate_tickers k
+INNER JOIN price_bars b ON b.ticker_id = k.ticker_id AND b.trade_date >= k.scan_from
+'''
+
+# 日線已改指向新清單，不在清單內的舊季報快照不再被參照
+_DROP_STALE_SQL = '''
+DELETE FROM fundamental_snapshots
+WHERE kind = 'quarter'
+  AND ticker_id IN (SELECT ticker_id FROM _restate_tickers WHERE changed)
+  AND NOT EXISTS (
+      SELECT 1 FROM _restate_snapshots r
+      WHERE r.ticker_id = fundamental_snapshots.ticker_id
+        AND r.available_from = fundamental_snapshots.available_from)
+'''
+
+# 指紋與最新成功交易日未變時不寫入
+_SAVE_FINGERPRINTS_SQL = '''
+INSERT INTO snapshot_fingerprints (ticker_id, fingerprint, restated_through, restated_at)
+SELECT k.ticker_id, k.fingerprint, l.latest_ok_date, datetime('now')
+FROM _restate_tickers k LEFT JOIN stock_latest l ON l.ticker_id = k.ticker_id
+WHERE true
+ON CONFLICT(ticker_id) DO UPDATE SET
+    fingerprint = excluded.fingerprint,
+    restated_through = excluded.restated_through,
+    restated_at = excluded.restated_at
+WHERE fingerprint IS NOT excluded.fingerprint
+   OR restated_through IS NOT excluded.restated_through
+'''
+
+
+def snapshots_fingerprint(snapshots):
+    """季報快照清單的指紋（內容或 available_from 有任何改變都會不同）。"""
+    payload = json.dumps(snapshots, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _apply_snapshots(conn, snapshots_by_ticker):
+    """
+    在同一交易內把多支 ticker 的季報快照套用到日線。
+
+    與上次套用的指紋相同時只檢查之後新增的日線；清單有增減時從
+    最早改變的 available_from 起重新指向；只有數值改變時就地更新快照，
+    日線不必改寫。
+
+    Args:
+        conn: 寫入連線
+        snapshots_by_ticker: {ticker: build_fundamental_snapshots() 的回傳值}
+
+    Returns:
+        tuple: (updated, total)，total 為實際檢查的日線筆數
+    """
+    cursor = conn.cursor()
+    for sql in _RESTATE_TEMP_SQL:
+        cursor.execute(sql)
+    cursor.executemany(_LOAD_TICKER_SQL, [
+        (snapshots_fingerprint(snapshots), ticker)
+        for ticker, snapshots in snapshots_by_ticker.items()])
+    cursor.executemany(_LOAD_RESTATE_SQL, [(
+        s['period_end'], s['available_from'], s['trailing_eps'], s['roe'], s['de_ratio'],
+        s['fcf'], s['bvps'], s['growth_rate'], s['dividend'], ticker,
+    ) for ticker, snapshots in snapshots_by_ticker.items() for s in snapshots])
+
+    cursor.execute(_MARK_UNCHANGED_SQL)
+    cursor.execute(_MARK_CHANGED_FROM_SQL)
+    cursor.execute(_FILL_CURRENT_RATIO_SQL)
+    cursor.execute(_UPSERT_QUARTERS_SQL)
+    cursor.execute(_RESTATE_RANGES_SQL)
+    updated = cursor.execute(_APPLY_RESTATE_SQL).rowcount
+    total = cursor.execute(_COUNT_SCANNED_SQL).fetchone()[0]
+    cursor.execute(_DROP_STALE_SQL)
+    cursor.execute(_SAVE_FINGERPRINTS_SQL)
+    cursor.execute('DROP TABLE _restate_ranges')
+    return updated, total
+
 
 def update_stock_history(ticker_code, snapshots):
     """
-    用快照修正 stock_history 中指定 ticker 的所有紀錄。
+    用快照修正指定 ticker 的日線：季報快照 upsert 進 fundamental_snapshots
+    （kind='quarter'），再以單一 UPDATE ... FROM 把日線的 snapshot_id 指向適用快照。
+    與上次套用的快照指紋比對，只檢查可能改變的日線、只寫入指向改變的列；
+    pe / pb / 殖利率由 stock_history view 推導。
+    於寫入連線上執行，啟用 sink 時會排在同支 ticker 先前的寫入之後。
 
     Args:
         ticker_code: 台股代碼
         snapshots: build_fundamental_snapshots() 的回傳值
 
     Returns:
-        tuple: (updated, total)
+        tuple: (updated, total)，total 為實際檢查的日線筆數
+    """
+    if not snapshots:
+        return 0, 0
+    return run_write(ticker_code, lambda conn: _apply_snapshots(conn, {ticker_code: snapshots}))
+
+
+# ─── 以 DB 季報修正 ──────────────────────────────────────────
+
+def _restate_stored(conn, ticker_code):
+    quarters, dividend_data = load_stored_quarters(ticker_code, conn)
+    if not quarters:
+        return 0, 0, 0
+    snapshots = build_fundamental_snapshots(quarters, dividend_data)
+    updated, total = _apply_snapshots(conn, {ticker_code: snapshots})
+    return len(quarters), updated, total
+
+
+def restate_from_db(ticker_code):
+    """
+    從 fundamentals_history 重建快照並修正日線（不下載財報）。
+
+    快照一律由 DB 已存的完整季報建立：下載財報（save_quarterly_and_fix）、
+    未到申報期與 --restate 三條路徑的輸入相同，指紋不會因路徑交替而改變。
+    讀取與套用都在寫入連線上執行，看得到同支 ticker 稍早排入 sink 的季報。
+
+    Returns:
+        tuple: (quarters, updated, total)
+    """
+    return run_write(ticker_code, lambda conn: _restate_stored(conn, ticker_code))
+
+
+# 每個 worker 分到的 ticker 批數（批次小一點，快慢不一的 worker 較平均）
+_CHUNKS_PER_WORKER = 4
+
+
+def _init_worker(db_path):
+    """process pool initializer：spawn 子行程重新 import stock_config，沿用父行程的 DB_PATH。"""
+    stock_config.DB_PATH = db_path
+
+
+def _build_from_db(tickers):
+    """process pool worker：以本行程自己的連線讀季報並建立快照。"""
+    try:
+        return build_all_fundamental_snapshots(load_all_stored_quarters(tickers))
+    finally:
+        close_connection()
+
+
+def _build_in_pool(tickers, workers):
+    """把 tickers 切批交給 process pool 建快照，回傳合併後的 {ticker: snapshots}。"""
+    size = max(1, -(-len(tickers) // (workers * _CHUNKS_PER_WORKER)))
+    chunks = [tickers[k:k + size] for k in range(0, len(tickers), size)]
+    # spawn：子行程重新 import，不會沿用父行程（執行緒區域）的 SQLite 連線
+    context = multiprocessing.get_context('spawn')
+    snapshots_by_ticker = {}
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=context,
+                             initializer=_init_worker,
+                             initargs=(stock_config.DB_PATH,)) as pool:
+        for part in pool.map(_build_from_db, chunks):
+            snapshots_by_ticker.update(part)
+    return snapshots_by_ticker
+
+
+def restate_all_from_db(tickers=None, workers=1):
+    """
+    以 fundamentals_history 一次重建全部未封存（或指定 tickers）的快照，
+    並在單一交易中以集合式 UPDATE 修正所有日線。完全不連網。
+
+    workers > 1 時讀季報與建快照依 ticker 分批交給 process pool（各自開連線），
+    寫入仍由本行程的單一交易完成。
+    輸入與下載財報路徑相同（DB 已存的完整季報），修正結果不會被下一次下載改回。
+
+    Returns:
+        tuple: (tickers, updated, total)
     """
-    with contextlib.closing(sqlite3.connect(DB_PATH)) as conn:
-        cursor = conn.cursor()
-
-        cursor.execute('''
-        SELECT id, fetch_time, price FROM stock_history
-        WHERE ticker = ? ORDER BY fetch_time
-        ''', (ticker_code,))
-        records = cursor.fetchall()
-
-        updated = 0
-        for row_id, fetch_time, price in records:
-            if price is None:
-                continue
-            snapshot = get_applicable_snapshot(fetch_time, snapshots)
-            if snapshot is None:
-                snapshot = snapshots[0] if snapshots else None
-                if snapshot is None:
-                    continue
-
-            trailing_eps = snapshot['trailing_eps']
-            bvps = snapshot['bvps']
-            pe = (price / trailing_eps) if trailing_eps != 0 else 0
-            pb = (price / bvps) if bvps > 0 else 0
-            dividend_yield = (snapshot['dividend'] / price * 100) if price > 0 else 0
-
-            cursor.execute('''
-            UPDATE stock_history SET
-                eps = ?, pe = ?, pb = ?, roe = ?,
-                dividend_yield = ?, debt_to_equity = ?,
-                fcf = ?, bvps = ?, growth_rate = ?
-            WHERE id = ?
-            ''', (
-                trailing_eps,
-                round(pe, 2),
-                round(pb, 2),
-                snapshot['roe'],
-                round(dividend_yield, 2),
-                snapshot['de_ratio'],
-                snapshot['fcf'],
-                bvps,
-                snapshot['growth_rate'],
-                row_id
-            ))
-            updated += 1
-
-        conn.commit()
-    return updated, len(records)
+    if tickers is None:
+        tickers = get_latest_period_ends()   # 未封存且有季報的 ticker
+    if workers > 1:
+        snapshots_by_ticker = _build_in_pool(sorted(tickers), workers) if tickers else {}
+    else:
+        snapshots_by_ticker = build_all_fundamental_snapshots(load_all_stored_quarters(tickers))
+    if not snapshots_by_ticker:
+        return 0, 0, 0
+    updated, total = run_write('restate', lambda conn: _apply_snapshots(conn, snapshots_by_ticker))
+    return len(snapshots_by_ticker), updated, total
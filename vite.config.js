@@ -111,6 +111,7 @@ export default defineConfig({
               } else {
                 if (parsed.refresh) flags.push('--refresh')
                 if (parsed.regenOnly) flags.push('--regen-only')
+                if (parsed.quotesOnly) flags.push('--quotes-only')
               }
             } catch {
               res.writeHead(400, { 'Content-Type': 'application/json' })